@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# bench_ntfs.py
+# Mục đích: benchmark lặp lại được cho các hàm quét/khôi phục trên ảnh NTFS tổng hợp.
+# Mỗi giai đoạn chạy trong một tiến trình con riêng để đo được peak RSS của riêng nó.
+# Kết quả (records/s, MB/s, peak RSS) được so với baseline lưu trong bench_baselines.json.
+# Thông lượng tuyệt đối phụ thuộc máy, nên mỗi lần đo còn chạy xen kẽ một phép tham chiếu trong
+# cùng tiến trình: vòng lặp Python thuần cho giai đoạn nặng CPU, đọc tuần tự cả ảnh cho giai đoạn
+# nặng I/O. Baseline lưu tỉ lệ thông lượng giai đoạn / tham chiếu; chỉ tỉ lệ và peak RSS được so.
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows không có module resource
+    resource = None
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baselines.json")
+MIN_SECONDS = 0.25   # Thời gian đo tối thiểu của một giai đoạn (gọi lại giai đoạn nếu ngắn hơn)
+
+# Cấu hình ảnh cho từng preset (tham số của ntfs_image_gen.build_image)
+PRESETS = {
+    "mbr-basic": {"size_mb": 128, "scheme": "mbr", "records": 4000, "compressed_ratio": 0.02,
+                  "seed": 1},
+    "gpt-mixed": {"size_mb": 256, "scheme": "gpt", "records": 4000, "fragmentation": 0.5,
+                  "sparse_ratio": 0.1, "compressed_ratio": 0.1, "seed": 2},
+}
+
+
+# --- PHÉP THAM CHIẾU ---
+# Cùng dạng kết quả với giai đoạn: (items, bytes, seconds).
+
+def reference_python_loop(manifest):
+    """Tham chiếu CPU: cộng từng byte của 1 MiB bằng vòng lặp Python (bám theo tốc độ interpreter)."""
+    data = bytes(range(256)) * 4096
+    total = 0
+    start = time.perf_counter()
+    for b in data:
+        total += b
+    elapsed = time.perf_counter() - start
+    return 1, len(data), elapsed
+
+def reference_seq_read(manifest):
+    """Tham chiếu I/O: đọc tuần tự cả ảnh (đã nằm trong page cache sau lượt đọc làm nóng)."""
+    with open(manifest["image"], "rb") as f:
+        while f.read(1024 * 1024):
+            pass
+        f.seek(0)
+        blocks = 0
+        start = time.perf_counter()
+        while f.read(1024 * 1024):
+            blocks += 1
+        elapsed = time.perf_counter() - start
+    return blocks, manifest["image_size"], elapsed
+
+REFERENCES = {"cpu": reference_python_loop, "io": reference_seq_read}
+
+
+# --- CÁC GIAI ĐOẠN ---
+# Mỗi hàm nhận manifest, tự bấm giờ phần cần đo và trả về (items, bytes, seconds).
+
+def phase_scan_boot(manifest):
+    import partition
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        candidates = partition.scan_image_for_ntfs(manifest["image"])
+    elapsed = time.perf_counter() - start
+    sectors = manifest["image_size"] // partition.SECTOR_SIZE
+    if not candidates:
+        raise RuntimeError("scan_image_for_ntfs không tìm thấy boot sector")
+    return sectors, manifest["image_size"], elapsed
+
+def phase_read_mft(manifest):
+    import recovery_ntfs
+    mft_offset = manifest["partition_offset"] + manifest["mft_lcn"] * manifest["bytes_per_cluster"]
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = recovery_ntfs.read_mft_records(manifest["image"], mft_offset,
+                                                   manifest["record_size"], manifest["records"],
+                                                   os.path.join(tmp, "mft_list.txt"))
+        elapsed = time.perf_counter() - start
+    if len(found) != manifest["records"]:
+        raise RuntimeError(f"read_mft_records trả về {len(found)}/{manifest['records']} record")
+    return manifest["records"], manifest["records"] * manifest["record_size"], elapsed
+
+def phase_parse_data(manifest):
+    import recovery_ntfs
+    record_size = manifest["record_size"]
+    mft_offset = manifest["partition_offset"] + manifest["mft_lcn"] * manifest["bytes_per_cluster"]
+    with open(manifest["image"], "rb") as f:
+        f.seek(mft_offset)
+        mft = f.read(manifest["records"] * record_size)
+    records = [mft[i:i + record_size] for i in range(0, len(mft), record_size)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for record in records:
+            recovery_ntfs.parse_data_attribute(record)
+    elapsed = time.perf_counter() - start
+    return len(records), len(mft), elapsed
+
+def phase_read_clusters(manifest):
+    import recovery_ntfs
+    cluster = manifest["bytes_per_cluster"]
+    # read_clusters tính LCN từ đầu thiết bị nên cộng thêm offset phân vùng
+    base_lcn = manifest["partition_offset"] // cluster
+    jobs = [[(lcn + base_lcn, count) for lcn, count in f["runs"] if lcn is not None]
+            for f in manifest["files"] if f["runs"]]
+    total = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for runs in jobs:
+            total += len(recovery_ntfs.read_clusters(manifest["image"], runs, cluster))
+    elapsed = time.perf_counter() - start
+    return len(jobs), total, elapsed
+
+def phase_lznt1_decompress(manifest):
+    from ntfs_lznt1 import assemble_compressed, split_compression_units
+    cluster = manifest["bytes_per_cluster"]
+    jobs = []
+    with open(manifest["image"], "rb") as f:
+        for entry in manifest["files"]:
+            if entry["kind"] != "compressed":
+                continue
+            units = split_compression_units([tuple(run) for run in entry["runs"]], 16)
+            unit_data = []
+            for _, extents, _ in units:
+                parts = []
+                for lcn, count in extents:
+                    f.seek(manifest["partition_offset"] + lcn * cluster)
+                    parts.append(f.read(count * cluster))
+                unit_data.append(b"".join(parts))
+            jobs.append((units, unit_data, entry["size"]))
+    total = 0
+    start = time.perf_counter()
+    for units, unit_data, size in jobs:
+        total += len(assemble_compressed(units, unit_data, cluster, size))
+    elapsed = time.perf_counter() - start
+    return len(jobs), total, elapsed
+
+def _drop_page_cache(path):
+    """Bỏ ảnh khỏi page cache (nếu hệ điều hành hỗ trợ) để đo tốc độ thiết bị thật."""
+    if not hasattr(os, "posix_fadvise"):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def _phase_pread(manifest, depth):
+    from ntfs_prefetch import PrefetchReader
+    path = manifest.get("pread_image") or manifest["image"]
+    _drop_page_cache(path)
+    total = 0
+    blocks = 0
+    with PrefetchReader(path, depth=depth, window=128 * 1024) as reader:
+        start = time.perf_counter()
+        for _, data in reader.iter_blocks(0, manifest.get("pread_bytes")):
+            total += len(data)
+            blocks += 1
+        elapsed = time.perf_counter() - start
+    return blocks, total, elapsed
+
+def phase_pread_qd1(manifest):
+    return _phase_pread(manifest, 1)
+
+def phase_pread_qd32(manifest):
+    return _phase_pread(manifest, 32)
+
+# Tên giai đoạn -> (hàm đo, phép tham chiếu trong REFERENCES)
+PHASES = {
+    "scan_boot": (phase_scan_boot, "cpu"),
+    "read_mft": (phase_read_mft, "cpu"),
+    "parse_data": (phase_parse_data, "cpu"),
+    "read_clusters": (phase_read_clusters, "io"),
+    "lznt1_decompress": (phase_lznt1_decompress, "cpu"),
+    "pread_qd1": (phase_pread_qd1, "io"),
+    "pread_qd32": (phase_pread_qd32, "io"),
+}
+# Thông lượng pread phụ thuộc thiết bị và page cache chứ không phụ thuộc code: ảnh tổng hợp vài
+# trăm MB nằm sẵn trong page cache (posix_fadvise không bỏ được cache của hypervisor/tmpfs), khi đó
+# QD32 chỉ thêm chi phí thread và chậm hơn QD1. Hai giai đoạn này chỉ chạy khi được yêu cầu
+# (--pread-image hoặc --phase), chỉ in kết quả, không lưu/so với baseline.
+PREAD_PHASES = ("pread_qd1", "pread_qd32")
+
+
+# --- CHẠY BENCHMARK ---
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def _run_phase(name, manifest):
+    measure, reference = PHASES[name]
+    items = nbytes = elapsed = ref_bytes = ref_seconds = 0
+    # Gọi xen kẽ tham chiếu và giai đoạn tới khi đủ MIN_SECONDS: tốc độ máy (nhất là máy ảo)
+    # dao động theo từng phần giây, tham chiếu phải đo sát giai đoạn mới bù được
+    while True:
+        _, done_bytes, done_seconds = REFERENCES[reference](manifest)
+        ref_bytes += done_bytes
+        ref_seconds += done_seconds
+        if elapsed >= MIN_SECONDS:
+            break
+        done_items, done_bytes, done_seconds = measure(manifest)
+        if not done_items:
+            # Giai đoạn không có việc gì để đo thì số liệu vô nghĩa: preset phải có dữ liệu cho nó
+            raise RuntimeError(f"Giai đoạn {name} không có dữ liệu để đo (preset thiếu loại file tương ứng)")
+        items += done_items
+        nbytes += done_bytes
+        elapsed += done_seconds
+    return {"items": items, "bytes": nbytes, "seconds": elapsed, "peak_rss_kb": _peak_rss_kb(),
+            "reference_mb_per_s": ref_bytes / max(ref_seconds, 1e-9) / 1e6}
+
+def run_phase_isolated(name, manifest):
+    """Chạy một giai đoạn trong tiến trình con mới (spawn) để peak RSS không bị cộng dồn."""
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(_run_phase, name, manifest).result()
+
+def run_preset(name, workdir, repeat, phases, pread_image=None, pread_bytes=None):
+    import ntfs_image_gen
+    image = os.path.join(workdir, f"{name}.img")
+    manifest = ntfs_image_gen.build_image(image, **PRESETS[name])
+    manifest.update(pread_image=pread_image, pread_bytes=pread_bytes)
+    results = {}
+    for phase in phases:
+        runs = [run_phase_isolated(phase, manifest) for _ in range(repeat)]
+        for r in runs:
+            r["ratio"] = r["bytes"] / max(r["seconds"], 1e-9) / 1e6 / r["reference_mb_per_s"]
+        # Lấy lần có tỉ lệ trung vị: lần nhanh nhất hay rơi vào lúc máy rảnh bất thường
+        median = sorted(runs, key=lambda r: r["ratio"])[len(runs) // 2]
+        seconds = max(median["seconds"], 1e-9)
+        rss = [r["peak_rss_kb"] for r in runs if r["peak_rss_kb"] is not None]
+        results[phase] = {
+            "records_per_s": round(median["items"] / seconds, 1),
+            "mb_per_s": round(median["bytes"] / seconds / 1e6, 2),
+            "reference_mb_per_s": round(median["reference_mb_per_s"], 2),
+            "ratio": float(f"{median['ratio']:.4g}"),
+            "peak_rss_kb": max(rss) if rss else None,
+            "seconds": round(seconds, 4),
+        }
+    return results
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Trả về danh sách mô tả các hồi quy: tỉ lệ thông lượng so với tham chiếu thấp hơn, hoặc peak RSS
+    cao hơn baseline quá ngưỡng cho phép. MB/s tuyệt đối không được so (khác máy là khác).
+    """
+    regressions = []
+    for preset, phases in results.items():
+        for phase, current in phases.items():
+            ref = baseline.get(preset, {}).get(phase)
+            if not ref or phase in PREAD_PHASES:
+                continue
+            if ref.get("ratio") and current["ratio"] < ref["ratio"] * (1 - tolerance):
+                regressions.append(f"{preset}/{phase}: ratio {current['ratio']} < baseline {ref['ratio']} "
+                                   f"({current['mb_per_s']} MB/s, tham chiếu "
+                                   f"{current['reference_mb_per_s']} MB/s)")
+            if ref.get("peak_rss_kb") and current["peak_rss_kb"] \
+                    and current["peak_rss_kb"] > ref["peak_rss_kb"] * (1 + tolerance):
+                regressions.append(f"{preset}/{phase}: peak_rss_kb {current['peak_rss_kb']} "
+                                   f"> baseline {ref['peak_rss_kb']}")
+    return regressions
+
+def print_results(results):
+    print(f"{'preset/phase':<28} {'records/s':>12} {'MB/s':>10} {'ratio':>8} {'peak RSS KB':>12}")
+    for preset, phases in results.items():
+        for phase, r in phases.items():
+            print(f"{preset + '/' + phase:<28} {r['records_per_s']:>12} {r['mb_per_s']:>10} "
+                  f"{str(r['ratio']):>8} {str(r['peak_rss_kb']):>12}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark các giai đoạn quét/khôi phục NTFS trên ảnh tổng hợp.")
+    ap.add_argument("--preset", action="append", choices=sorted(PRESETS),
+                    help="Preset cần chạy (mặc định: tất cả)")
+    ap.add_argument("--phase", action="append", choices=list(PHASES),
+                    help="Giai đoạn cần chạy (mặc định: tất cả)")
+    ap.add_argument("--repeat", type=int, default=3,
+                    help="Số lần lặp mỗi giai đoạn, lấy lần có tỉ lệ trung vị")
+    ap.add_argument("--baseline", default=BASELINE_FILE)
+    ap.add_argument("--save-baseline", action="store_true", help="Ghi kết quả làm baseline mới")
+    ap.add_argument("--tolerance", type=float, default=0.30,
+                    help="Sai lệch cho phép của tỉ lệ thông lượng (so với tham chiếu) và peak RSS")
+    ap.add_argument("--json", help="Ghi kết quả ra file JSON")
+    ap.add_argument("--workdir", help="Thư mục chứa ảnh tổng hợp (mặc định: thư mục tạm)")
+    ap.add_argument("--pread-image",
+                    help="Thiết bị/ảnh lớn không nằm trong page cache cho pread_qd1/pread_qd32 "
+                         "(bật hai giai đoạn này; mặc định chúng không chạy)")
+    ap.add_argument("--pread-mb", type=int, default=1024,
+                    help="Số MB đầu của --pread-image được đọc mỗi lần đo pread")
+    args = ap.parse_args()
+
+    presets = args.preset or sorted(PRESETS)
+    phases = args.phase or [p for p in PHASES if p not in PREAD_PHASES or args.pread_image]
+    if not args.pread_image and any(p in PREAD_PHASES for p in phases):
+        print("[!] pread_qd1/pread_qd32 đo trên ảnh tổng hợp (gần như chắc chắn nằm trong page cache): "
+              "kết quả không phản ánh thiết bị thật, dùng --pread-image để đo đúng.")
+    pread_bytes = args.pread_mb * 1024 * 1024 if args.pread_image else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ntfs_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = {name: run_preset(name, workdir, args.repeat, phases, args.pread_image, pread_bytes)
+                   for name in presets}
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as bf:
+            baseline = json.load(bf)
+
+    if args.save_baseline:
+        for preset, phases_result in results.items():
+            baseline.setdefault(preset, {}).update(
+                (phase, r) for phase, r in phases_result.items() if phase not in PREAD_PHASES)
+        with open(args.baseline, "w") as bf:
+            json.dump(baseline, bf, indent=2, sort_keys=True)
+        print(f"[+] Đã lưu baseline vào {args.baseline}")
+        return
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print("[!] Phát hiện hồi quy hiệu năng:")
+        for line in regressions:
+            print(f"    - {line}")
+        sys.exit(1)
+    print("[+] Không có hồi quy so với baseline.")
+
+if __name__ == "__main__":
+    main()
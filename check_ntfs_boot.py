@@ -1,6 +1,7 @@
 import struct
 
-def check_ntfs_boot(vhd_path):
+def check_ntfs_boot(vhd_path, deep=False):
+    """Kiểm tra nhanh boot sector; deep=True thì đọc thêm toàn bộ MFT (ntfs_mft_health)."""
     with open(vhd_path, "rb") as f:
         boot_sector = f.read(512)
 
@@ -53,5 +54,12 @@ def check_ntfs_boot(vhd_path):
         if file_error:
             print("   - File/thư mục đã xóa: Boot signature hoặc bảng tệp có thể đã bị ghi đè.")
 
+    if deep:
+        from ntfs_mft_health import mft_health, print_health
+        print_health(mft_health(vhd_path))
+
 # --- Ví dụ ---
-check_ntfs_boot("D:\\anToanVaPhucHoi\\demo_2.vhd")
+if __name__ == "__main__":
+    import sys
+    paths = [a for a in sys.argv[1:] if a != "--deep"]
+    check_ntfs_boot(paths[0] if paths else "D:\\anToanVaPhucHoi\\demo_2.vhd", deep="--deep" in sys.argv)
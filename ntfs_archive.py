@@ -0,0 +1,208 @@
+# ntfs_archive.py
+# Mục đích: ghi file khôi phục thẳng vào một archive tar (tar.gz) hoặc zip (zip64), hoặc ra
+# stdout để pipe sang máy khác, thay vì tạo hàng trăm nghìn file nhỏ trong OUTPUT_DIR.
+# - Nội dung được đưa vào archive theo từng khúc khi đọc từ đĩa: bộ nhớ giới hạn, không có
+#   file tạm trung gian.
+# - Đường dẫn trong archive dựng lại từ parent reference của $FILE_NAME (bản đồ thư mục lấy
+#   ngay trong lượt quét MFT), thời gian sửa đổi lấy từ $STANDARD_INFORMATION.
+
+import os
+import struct
+import sys
+import tarfile
+import time
+import zipfile
+
+from ntfs_timeline import FILETIME_EPOCH_DIFF, FILETIME_PER_SECOND, NAMESPACE_DOS, parse_record_times
+
+ROOT_RECORD = 5                   # Record của thư mục gốc "."
+ORPHAN_DIR = "$OrphanFiles"       # Thư mục cha không còn trong MFT
+MAX_DEPTH = 256                   # Chặn vòng lặp parent bị hỏng
+FORMATS = ("tar", "tar.gz", "zip")
+
+
+# --- DỰNG LẠI ĐƯỜNG DẪN ---
+
+def primary_name(names):
+    """(name, parent_record) của $FILE_NAME chính: ưu tiên tên dài, bỏ tên DOS 8.3."""
+    long_names = [n for n in names if n[1] != NAMESPACE_DOS] or names
+    if not long_names:
+        return None, None
+    name, _, parent, _ = long_names[0]
+    return name, parent
+
+def _clean_component(name):
+    name = "".join("_" if c in "/\\" or ord(c) < 32 else c for c in name).strip()
+    return "_" if name in ("", ".", "..") else name
+
+class PathResolver:
+    """
+    Bản đồ record thư mục -> (tên, record cha), thu thập từ record_sink của bộ quét MFT,
+    dùng để dựng đường dẫn đầy đủ cho file khôi phục.
+    """
+
+    def __init__(self):
+        self.dirs = {}
+
+    def add(self, record_no, offset, data):
+        info = parse_record_times(data)
+        if info is None or not info["is_dir"]:
+            return
+        name, parent = primary_name(info["names"])
+        if name is not None:
+            # Số record thật nằm ở header (0x2C); record_no của bộ quét chỉ là chỉ số
+            number = struct.unpack_from("<I", data, 0x2C)[0] if len(data) >= 0x30 else record_no
+            self.dirs[number] = (_clean_component(name), parent)
+
+    def directory(self, record_no):
+        """Đường dẫn (dùng "/") của thư mục `record_no`, tính từ gốc volume."""
+        parts = []
+        for _ in range(MAX_DEPTH):
+            if record_no == ROOT_RECORD:
+                break
+            entry = self.dirs.get(record_no)
+            if entry is None:
+                parts.append(f"{ORPHAN_DIR}/{record_no}")
+                break
+            name, record_no = entry
+            parts.append(name)
+        else:
+            parts.append(ORPHAN_DIR)
+        return "/".join(reversed(parts))
+
+    def path(self, name, parent_record):
+        directory = self.directory(parent_record) if parent_record is not None else ORPHAN_DIR
+        name = _clean_component(name)
+        return f"{directory}/{name}" if directory else name
+
+def record_name_and_time(record):
+    """(tên chính, record cha, mtime epoch | None) của một FILE record; tên None nếu không đọc được."""
+    info = parse_record_times(record)
+    if info is None:
+        return None, None, None
+    name, parent = primary_name(info["names"])
+    mtime = None
+    if info["si"] is not None and info["si"][1]:
+        mtime = (info["si"][1] - FILETIME_EPOCH_DIFF) / FILETIME_PER_SECOND
+    return name, parent, mtime
+
+def record_path_and_time(record, resolver):
+    """(đường dẫn trong archive, mtime epoch | None) của một FILE record."""
+    name, parent, mtime = record_name_and_time(record)
+    if name is None:
+        return None, None
+    return resolver.path(name, parent), mtime
+
+
+# --- GHI ARCHIVE ---
+
+class _ChunkReader:
+    """File-like chỉ đọc trên một iterator các khúc bytes; thiếu dữ liệu thì đệm số 0 cho đủ size."""
+
+    def __init__(self, chunks, size):
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b"")
+        self._pos = 0
+        self._remaining = size
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self._remaining
+        n = min(n, self._remaining)
+        parts, need = [], n
+        while need:
+            if self._pos >= len(self._chunk):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    parts.append(bytes(need))
+                    break
+                self._chunk, self._pos = memoryview(chunk), 0
+                continue
+            take = min(need, len(self._chunk) - self._pos)
+            parts.append(self._chunk[self._pos:self._pos + take])
+            self._pos += take
+            need -= take
+        self._remaining -= n
+        return b"".join(parts)
+
+def format_from_path(path):
+    lower = path.lower()
+    if lower.endswith(".zip"):
+        return "zip"
+    if lower.endswith((".tar.gz", ".tgz")):
+        return "tar.gz"
+    return "tar"
+
+class ArchiveWriter:
+    """
+    Archive đầu ra: `target` là đường dẫn file hoặc "-" (stdout). Tar ghi ở chế độ stream
+    (không seek); zip luôn cho phép zip64 và ghi được vào stream không seek được.
+    """
+
+    def __init__(self, target, fmt=None):
+        self.target = target
+        self.fmt = fmt or ("tar" if target == "-" else format_from_path(target))
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Định dạng archive không hỗ trợ: {self.fmt}")
+        stream = sys.__stdout__.buffer if target == "-" else None
+        self._tar = self._zip = None
+        if self.fmt == "zip":
+            self._zip = zipfile.ZipFile(stream or target, "w", zipfile.ZIP_STORED, allowZip64=True)
+        else:
+            mode = "w|gz" if self.fmt == "tar.gz" else "w|"
+            self._tar = tarfile.open(None if stream else target, mode, fileobj=stream,
+                                     format=tarfile.PAX_FORMAT)
+        self._names = set()
+        self.entries = 0
+        self.bytes = 0
+
+    def unique_name(self, name, offset):
+        """Tên entry không trùng: thêm _(offset_N) như khi ghi ra thư mục."""
+        if name in self._names:
+            base, ext = os.path.splitext(name)
+            name = f"{base}_(offset_{offset}){ext}"
+        self._names.add(name)
+        return name
+
+    def add(self, name, size, chunks, mtime=None):
+        """Ghi một entry `size` byte từ iterator `chunks` (không giữ cả file trong bộ nhớ)."""
+        mtime = time.time() if mtime is None else mtime
+        if self._tar is not None:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = max(0, mtime)
+            info.mode = 0o644
+            self._tar.addfile(info, _ChunkReader(chunks, size))
+        else:
+            info = zipfile.ZipInfo(name, date_time=_zip_time(mtime))
+            info.external_attr = 0o644 << 16
+            with self._zip.open(info, "w", force_zip64=size >= zipfile.ZIP64_LIMIT) as out:
+                reader = _ChunkReader(chunks, size)
+                while True:
+                    data = reader.read(1024 * 1024)
+                    if not data:
+                        break
+                    out.write(data)
+        self.entries += 1
+        self.bytes += size
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+        if self._zip is not None:
+            self._zip.close()
+        if self.target == "-":
+            sys.__stdout__.buffer.flush()
+        else:
+            print(f"[+] Đã ghi {self.entries} file ({self.bytes} byte) vào archive '{self.target}'.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _zip_time(epoch):
+    # Zip chỉ lưu được thời gian từ 1980 tới 2107, độ chính xác 2 giây
+    t = time.gmtime(max(epoch, 315532800))
+    return (min(t.tm_year, 2107),) + tuple(t[1:6])
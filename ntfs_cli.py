@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# ntfs_cli.py
+# Mục đích: một CLI duy nhất, không tương tác, cho các công cụ NTFS.
+# Subcommand: diagnose, scan, recover, rebuild-mbr, restore-vbr, verify.
+# Hỗ trợ --batch <manifest> để xử lý nhiều ảnh song song với giới hạn worker/I/O chung,
+# mỗi ảnh có report JSON + log riêng.
+# Các module nặng chỉ được import trong handler để `diagnose` khởi động ngay.
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+# --- ĐỊNH TUYẾN LOG THEO LUỒNG ---
+
+class _ThreadLogRouter(io.TextIOBase):
+    """
+    Thay cho sys.stdout trong lúc chạy: mỗi luồng worker ghi log vào file của ảnh nó đang
+    xử lý (echo=True thì in cả ra console), luồng chính vẫn in ra console.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self._local = threading.local()
+
+    def bind(self, stream, echo=False):
+        self._local.stream = stream
+        self._local.echo = echo
+
+    def unbind(self):
+        self._local.stream = None
+
+    def write(self, text):
+        stream = getattr(self._local, "stream", None)
+        if stream is None:
+            return self.fallback.write(text)
+        if self._local.echo:
+            self.fallback.write(text)
+        return stream.write(text)
+
+    def flush(self):
+        stream = getattr(self._local, "stream", None)
+        if stream is not None:
+            stream.flush()
+        self.fallback.flush()
+
+
+# --- HANDLER CHO TỪNG SUBCOMMAND ---
+# Mỗi handler nhận (job, args, reader) và trả về dict kết quả (có khóa "status").
+
+def _handle_diagnose(job, args, reader):
+    from ntfs_recovery_main import diagnose_ntfs, print_diagnosis
+    errors, boot_info = diagnose_ntfs(job["image"], deep=args.deep, workers=args.deep_workers)
+    print_diagnosis(errors, boot_info)
+    return {"status": "ok", "errors": errors, "boot_info": boot_info}
+
+def _open_timeline(job, args):
+    if not args.timeline:
+        return None
+    from ntfs_timeline import TimelineWriter
+    ext = {"bodyfile": "body"}.get(args.timeline, args.timeline)
+    return TimelineWriter(f"{job['report_base']}.timeline.{ext}", args.timeline)
+
+def _mft_state(job, args):
+    """File trạng thái quét tăng dần của ảnh, dùng chung cho scan và recover."""
+    if not args.incremental:
+        return None
+    return os.path.join(args.report_dir, f"{job['name']}.mftstate")
+
+def _handle_scan(job, args, reader):
+    from recovery_ntfs import run_recovery
+    timeline = _open_timeline(job, args)
+    try:
+        return run_recovery(job["image"], reader=reader, timeline=timeline,
+                            mft_list_file=job["report_base"] + ".mft_records.txt", extract=False,
+                            incremental=_mft_state(job, args))
+    finally:
+        if timeline is not None:
+            timeline.close()
+
+def _handle_recover(job, args, reader):
+    from recovery_ntfs import run_recovery
+    timeline = _open_timeline(job, args)
+    archive = None
+    if args.archive:
+        # Mỗi ảnh một archive cạnh thư mục khôi phục của nó: <output-dir>/<ảnh>.tar|.tar.gz|.zip
+        from ntfs_archive import ArchiveWriter
+        target = f"{job['output_dir'].rstrip(os.sep)}.{args.archive}"
+        os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+        archive = ArchiveWriter(target, args.archive)
+    try:
+        return run_recovery(job["image"], reader=reader, output_dir=job["output_dir"],
+                            timeline=timeline, mft_list_file=job["report_base"] + ".mft_records.txt",
+                            triage_threshold=args.triage_threshold,
+                            known_files=_load_known_files(args), known_mode=args.known_mode,
+                            archive=archive, incremental=_mft_state(job, args))
+    finally:
+        if timeline is not None:
+            timeline.close()
+        if archive is not None:
+            archive.close()
+
+_KNOWN_FILES = {}
+_KNOWN_LOCK = threading.Lock()
+
+def _load_known_files(args):
+    """Nạp tập hash một lần, dùng chung cho mọi ảnh trong batch."""
+    if not args.known_hashes:
+        return None
+    with _KNOWN_LOCK:
+        if args.known_hashes not in _KNOWN_FILES:
+            from ntfs_knownfiles import KnownFileSet
+            _KNOWN_FILES[args.known_hashes] = KnownFileSet.load(args.known_hashes)
+        return _KNOWN_FILES[args.known_hashes]
+
+def _handle_rebuild_mbr(job, args, reader):
+    import partition
+    candidates = partition.find_candidates(job["image"], max_sectors=args.max_sectors,
+                                           reader=reader, force_scan=args.force_scan)
+    if not candidates:
+        return {"status": "error", "error": "Không tìm thấy boot sector NTFS"}
+    total_sectors = os.path.getsize(job["image"]) // partition.SECTOR_SIZE
+    proposals = partition.propose_partitions_from_candidates(candidates, total_sectors)
+    result = {"status": "ok", "candidates": candidates, "proposals": proposals}
+    if args.apply:
+        out_path = job["report_base"] + ".rebuilt.img"
+        partition.apply_new_mbr(job["image"], out_path, proposals[:1])
+        result["output_image"] = out_path
+    return result
+
+def _handle_restore_vbr(job, args, reader):
+    from ntfs_restore_vbr import recover_vbr_from_backup
+    result = {"status": "ok"}
+    if args.backup:
+        from ntfs_recovery_main import create_backup
+        backup_path = create_backup(job["image"], overwrite=True)
+        if not backup_path:
+            return {"status": "error", "error": "Không tạo được backup"}
+        result["backup"] = backup_path
+    if not recover_vbr_from_backup(job["image"]):
+        return dict(result, status="error", error="Phục hồi VBR thất bại")
+    return result
+
+def _handle_verify(job, args, reader):
+    from ntfs_verify import print_verify, verify_images
+    result = verify_images(job["image"], args.against, block_size=args.block_size,
+                           workers=args.hash_workers, use_cache=not args.no_cache)
+    print_verify(result)
+    return dict(result, status="ok")
+
+HANDLERS = {
+    "diagnose": _handle_diagnose,
+    "scan": _handle_scan,
+    "recover": _handle_recover,
+    "rebuild-mbr": _handle_rebuild_mbr,
+    "restore-vbr": _handle_restore_vbr,
+    "verify": _handle_verify,
+}
+
+# Subcommand nào đọc khối lượng lớn và được hưởng lợi từ PrefetchReader
+PREFETCH_COMMANDS = {"scan", "recover", "rebuild-mbr"}
+
+def add_serve_arguments(ap):
+    """
+    Tham số của dịch vụ ntfs_service (lệnh `serve`). Khai báo ở đây để các lệnh khác không phải
+    import http.server và cả dịch vụ chỉ để dựng parser.
+    """
+    ap.add_argument("--host", default="127.0.0.1", help="Địa chỉ bind (mặc định chỉ localhost)")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--memory-budget", type=int, default=512,
+                    help="Ngân sách bộ nhớ (MiB) cho các ảnh giữ ấm trong cache")
+    ap.add_argument("--workdir", default="service_work",
+                    help="Thư mục chứa danh sách MFT record của các ảnh đã quét")
+    ap.add_argument("--workers", type=int, default=2, help="Số job chạy song song")
+
+
+# --- NẠP DANH SÁCH ẢNH ---
+
+def load_manifest(path):
+    """
+    Đọc manifest batch: file .json (list đường dẫn hoặc list {"image": ..., "output_dir": ...,
+    "mapfile": ..., "size": ...})
+    hoặc file text mỗi dòng một đường dẫn (bỏ qua dòng trống và dòng bắt đầu bằng #).
+    """
+    with open(path, encoding="utf-8") as mf:
+        if path.lower().endswith(".json"):
+            entries = json.load(mf)
+        else:
+            entries = [line.strip() for line in mf if line.strip() and not line.lstrip().startswith("#")]
+    return [e if isinstance(e, dict) else {"image": e} for e in entries]
+
+def build_jobs(entries, args):
+    jobs = []
+    seen = {}
+    for entry in entries:
+        name = os.path.splitext(os.path.basename(entry["image"].rstrip("\\/")))[0] or "image"
+        name = "".join(c if c.isalnum() or c in "._-" else "_" for c in name)
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name}_{seen[name]}"
+        jobs.append({
+            "image": entry["image"],
+            "name": name,
+            "report_base": os.path.join(args.report_dir, f"{name}.{args.command}"),
+            "output_dir": entry.get("output_dir") or os.path.join(args.output_dir, name),
+            "mapfile": entry.get("mapfile") or args.mapfile,
+            "size": entry.get("size") or args.size,
+        })
+    return jobs
+
+
+# --- CHẠY JOB ---
+
+def run_job(job, args, router, io_budget, reader_depth, echo=False):
+    """Chạy một subcommand trên một ảnh, ghi log và report JSON riêng."""
+    log_path = job["report_base"] + ".log"
+    started = time.time()
+    reader = None
+    with open(log_path, "w", encoding="utf-8") as log:
+        router.bind(log, echo=echo)
+        try:
+            if args.command in PREFETCH_COMMANDS and job.get("mapfile"):
+                # Ảnh từ ổ đĩa hỏng: chỉ đọc các vùng đã cứu được theo map file
+                from ntfs_rescue import MappedReader
+                reader = MappedReader(job["image"], job["mapfile"], depth=max(1, reader_depth),
+                                      budget=io_budget, size=job.get("size"))
+            elif args.command in PREFETCH_COMMANDS and (reader_depth > 0 or job.get("size")):
+                from ntfs_prefetch import PrefetchReader
+                reader = PrefetchReader(job["image"], depth=max(1, reader_depth), budget=io_budget,
+                                        size=job.get("size"))
+            result = HANDLERS[args.command](job, args, reader)
+        except Exception as e:
+            print(f"[!] Lỗi khi xử lý {job['image']}: {e}")
+            result = {"status": "error", "error": str(e)}
+        finally:
+            if reader is not None:
+                reader.close()
+            router.unbind()
+
+    report = {
+        "image": job["image"],
+        "command": args.command,
+        "started": started,
+        "seconds": round(time.time() - started, 3),
+        "log": log_path,
+        "result": result,
+    }
+    with open(job["report_base"] + ".json", "w", encoding="utf-8") as rf:
+        json.dump(report, rf, indent=2, ensure_ascii=False, default=str)
+    return report
+
+def run_batch(jobs, args):
+    """Chạy các job với tối đa args.jobs ảnh song song và args.io_depth lệnh đọc chung."""
+    os.makedirs(args.report_dir, exist_ok=True)
+    io_budget = threading.BoundedSemaphore(args.io_depth) if args.io_depth > 0 else None
+    workers = max(1, min(args.jobs, len(jobs)))
+    reader_depth = max(1, args.io_depth // workers) if args.io_depth > 0 else 0
+
+    # Chỉ một ảnh (không --batch) thì vẫn in log ra console như các script cũ
+    echo = not args.batch and len(jobs) == 1
+    router = _ThreadLogRouter(sys.stdout)
+    sys.stdout = router
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image") as pool:
+            futures = [pool.submit(run_job, job, args, router, io_budget, reader_depth, echo)
+                       for job in jobs]
+            reports = []
+            for future in futures:
+                report = future.result()
+                reports.append(report)
+                status = report["result"].get("status", "ok")
+                print(f"[{'+' if status == 'ok' else '!'}] {report['image']}: {status} "
+                      f"({report['seconds']}s) -> {report['log']}")
+    finally:
+        sys.stdout = router.fallback
+    return reports
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Công cụ khôi phục NTFS (không tương tác, hỗ trợ batch).")
+    ap.add_argument("--batch", help="Manifest danh sách ảnh (.json hoặc text, mỗi dòng một ảnh)")
+    ap.add_argument("--jobs", type=int, default=min(4, os.cpu_count() or 1),
+                    help="Số ảnh xử lý song song")
+    ap.add_argument("--io-depth", type=int, default=32,
+                    help="Tổng số lệnh đọc song song cho tất cả ảnh (0 = đọc tuần tự)")
+    ap.add_argument("--report-dir", default="reports", help="Thư mục chứa report JSON và log từng ảnh")
+    ap.add_argument("--metrics", help="Ghi metrics tổng hợp của cả batch ra file JSON")
+    ap.add_argument("--mapfile", help="Map file ntfs_rescue/ddrescue (một ảnh; batch thì khai báo "
+                                      "\"mapfile\" cho từng ảnh trong manifest JSON)")
+    ap.add_argument("--size", type=int, default=None,
+                    help="Kích thước nguồn (byte) nếu không tự đọc được, vd volume raw (một ảnh; "
+                         "batch thì khai báo \"size\" trong manifest JSON)")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    for name, help_text in [
+        ("diagnose", "Chẩn đoán lỗi MBR/VBR"),
+        ("scan", "Quét MFT và liệt kê file đã xóa (không ghi file)"),
+        ("recover", "Quét MFT và khôi phục file đã xóa"),
+        ("rebuild-mbr", "Quét boot sector NTFS và đề xuất/ghi MBR mới"),
+        ("restore-vbr", "Ghi đè VBR chính bằng VBR backup"),
+        ("verify", "So sánh ảnh với <ảnh>.backup theo khối, chỉ ra vùng cấu trúc bị thay đổi"),
+    ]:
+        sp = sub.add_parser(name, help=help_text)
+        sp.add_argument("images", nargs="*", help="Đường dẫn ảnh/ổ đĩa")
+        if name in ("scan", "recover"):
+            sp.add_argument("--timeline", choices=("bodyfile", "csv", "jsonl"), default=None,
+                            help="Xuất timeline MACB <report-dir>/<ảnh>.<lệnh>.timeline.*")
+            sp.add_argument("--incremental", action="store_true",
+                            help="Chỉ phân tích lại khúc MFT đã đổi so với lần chạy trước "
+                                 "(<report-dir>/<ảnh>.mftstate), ghi báo cáo delta")
+        if name == "diagnose":
+            sp.add_argument("--deep", action="store_true",
+                            help="Đọc toàn bộ MFT: fixup/USA, $MFTMirr, chuỗi thuộc tính, chiến lược đề xuất")
+            sp.add_argument("--deep-workers", type=int, default=None,
+                            help="Số process cho --deep (mặc định: số CPU)")
+        if name == "recover":
+            sp.add_argument("--output-dir", default="recovered_files",
+                            help="Thư mục gốc; mỗi ảnh có một thư mục con")
+            sp.add_argument("--triage-threshold", type=float, default=None,
+                            help="Bỏ qua file có điểm triage dưới ngưỡng (0..1)")
+            sp.add_argument("--known-hashes", default=None,
+                            help="Tập hash file đã biết (CSV kiểu NSRL) để lọc file hệ thống")
+            sp.add_argument("--known-mode", choices=("tag", "suppress"), default="tag")
+            sp.add_argument("--archive", choices=("tar", "tar.gz", "zip"), default=None,
+                            help="Ghi file khôi phục vào <output-dir>/<ảnh>.<định dạng> thay vì thư mục")
+        if name == "rebuild-mbr":
+            sp.add_argument("--max-sectors", type=int, default=None)
+            sp.add_argument("--force-scan", action="store_true",
+                            help="Bỏ qua bảng phân vùng, quét từng sector")
+            sp.add_argument("--apply", action="store_true",
+                            help="Ghi ảnh mới <report-dir>/<ảnh>.rebuild-mbr.rebuilt.img")
+        if name == "restore-vbr":
+            sp.add_argument("--backup", action="store_true", help="Tạo <ảnh>.backup trước khi ghi")
+        if name == "verify":
+            sp.add_argument("--against", default=None,
+                            help="File so sánh (mặc định <ảnh>.backup; chỉ dùng với một ảnh)")
+            sp.add_argument("--block-size", type=int, default=1024 * 1024)
+            sp.add_argument("--hash-workers", type=int, default=8,
+                            help="Số khối được đọc và băm cùng lúc cho mỗi ảnh")
+            sp.add_argument("--no-cache", action="store_true",
+                            help="Không dùng cache digest <ảnh>.blockhash")
+    add_serve_arguments(sub.add_parser("serve", help="Chạy dịch vụ HTTP/JSON trên localhost, giữ ấm "
+                                                     "kết quả quét của từng ảnh giữa các yêu cầu"))
+    args = ap.parse_args(argv)
+    if args.command == "serve":
+        from ntfs_service import serve
+        serve(args.host, args.port, args.memory_budget * 1024 * 1024, args.workdir, args.workers)
+        return 0
+    if not hasattr(args, "output_dir"):
+        args.output_dir = "recovered_files"
+
+    entries = [{"image": path} for path in args.images]
+    if args.batch:
+        entries += load_manifest(args.batch)
+    if not entries:
+        ap.error("Cần ít nhất một ảnh hoặc --batch <manifest>")
+
+    reports = run_batch(build_jobs(entries, args), args)
+    if args.metrics:
+        from ntfs_metrics import METRICS
+        METRICS.export_json(args.metrics)
+
+    summary_path = os.path.join(args.report_dir, f"batch_{args.command}_summary.json")
+    with open(summary_path, "w", encoding="utf-8") as sf:
+        json.dump([{"image": r["image"], "status": r["result"].get("status"), "seconds": r["seconds"]}
+                   for r in reports], sf, indent=2, ensure_ascii=False)
+    failed = [r for r in reports if r["result"].get("status") != "ok"]
+    print(f"[+] {len(reports) - len(failed)}/{len(reports)} ảnh thành công. Tổng hợp: {summary_path}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
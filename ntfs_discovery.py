@@ -0,0 +1,311 @@
+# ntfs_discovery.py
+# Mục đích: tìm phân vùng NTFS theo bảng phân vùng trước, quét brute-force sau.
+# Thứ tự: GPT (header chính + backup, kiểm tra CRC32) -> MBR (4 entry chính + chuỗi EBR
+# của phân vùng mở rộng) -> boot sector NTFS tại offset 0 (volume raw) -> quét từng sector
+# (partition.scan_image_for_ntfs). Mỗi boot sector NTFS tìm được đều được đối chiếu với bảng.
+
+import os
+import struct
+import uuid
+import zlib
+
+SECTOR_SIZE = 512
+GPT_SIGNATURE = b"EFI PART"
+MBR_EXTENDED_TYPES = (0x05, 0x0F, 0x85)
+MBR_NTFS_TYPES = (0x07, 0x27)     # 0x27: phân vùng recovery NTFS ẩn
+MAX_EBR_CHAIN = 128               # Chặn vòng lặp khi chuỗi EBR bị hỏng
+
+GPT_NTFS_TYPES = {
+    uuid.UUID("EBD0A0A2-B9E5-4433-87C0-68B6B72699C7"): "basic_data",
+    uuid.UUID("DE94BBA4-06D1-4D40-A16A-BFD50179D6AC"): "windows_recovery",
+}
+
+
+class _SectorReader:
+    """Đọc theo LBA và đếm số lần đọc (để kiểm chứng discovery chỉ tốn O(1) lần đọc)."""
+
+    def __init__(self, f, total_sectors):
+        self.f = f
+        self.total_sectors = total_sectors
+        self.reads = 0
+
+    def read(self, lba, count=1):
+        if lba < 0 or lba >= self.total_sectors:
+            return b""
+        self.f.seek(lba * SECTOR_SIZE)
+        self.reads += 1
+        return self.f.read(count * SECTOR_SIZE)
+
+
+# --- MBR / EBR ---
+
+def parse_mbr_entries(sector):
+    """Trả về list 4 entry của bảng phân vùng MBR (bỏ entry rỗng)."""
+    entries = []
+    if len(sector) < SECTOR_SIZE:
+        return entries
+    for i in range(4):
+        off = 0x1BE + i * 16
+        boot_flag, ptype = sector[off], sector[off + 4]
+        start_lba, num_sectors = struct.unpack_from("<II", sector, off + 8)
+        if ptype == 0 or num_sectors == 0:
+            continue
+        entries.append({"index": i, "bootable": boot_flag == 0x80, "type": ptype,
+                        "start_lba": start_lba, "num_sectors": num_sectors})
+    return entries
+
+def walk_ebr_chain(reader, extended_start):
+    """
+    Duyệt chuỗi EBR của phân vùng mở rộng bắt đầu ở `extended_start`.
+    Entry 0 của mỗi EBR: phân vùng logic (tương đối với EBR hiện tại).
+    Entry 1: EBR kế tiếp (tương đối với đầu phân vùng mở rộng).
+    """
+    logical = []
+    ebr_lba = extended_start
+    visited = set()
+    while ebr_lba not in visited and len(visited) < MAX_EBR_CHAIN:
+        visited.add(ebr_lba)
+        sector = reader.read(ebr_lba)
+        if len(sector) < SECTOR_SIZE or sector[510:512] != b"\x55\xAA":
+            break
+        entries = []
+        for i in (0, 1):
+            off = 0x1BE + i * 16
+            entries.append((sector[off + 4],) + struct.unpack_from("<II", sector, off + 8))
+        (ptype, rel_start, num_sectors), (next_type, next_rel, next_sectors) = entries
+        if ptype and num_sectors:
+            logical.append({"index": 4 + len(logical), "bootable": False, "type": ptype,
+                            "start_lba": ebr_lba + rel_start, "num_sectors": num_sectors,
+                            "ebr_lba": ebr_lba})
+        if next_type not in MBR_EXTENDED_TYPES or not next_sectors:
+            break
+        ebr_lba = extended_start + next_rel
+    return logical
+
+
+# --- GPT ---
+
+def parse_gpt_header(sector):
+    """Phân tích và kiểm tra CRC32 của GPT header. Trả về dict hoặc None nếu không hợp lệ."""
+    if len(sector) < 92 or sector[0:8] != GPT_SIGNATURE:
+        return None
+    header_size = struct.unpack_from("<I", sector, 12)[0]
+    if not 92 <= header_size <= len(sector):
+        return None
+    stored_crc = struct.unpack_from("<I", sector, 16)[0]
+    raw = bytearray(sector[:header_size])
+    raw[16:20] = b"\x00\x00\x00\x00"
+    if zlib.crc32(bytes(raw)) & 0xFFFFFFFF != stored_crc:
+        return None
+    (current_lba, backup_lba, first_usable, last_usable) = struct.unpack_from("<QQQQ", sector, 24)
+    disk_guid = uuid.UUID(bytes_le=bytes(sector[56:72]))
+    entries_lba, num_entries, entry_size, entries_crc = struct.unpack_from("<QIII", sector, 72)
+    if entry_size < 128 or num_entries == 0 or num_entries * entry_size > 1024 * 1024:
+        return None
+    return {"current_lba": current_lba, "backup_lba": backup_lba, "first_usable": first_usable,
+            "last_usable": last_usable, "disk_guid": str(disk_guid), "entries_lba": entries_lba,
+            "num_entries": num_entries, "entry_size": entry_size, "entries_crc": entries_crc}
+
+def parse_gpt_entries(header, data):
+    """Kiểm tra CRC32 của mảng entry và trả về list phân vùng (None nếu CRC sai)."""
+    size = header["num_entries"] * header["entry_size"]
+    if len(data) < size or zlib.crc32(data[:size]) & 0xFFFFFFFF != header["entries_crc"]:
+        return None
+    partitions = []
+    for i in range(header["num_entries"]):
+        off = i * header["entry_size"]
+        type_guid = uuid.UUID(bytes_le=bytes(data[off:off + 16]))
+        if type_guid.int == 0:
+            continue
+        first_lba, last_lba, attrs = struct.unpack_from("<QQQ", data, off + 32)
+        name = bytes(data[off + 56:off + 128]).decode("utf-16le", errors="ignore").rstrip("\x00")
+        partitions.append({"index": i, "type": str(type_guid),
+                           "type_name": GPT_NTFS_TYPES.get(type_guid, "other"),
+                           "start_lba": first_lba, "num_sectors": last_lba - first_lba + 1,
+                           "attributes": attrs, "name": name})
+    return partitions
+
+def read_gpt(reader, head):
+    """
+    Đọc GPT: header chính ở LBA 1 (đã có trong `head`), nếu hỏng thì dùng header backup ở LBA cuối.
+    Trả về (partitions, source) với source là "primary"/"backup", hoặc (None, None).
+    """
+    candidates = [("primary", head[SECTOR_SIZE:2 * SECTOR_SIZE], 1),
+                  ("backup", None, reader.total_sectors - 1)]
+    for source, sector, lba in candidates:
+        if sector is None:
+            sector = reader.read(lba)
+        header = parse_gpt_header(sector)
+        if header is None or header["current_lba"] != lba:
+            continue
+        size = header["num_entries"] * header["entry_size"]
+        start = header["entries_lba"] * SECTOR_SIZE
+        if source == "primary" and start + size <= len(head):
+            data = head[start:start + size]
+        else:
+            data = reader.read(header["entries_lba"], -(-size // SECTOR_SIZE))
+        partitions = parse_gpt_entries(header, data)
+        if partitions is not None:
+            return partitions, source
+    return None, None
+
+
+# --- ĐỐI CHIẾU BOOT SECTOR VỚI BẢNG ---
+
+def validate_ntfs_boot(sector, start_lba=None, num_sectors=None):
+    """
+    Phân tích boot sector NTFS và đối chiếu với thông tin từ bảng phân vùng.
+    Trả về (info, issues) — info None nếu không phải boot sector NTFS.
+    """
+    from partition import is_ntfs_boot_sector, parse_ntfs_boot
+    if len(sector) < SECTOR_SIZE or not is_ntfs_boot_sector(sector):
+        return None, []
+    info = parse_ntfs_boot(sector)
+    issues = []
+    if sector[510:512] != b"\x55\xAA":
+        issues.append("boot_signature")
+    if info["bytes_per_sector"] not in (512, 1024, 2048, 4096):
+        issues.append("bytes_per_sector")
+    spc = info["sectors_per_cluster"]
+    if spc == 0 or spc & (spc - 1):
+        issues.append("sectors_per_cluster")
+    if info["total_sectors"] == 0:
+        issues.append("total_sectors_zero")
+    elif num_sectors and info["total_sectors"] > num_sectors:
+        issues.append("total_sectors_exceeds_partition")
+    if info["bytes_per_cluster"] and info["mft_lcn"] is not None and info["total_sectors"]:
+        total_clusters = info["total_sectors"] // max(spc, 1)
+        if not 0 < info["mft_lcn"] < total_clusters:
+            issues.append("mft_out_of_volume")
+    hidden = struct.unpack_from("<I", sector, 0x1C)[0]
+    if start_lba is not None and hidden not in (0, start_lba & 0xFFFFFFFF):
+        # Nhiều công cụ ghi 0; chỉ coi là lệch khi có giá trị khác
+        issues.append("hidden_sectors_mismatch")
+    return info, issues
+
+def _probe_partition(reader, part, scheme):
+    """Đọc boot sector (và boot sector backup nếu cần) của một phân vùng trong bảng."""
+    entry = dict(part, scheme=scheme, offset=part["start_lba"] * SECTOR_SIZE,
+                 is_ntfs=False, boot=None, issues=[], boot_source=None)
+    info, issues = validate_ntfs_boot(reader.read(part["start_lba"]),
+                                      part["start_lba"], part["num_sectors"])
+    source = "primary"
+    if info is None or issues:
+        # VBR chính hỏng: thử VBR backup ở sector cuối phân vùng
+        backup_info, backup_issues = validate_ntfs_boot(
+            reader.read(part["start_lba"] + part["num_sectors"] - 1),
+            part["start_lba"], part["num_sectors"])
+        if backup_info is not None and (info is None or len(backup_issues) < len(issues)):
+            info, issues, source = backup_info, backup_issues, "backup"
+    if info is not None:
+        issues = list(issues)
+        if scheme in ("mbr", "ebr") and part["type"] not in MBR_NTFS_TYPES:
+            issues.append("table_type_mismatch")
+        elif scheme == "gpt" and part.get("type_name") == "other":
+            issues.append("table_type_mismatch")
+        entry.update(is_ntfs=True, boot=info, issues=issues, boot_source=source)
+    return entry
+
+
+# --- HÀM CHÍNH ---
+
+def discover_partitions(image_path, scan_fallback=True, max_sectors=None, reader=None):
+    """
+    Tìm các phân vùng NTFS của một ảnh/ổ đĩa.
+    Trả về dict: scheme ("gpt", "mbr", "raw", "scan" hoặc None), partitions (list dict với
+    start_lba, num_sectors, offset, is_ntfs, boot, issues, boot_source), reads (số lần đọc).
+    """
+    with open(image_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        # Volume raw trên Windows báo kích thước 0: dùng kích thước reader đã suy ra từ VBR/--size
+        total_sectors = (f.tell() or getattr(reader, "size", None) or 0) // SECTOR_SIZE
+        sr = _SectorReader(f, total_sectors)
+        # LBA 0..33: MBR + GPT header + 128 entry chuẩn trong một lần đọc
+        head = sr.read(0, 34)
+        result = {"image": image_path, "scheme": None, "partitions": [], "reads": 0,
+                  "gpt_source": None}
+
+        mbr_entries = parse_mbr_entries(head[:SECTOR_SIZE]) if head[510:512] == b"\x55\xAA" else []
+        protective = any(e["type"] == 0xEE for e in mbr_entries)
+        if protective or head[SECTOR_SIZE:SECTOR_SIZE + 8] == GPT_SIGNATURE:
+            gpt_parts, source = read_gpt(sr, head)
+            if gpt_parts is not None:
+                result.update(scheme="gpt", gpt_source=source)
+                result["partitions"] = [_probe_partition(sr, p, "gpt") for p in gpt_parts]
+
+        if result["scheme"] is None and mbr_entries and not protective:
+            parts = []
+            for e in mbr_entries:
+                if e["type"] in MBR_EXTENDED_TYPES:
+                    parts.extend(_probe_partition(sr, p, "ebr")
+                                 for p in walk_ebr_chain(sr, e["start_lba"]))
+                else:
+                    parts.append(_probe_partition(sr, e, "mbr"))
+            if parts:
+                result.update(scheme="mbr", partitions=parts)
+
+        if not any(p["is_ntfs"] for p in result["partitions"]):
+            # Không có bảng hợp lệ: có thể là volume NTFS raw (boot sector tại LBA 0)
+            info, issues = validate_ntfs_boot(head[:SECTOR_SIZE], 0, total_sectors)
+            if info is not None:
+                result["scheme"] = "raw"
+                result["partitions"] = [{
+                    "index": 0, "scheme": "raw", "type": None, "start_lba": 0,
+                    "num_sectors": total_sectors, "offset": 0, "is_ntfs": True, "boot": info,
+                    "issues": issues, "boot_source": "primary",
+                }]
+        result["reads"] = sr.reads
+
+    if scan_fallback and not any(p["is_ntfs"] for p in result["partitions"]):
+        import partition
+        print("[!] Bảng phân vùng không chỉ ra phân vùng NTFS nào, chuyển sang quét từng sector...")
+        candidates = partition.scan_image_for_ntfs(image_path, max_sectors=max_sectors, reader=reader)
+        result["scheme"] = "scan"
+        result["partitions"] = _partitions_from_scan(image_path, candidates)
+    return result
+
+def _partitions_from_scan(image_path, candidates):
+    """
+    Chuyển kết quả quét sector thành danh sách phân vùng. Boot sector backup (ở sector cuối
+    volume) của một boot sector chính đã thấy thì bỏ qua; backup đứng một mình thì suy ra
+    đầu phân vùng = boot_lba - total_sectors nếu MFT ở đó có chữ ký FILE.
+    """
+    primaries = {c["boot_lba"] for c in candidates}
+    partitions = []
+    with open(image_path, "rb") as f:
+        for c in candidates:
+            start, source = c["boot_lba"], "scan"
+            backup_of = c["boot_lba"] - c["total_sectors"]
+            if backup_of in primaries:
+                continue
+            if backup_of >= 0 and c["mft_byte_offset"] is not None:
+                f.seek(backup_of * SECTOR_SIZE + c["mft_byte_offset"])
+                if f.read(4) == b"FILE":
+                    start, source = backup_of, "scan_backup"
+            partitions.append({
+                "index": len(partitions), "scheme": "scan", "type": None, "start_lba": start,
+                "num_sectors": c["total_sectors"] + 1, "offset": start * SECTOR_SIZE,
+                "is_ntfs": True, "boot": c,
+                "issues": [] if c.get("sanity") == "ok" else [c.get("sanity")],
+                "boot_source": source,
+            })
+    return partitions
+
+def ntfs_partitions(discovery):
+    """Lọc các phân vùng NTFS từ kết quả discover_partitions."""
+    return [p for p in discovery["partitions"] if p["is_ntfs"]]
+
+def find_ntfs_partition(image_path, scan_fallback=True):
+    """
+    Trả về phân vùng NTFS đầu tiên (dict như discover_partitions) hoặc None.
+    Khi không boot sector nào hợp lệ, vẫn trả về phân vùng đầu tiên có kiểu NTFS trong bảng
+    (0x07/0x27 hoặc GUID basic data) để còn phục hồi VBR.
+    """
+    discovery = discover_partitions(image_path, scan_fallback=scan_fallback)
+    found = ntfs_partitions(discovery)
+    if found:
+        return found[0]
+    for p in discovery["partitions"]:
+        if p["type"] in MBR_NTFS_TYPES or p.get("type_name") in ("basic_data", "windows_recovery"):
+            return p
+    return None
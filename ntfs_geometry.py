@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# ntfs_geometry.py
+# Mục đích: suy ra hình học volume NTFS (kích thước cluster, MFT LCN, MFTMirr LCN, vị trí
+# phân vùng) khi CẢ VBR chính lẫn VBR backup đều hỏng, rồi dựng lại một boot sector hợp lệ.
+# Cách làm: đọc mẫu vài trăm khối rải đều trên ảnh, tìm FILE record, dùng số record (0x2C)
+# để đoán vị trí đầu MFT, đọc record 0 ($MFT) và 1 ($MFTMirr) rồi dùng runlist của chính
+# chúng để tính cluster size/LCN, đối chiếu chéo MFT với MFTMirr và với kích thước ảnh.
+
+import argparse
+import json
+import os
+import struct
+from collections import Counter
+
+SECTOR_SIZE = 512
+DEFAULT_SAMPLES = 256
+MAX_SAMPLES = 4096                 # Không thấy FILE record nào thì tăng dần mật độ lấy mẫu tới đây
+DEFAULT_BLOCK_SIZE = 64 * 1024
+MAX_CANDIDATES = 8                 # Số vị trí đầu MFT (nhiều phiếu nhất) được kiểm tra
+VALID_RECORD_SIZES = (1024, 2048, 4096)
+VALID_SECTOR_SIZES = (512, 1024, 2048, 4096)
+MAX_CLUSTER_SIZE = 2 * 1024 * 1024
+
+
+class _SampleReader:
+    """Đọc theo offset byte và đếm số lần đọc/byte đã đọc."""
+
+    def __init__(self, f):
+        self.f = f
+        f.seek(0, os.SEEK_END)
+        self.size = f.tell()
+        self.reads = 0
+        self.bytes_read = 0
+
+    def read(self, offset, size):
+        if offset < 0 or offset >= self.size:
+            return b""
+        self.f.seek(offset)
+        data = self.f.read(size)
+        self.reads += 1
+        self.bytes_read += len(data)
+        return data
+
+
+# --- PHÂN TÍCH FILE RECORD ---
+
+def parse_record_header(data, offset=0):
+    """
+    Đọc header FILE record tại `offset`. Trả về dict (record_no, record_size, sector_size)
+    hoặc None nếu header không hợp lý (chỉ nhận định dạng NTFS 3.1 có số record ở 0x2C).
+    """
+    if len(data) < offset + 0x30 or data[offset:offset + 4] != b"FILE":
+        return None
+    usa_offset, usa_count = struct.unpack_from("<HH", data, offset + 4)
+    record_size = struct.unpack_from("<I", data, offset + 0x1C)[0]
+    if usa_offset != 0x30 or record_size not in VALID_RECORD_SIZES or usa_count < 2:
+        return None
+    sector_size = record_size // (usa_count - 1)
+    if sector_size * (usa_count - 1) != record_size or sector_size not in VALID_SECTOR_SIZES:
+        return None
+    return {"record_no": struct.unpack_from("<I", data, offset + 0x2C)[0],
+            "record_size": record_size, "sector_size": sector_size}
+
+def undo_fixups(record, sector_size):
+    """Trả lại 2 byte gốc cuối mỗi sector từ Update Sequence Array; None nếu record bị rách."""
+    record = bytearray(record)
+    usa_offset, usa_count = struct.unpack_from("<HH", record, 4)
+    usn = record[usa_offset:usa_offset + 2]
+    for i in range(1, usa_count):
+        end = i * sector_size
+        if end > len(record) or record[end - 2:end] != usn:
+            return None
+        record[end - 2:end] = record[usa_offset + 2 * i:usa_offset + 2 * i + 2]
+    return bytes(record)
+
+def decode_runlist(data, start, end):
+    """Giải mã runlist trong data[start:end] -> list (lcn, count); lcn None = run thưa."""
+    runs = []
+    lcn = 0
+    p = start
+    while p < end and data[p] != 0x00:
+        len_bytes = data[p] & 0x0F
+        offset_bytes = data[p] >> 4
+        p += 1
+        if len_bytes == 0 or p + len_bytes + offset_bytes > end:
+            return None
+        count = int.from_bytes(data[p:p + len_bytes], "little")
+        p += len_bytes
+        if offset_bytes:
+            lcn += int.from_bytes(data[p:p + offset_bytes], "little", signed=True)
+            runs.append((lcn, count))
+        else:
+            runs.append((None, count))
+        p += offset_bytes
+    return runs
+
+def nonresident_data(record):
+    """
+    Tìm $DATA (0x80) không resident, không tên trong record đã gỡ fixup.
+    Trả về dict (runs, allocated_size, real_size) hoặc None.
+    """
+    p = struct.unpack_from("<H", record, 0x14)[0]
+    while p + 0x10 <= len(record):
+        attr_type, attr_len = struct.unpack_from("<II", record, p)
+        if attr_type == 0xFFFFFFFF or attr_len < 0x10 or p + attr_len > len(record):
+            return None
+        if attr_type == 0x80 and record[p + 8] == 1 and record[p + 9] == 0 and attr_len >= 0x40:
+            runlist_offset = struct.unpack_from("<H", record, p + 0x20)[0]
+            allocated, real = struct.unpack_from("<QQ", record, p + 0x28)
+            runs = decode_runlist(record, p + runlist_offset, p + attr_len)
+            if not runs:
+                return None
+            return {"runs": runs, "allocated_size": allocated, "real_size": real}
+        p += attr_len
+    return None
+
+
+# --- LẤY MẪU ---
+
+def sample_records(sr, region_start, region_end, samples, block_size):
+    """
+    Đọc `samples` khối rải đều trong [region_start, region_end) và bỏ phiếu cho vị trí đầu
+    MFT: mỗi FILE record số n tại offset X cho một phiếu (X - n * record_size).
+    Trả về (Counter phiếu, list runlist $DATA của các record đã carve).
+    """
+    votes = Counter()
+    data_runs = []
+    span = max(region_end - region_start, 1)
+    stride = max(block_size, span // max(samples, 1) // SECTOR_SIZE * SECTOR_SIZE)
+    for block_start in range(region_start, region_end, stride):
+        block = sr.read(block_start, min(block_size, region_end - block_start))
+        pos = block.find(b"FILE")
+        while pos != -1:
+            if (block_start + pos - region_start) % SECTOR_SIZE == 0:
+                header = parse_record_header(block, pos)
+                if header is not None:
+                    size = header["record_size"]
+                    votes[(block_start + pos - header["record_no"] * size,
+                           size, header["sector_size"])] += 1
+                    record = undo_fixups(block[pos:pos + size], header["sector_size"])
+                    if record is not None and len(record) == size:
+                        info = nonresident_data(record)
+                        if info is not None:
+                            data_runs.append(info["runs"])
+            pos = block.find(b"FILE", pos + 4)
+    return votes, data_runs
+
+
+# --- SUY RA HÌNH HỌC ---
+
+def _read_record(sr, offset, record_size, sector_size):
+    raw = sr.read(offset, record_size)
+    header = parse_record_header(raw)
+    if header is None or header["record_size"] != record_size:
+        return None, None
+    return header, undo_fixups(raw, sector_size)
+
+def _check_candidate(sr, mft_start, record_size, sector_size, start_lba):
+    """
+    Kiểm tra một vị trí đầu MFT ứng viên. Vị trí đó có thể là $MFT hoặc $MFTMirr (cả hai
+    đều bắt đầu bằng record 0), nên thử cả hai giả thuyết và chỉ nhận giả thuyết mà bản sao
+    còn lại (ở LCN do runlist chỉ ra) trùng với record 0 đang đọc.
+    """
+    header0, record0 = _read_record(sr, mft_start, record_size, sector_size)
+    header1, record1 = _read_record(sr, mft_start + record_size, record_size, sector_size)
+    if record0 is None or record1 is None or header0["record_no"] != 0 or header1["record_no"] != 1:
+        return None
+    mft = nonresident_data(record0)
+    mirr = nonresident_data(record1)
+    if mft is None or mirr is None or mft["runs"][0][0] is None or mirr["runs"][0][0] is None:
+        return None
+
+    clusters = sum(count for _, count in mft["runs"])
+    cluster_size = mft["allocated_size"] // clusters if clusters else 0
+    if (cluster_size < sector_size or cluster_size > MAX_CLUSTER_SIZE
+            or cluster_size & (cluster_size - 1) or cluster_size * clusters != mft["allocated_size"]):
+        return None
+
+    mft_lcn, mirr_lcn = mft["runs"][0][0], mirr["runs"][0][0]
+    for here, there, role in ((mft_lcn, mirr_lcn, "mft"), (mirr_lcn, mft_lcn, "mftmirr")):
+        partition_offset = mft_start - here * cluster_size
+        if partition_offset < 0 or partition_offset % SECTOR_SIZE:
+            continue
+        if start_lba is not None and partition_offset != start_lba * SECTOR_SIZE:
+            continue
+        _, copy0 = _read_record(sr, partition_offset + there * cluster_size, record_size, sector_size)
+        if copy0 is not None and copy0 == record0:
+            return {"partition_offset": partition_offset, "bytes_per_cluster": cluster_size,
+                    "mft_lcn": mft_lcn, "mftmirr_lcn": mirr_lcn, "mft_runs": mft["runs"],
+                    "sampled_role": role}
+    return None
+
+def infer_geometry(image_path, start_lba=None, num_sectors=None, samples=DEFAULT_SAMPLES,
+                   block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Suy ra hình học volume NTFS mà không cần boot sector.
+    start_lba/num_sectors (tùy chọn, lấy từ bảng phân vùng) thu hẹp vùng lấy mẫu và cố định
+    vị trí phân vùng; không có thì tự suy ra từ vị trí MFT.
+    Trả về dict hình học (kèm reads, bytes_read, checks) hoặc None nếu không suy ra được.
+    """
+    with open(image_path, "rb") as f:
+        sr = _SampleReader(f)
+        region_start = start_lba * SECTOR_SIZE if start_lba is not None else 0
+        region_end = sr.size
+        if start_lba is not None and num_sectors:
+            region_end = min(sr.size, (start_lba + num_sectors) * SECTOR_SIZE)
+
+        votes, data_runs = sample_records(sr, region_start, region_end, samples, block_size)
+        while not votes and samples < MAX_SAMPLES:
+            samples *= 4
+            votes, data_runs = sample_records(sr, region_start, region_end, samples, block_size)
+        geometry = None
+        for (mft_start, record_size, sector_size), _ in votes.most_common(MAX_CANDIDATES):
+            geometry = _check_candidate(sr, mft_start, record_size, sector_size, start_lba)
+            if geometry is not None:
+                geometry.update(record_size=record_size, bytes_per_sector=sector_size)
+                break
+        if geometry is None:
+            print(f"[!] Không suy ra được hình học volume ({sum(votes.values())} FILE record "
+                  f"trong {sr.reads} khối mẫu).")
+            return None
+
+        # Kích thước volume: theo bảng phân vùng nếu có, không thì tới cuối ảnh;
+        # sector cuối dành cho VBR backup
+        partition_offset = geometry["partition_offset"]
+        cluster_size = geometry["bytes_per_cluster"]
+        if num_sectors:
+            volume_bytes = (num_sectors - 1) * SECTOR_SIZE
+        else:
+            disk_end = sr.size
+            if sr.read(sr.size - SECTOR_SIZE, 8) == b"EFI PART":
+                # GPT backup: 32 sector entry + header ở cuối đĩa, không thuộc volume
+                disk_end -= 33 * SECTOR_SIZE
+            volume_bytes = disk_end - partition_offset - SECTOR_SIZE
+        total_sectors = volume_bytes // SECTOR_SIZE
+        total_clusters = volume_bytes // cluster_size
+
+        # Đối chiếu chéo: mọi run của các record đã carve phải nằm trong volume
+        ends = [lcn + count for runs in data_runs + [geometry["mft_runs"]]
+                for lcn, count in runs if lcn is not None]
+        in_volume = sum(1 for end in ends if 0 < end <= total_clusters)
+        checks = {
+            "mftmirr_matches": True,
+            "runs_checked": len(ends),
+            "runs_in_volume": in_volume,
+            "mft_in_volume": geometry["mft_lcn"] < total_clusters and geometry["mftmirr_lcn"] < total_clusters,
+        }
+        if ends and in_volume < len(ends):
+            print(f"[!] {len(ends) - in_volume}/{len(ends)} run vượt ra ngoài volume suy ra "
+                  f"({total_clusters} cluster) - kích thước volume có thể sai.")
+
+        geometry.pop("mft_runs")
+        geometry.update(
+            start_lba=partition_offset // SECTOR_SIZE,
+            sectors_per_cluster=cluster_size // SECTOR_SIZE,
+            total_sectors=total_sectors,
+            total_clusters=total_clusters,
+            votes=sum(votes.values()),
+            reads=sr.reads,
+            bytes_read=sr.bytes_read,
+            checks=checks,
+        )
+    return geometry
+
+
+# --- DỰNG BOOT SECTOR ---
+
+def encode_clusters_per_record(record_size, cluster_size):
+    if record_size >= cluster_size:
+        return record_size // cluster_size
+    return -(record_size.bit_length() - 1)
+
+def build_boot_sector(bytes_per_sector, sectors_per_cluster, total_sectors, mft_lcn,
+                      mftmirr_lcn, record_size=1024, hidden_sectors=0, serial=0):
+    """Tạo boot sector NTFS 512 byte hợp lệ."""
+    cluster_size = bytes_per_sector * sectors_per_cluster
+    bs = bytearray(SECTOR_SIZE)
+    bs[0:3] = b"\xEB\x52\x90"
+    bs[3:11] = b"NTFS    "
+    struct.pack_into("<HB", bs, 0x0B, bytes_per_sector, sectors_per_cluster)
+    bs[0x15] = 0xF8
+    struct.pack_into("<HHI", bs, 0x18, 63, 255, hidden_sectors & 0xFFFFFFFF)
+    struct.pack_into("<IQQQ", bs, 0x24, 0x00800080, total_sectors, mft_lcn, mftmirr_lcn)
+    struct.pack_into("<b", bs, 0x40, encode_clusters_per_record(record_size, cluster_size))
+    struct.pack_into("<b", bs, 0x44, encode_clusters_per_record(4096, cluster_size))
+    struct.pack_into("<Q", bs, 0x48, serial)
+    bs[510:512] = b"\x55\xAA"
+    return bytes(bs)
+
+def synthesize_boot_sector(geometry, serial=None):
+    """Dựng boot sector 512 byte từ hình học đã suy ra (boot code để trống)."""
+    if serial is None:
+        serial = int.from_bytes(os.urandom(8), "little")
+    # Trường bytes/sector của VBR luôn tính theo sector 512 mà các script này dùng
+    return build_boot_sector(SECTOR_SIZE, geometry["bytes_per_cluster"] // SECTOR_SIZE,
+                             geometry["total_sectors"], geometry["mft_lcn"],
+                             geometry["mftmirr_lcn"], geometry["record_size"],
+                             hidden_sectors=geometry["start_lba"], serial=serial)
+
+def rebuild_vbr(image_path, partition=None, write=True, samples=DEFAULT_SAMPLES):
+    """
+    Suy ra hình học rồi ghi boot sector tổng hợp vào VBR chính và VBR backup.
+    `partition` là dict từ ntfs_discovery (start_lba, num_sectors) nếu bảng phân vùng còn dùng được.
+    Trả về dict hình học (thêm khóa "boot_sector") hoặc None.
+    """
+    start_lba = partition["start_lba"] if partition else None
+    num_sectors = partition["num_sectors"] if partition else None
+    print("[+] Cả hai VBR đều hỏng: suy ra hình học volume từ các FILE record...")
+    geometry = infer_geometry(image_path, start_lba, num_sectors, samples=samples)
+    if geometry is None:
+        return None
+    boot = synthesize_boot_sector(geometry)
+    print(f"  Phân vùng bắt đầu tại LBA {geometry['start_lba']}, cluster {geometry['bytes_per_cluster']} byte, "
+          f"MFT LCN {geometry['mft_lcn']}, MFTMirr LCN {geometry['mftmirr_lcn']}, "
+          f"{geometry['total_sectors']} sector ({geometry['reads']} lần đọc mẫu)")
+    if write:
+        primary = geometry["start_lba"] * SECTOR_SIZE
+        backup = primary + geometry["total_sectors"] * SECTOR_SIZE
+        with open(image_path, "rb+") as f:
+            f.seek(primary)
+            f.write(boot)
+            f.seek(backup)
+            f.write(boot)
+        print(f"[+] Đã ghi boot sector tổng hợp tại 0x{primary:X} và backup tại 0x{backup:X}.")
+    return dict(geometry, boot_sector=boot)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Suy ra hình học NTFS từ MFT và dựng lại VBR")
+    ap.add_argument("image", help="Ảnh đĩa / volume")
+    ap.add_argument("--start-lba", type=int, default=None, help="LBA đầu phân vùng (nếu biết)")
+    ap.add_argument("--num-sectors", type=int, default=None, help="Số sector của phân vùng (nếu biết)")
+    ap.add_argument("--samples", type=int, default=DEFAULT_SAMPLES, help="Số khối lấy mẫu")
+    ap.add_argument("--write", action="store_true", help="Ghi boot sector tổng hợp vào ảnh")
+    args = ap.parse_args()
+
+    partition = None
+    if args.start_lba is not None:
+        partition = {"start_lba": args.start_lba, "num_sectors": args.num_sectors}
+    geometry = rebuild_vbr(args.image, partition, write=args.write, samples=args.samples)
+    if geometry is None:
+        raise SystemExit(1)
+    geometry.pop("boot_sector")
+    print(json.dumps(geometry, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+# ntfs_image_gen.py
+# Mục đích: sinh ảnh đĩa NTFS tổng hợp (thuần Python) để benchmark và kiểm tra
+# các hàm quét/khôi phục mà không cần VHD thật.
+# Hỗ trợ: MBR/GPT/raw, số lượng MFT record, phân mảnh, tỉ lệ file đã xóa,
+# file resident/non-resident, run thưa (sparse), run nén (LZNT1), VBR hỏng.
+
+import argparse
+import hashlib
+import json
+import random
+import struct
+import uuid
+import zlib
+
+from ntfs_geometry import build_boot_sector
+from partition import make_mbr_with_partitions
+
+SECTOR_SIZE = 512
+PARTITION_START_LBA = 2048        # Căn lề 1 MiB giống Windows
+MFT_LCN = 16                      # Vị trí MFT trong ảnh tổng hợp
+COMPRESSION_UNIT = 4              # 2^4 = 16 cluster / compression unit
+SYSTEM_RECORDS = 16               # Record 0..15 dành cho file hệ thống
+
+# GUID "Microsoft basic data" (phân vùng dữ liệu NTFS trên GPT)
+GPT_BASIC_DATA_GUID = uuid.UUID("EBD0A0A2-B9E5-4433-87C0-68B6B72699C7")
+
+SYSTEM_NAMES = [
+    "$MFT", "$MFTMirr", "$LogFile", "$Volume", "$AttrDef", ".", "$Bitmap",
+    "$Boot", "$BadClus", "$Secure", "$UpCase", "$Extend",
+]
+
+# Chữ ký đầu file theo phần mở rộng (phần đuôi ghép thêm nếu có)
+FILE_KINDS = {
+    ".txt": (b"", b""),
+    ".jpg": (b"\xFF\xD8\xFF\xE0\x00\x10JFIF\x00", b"\xFF\xD9"),
+    ".png": (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", b"IEND\xaeB`\x82"),
+    ".pdf": (b"%PDF-1.4\n", b"\n%%EOF\n"),
+    ".zip": (b"PK\x03\x04\x14\x00\x00\x00", b""),
+    ".bin": (b"", b""),
+}
+
+WORDS = (b"ntfs cluster record volume sector boot mirror index attribute "
+         b"runlist data khoi phuc tep tin bang thu muc ").split()
+
+# 2024-01-01 00:00:00 UTC dưới dạng FILETIME (100ns kể từ 1601-01-01)
+BASE_FILETIME = 133485408000000000
+
+
+# --- LZNT1 (NÉN) ---
+
+def _lznt1_split(pos):
+    """Trả về (length_mask, offset_shift) của token tại vị trí pos trong chunk."""
+    length_mask, offset_shift = 0xFFF, 12
+    p = pos - 1
+    while p >= 0x10:
+        length_mask >>= 1
+        offset_shift -= 1
+        p >>= 1
+    return length_mask, offset_shift
+
+def _lznt1_compress_chunk(chunk):
+    out = bytearray()
+    last_seen = {}
+    pos = 0
+    n = len(chunk)
+    while pos < n:
+        flag_index = len(out)
+        out.append(0)
+        flags = 0
+        for bit in range(8):
+            if pos >= n:
+                break
+            best_len = 0
+            best_off = 0
+            if pos >= 1 and pos + 3 <= n:
+                key = chunk[pos:pos + 3]
+                cand = last_seen.get(key)
+                if cand is not None:
+                    length_mask, offset_shift = _lznt1_split(pos)
+                    max_off = 1 << (16 - offset_shift)
+                    if pos - cand <= max_off:
+                        max_len = min(length_mask + 3, n - pos)
+                        length = 0
+                        while length < max_len and chunk[cand + length] == chunk[pos + length]:
+                            length += 1
+                        if length >= 3:
+                            best_len, best_off = length, pos - cand
+            if best_len:
+                length_mask, offset_shift = _lznt1_split(pos)
+                token = ((best_off - 1) << offset_shift) | (best_len - 3)
+                out += struct.pack("<H", token)
+                flags |= 1 << bit
+                for i in range(pos, pos + best_len):
+                    if i + 3 <= n:
+                        last_seen[chunk[i:i + 3]] = i
+                pos += best_len
+            else:
+                if pos + 3 <= n:
+                    last_seen[chunk[pos:pos + 3]] = pos
+                out.append(chunk[pos])
+                pos += 1
+        out[flag_index] = flags
+    return bytes(out)
+
+def _lznt1_pack_chunk(chunk):
+    """Đóng gói một chunk (<= 4096 byte) kèm header; chunk không nén được thì lưu thô."""
+    packed = _lznt1_compress_chunk(chunk)
+    if len(packed) < len(chunk):
+        return struct.pack("<H", 0xB000 | (len(packed) - 1)) + packed
+    return struct.pack("<H", 0x3000 | (len(chunk) - 1)) + chunk
+
+def lznt1_compress(data):
+    """
+    Nén dữ liệu theo định dạng LZNT1 (chunk 4096 byte).
+    Không ghi header kết thúc (0x0000).
+    """
+    return b"".join(_lznt1_pack_chunk(data[start:start + 4096])
+                    for start in range(0, len(data), 4096))
+
+
+# --- MÃ HÓA RUNLIST VÀ THUỘC TÍNH ---
+
+def _unsigned_size(value):
+    size = 1
+    while value >= 1 << (8 * size):
+        size += 1
+    return size
+
+def _signed_size(value):
+    size = 1
+    while not -(1 << (8 * size - 1)) <= value < (1 << (8 * size - 1)):
+        size += 1
+    return size
+
+def encode_runlist(runs):
+    """
+    Mã hóa danh sách (LCN, ClusterCount) thành runlist NTFS.
+    LCN = None biểu diễn run thưa (không có offset).
+    """
+    out = bytearray()
+    prev_lcn = 0
+    for lcn, count in runs:
+        len_size = _unsigned_size(count)
+        length = count.to_bytes(len_size, "little")
+        if lcn is None:
+            out.append(len_size)
+            out += length
+            continue
+        delta = lcn - prev_lcn
+        off_size = _signed_size(delta)
+        out.append((off_size << 4) | len_size)
+        out += length
+        out += delta.to_bytes(off_size, "little", signed=True)
+        prev_lcn = lcn
+    out.append(0x00)
+    return bytes(out)
+
+def _align8(data):
+    return data + b"\x00" * (-len(data) % 8)
+
+def resident_attribute(attr_type, content, attr_id):
+    header = struct.pack("<IIBBHHHIHBB", attr_type, 0, 0, 0, 0x18, 0, attr_id,
+                         len(content), 0x18, 0, 0)
+    attr = bytearray(_align8(header + content))
+    struct.pack_into("<I", attr, 4, len(attr))
+    return bytes(attr)
+
+def nonresident_attribute(attr_type, runs, attr_id, real_size, cluster_size,
+                          flags=0, compressed_size=None):
+    total_clusters = sum(count for _, count in runs)
+    runlist_offset = 0x48 if compressed_size is not None else 0x40
+    compression_unit = COMPRESSION_UNIT if flags & 0x0001 else 0
+    header = bytearray(runlist_offset)
+    struct.pack_into("<IIBBHHH", header, 0, attr_type, 0, 1, 0, runlist_offset, flags, attr_id)
+    struct.pack_into("<QQHH", header, 0x10, 0, max(total_clusters - 1, 0),
+                     runlist_offset, compression_unit)
+    struct.pack_into("<QQQ", header, 0x28, total_clusters * cluster_size, real_size, real_size)
+    if compressed_size is not None:
+        struct.pack_into("<Q", header, 0x40, compressed_size)
+    attr = bytearray(_align8(bytes(header) + encode_runlist(runs)))
+    struct.pack_into("<I", attr, 4, len(attr))
+    return bytes(attr)
+
+def standard_information(times):
+    """$STANDARD_INFORMATION (0x10): 4 FILETIME (C, M, MFT-M, A) + thuộc tính DOS."""
+    return struct.pack("<QQQQIIII", times[0], times[1], times[2], times[3], 0x20, 0, 0, 0)
+
+def file_name_content(name, parent_ref, times, real_size, alloc_size, is_dir=False):
+    encoded = name.encode("utf-16le")
+    return struct.pack("<QQQQQQQIIBB", parent_ref, times[0], times[1], times[2], times[3],
+                       alloc_size, real_size, 0x10000000 if is_dir else 0x20, 0,
+                       len(name), 3) + encoded
+
+def apply_fixups(record, usn=1):
+    """Ghi Update Sequence Array: thay 2 byte cuối mỗi sector 512 bằng USN."""
+    usa_offset, usa_count = struct.unpack_from("<HH", record, 4)
+    struct.pack_into("<H", record, usa_offset, usn)
+    for i in range(1, usa_count):
+        end = i * SECTOR_SIZE
+        record[usa_offset + 2 * i:usa_offset + 2 * i + 2] = record[end - 2:end]
+        struct.pack_into("<H", record, end - 2, usn)
+
+def build_file_record(record_no, record_size, attributes, in_use=True, is_dir=False, seq=1):
+    """Dựng một FILE record hoàn chỉnh (có fixup) từ danh sách thuộc tính đã mã hóa."""
+    record = bytearray(record_size)
+    usa_count = 1 + record_size // SECTOR_SIZE
+    first_attr = (0x30 + 2 * usa_count + 7) & ~7
+    flags = (0x01 if in_use else 0) | (0x02 if is_dir else 0)
+    struct.pack_into("<4sHHQHHHHIIQHHI", record, 0, b"FILE", 0x30, usa_count, 0, seq, 1,
+                     first_attr, flags, 0, record_size, 0, len(attributes) + 1, 0, record_no)
+    p = first_attr
+    for attr in attributes:
+        record[p:p + len(attr)] = attr
+        p += len(attr)
+    struct.pack_into("<II", record, p, 0xFFFFFFFF, 0)
+    used = p + 8
+    if used > record_size - 2:
+        raise ValueError(f"Record {record_no} vượt quá {record_size} byte")
+    struct.pack_into("<I", record, 0x18, used)
+    apply_fixups(record)
+    return record
+
+
+# --- BẢNG PHÂN VÙNG (boot sector: ntfs_geometry.build_boot_sector) ---
+
+def _gpt_header(current_lba, backup_lba, first_usable, last_usable, disk_guid,
+                entries_lba, entries_crc):
+    hdr = bytearray(92)
+    struct.pack_into("<8sIIIIQQQQ16sQIII", hdr, 0, b"EFI PART", 0x00010000, 92, 0, 0,
+                     current_lba, backup_lba, first_usable, last_usable, disk_guid.bytes_le,
+                     entries_lba, 128, 128, entries_crc)
+    struct.pack_into("<I", hdr, 16, _crc32(bytes(hdr)))
+    return bytes(hdr).ljust(SECTOR_SIZE, b"\x00")
+
+def _crc32(data):
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+def build_gpt(total_disk_sectors, start_lba, end_lba, rng):
+    """Trả về (protective_mbr, primary_gpt_bytes, backup_gpt_bytes) cho 1 phân vùng NTFS."""
+    entries = bytearray(128 * 128)
+    struct.pack_into("<16s16sQQQ", entries, 0, GPT_BASIC_DATA_GUID.bytes_le,
+                     uuid.UUID(int=rng.getrandbits(128)).bytes_le, start_lba, end_lba, 0)
+    entries[56:56 + 72] = "Basic data partition".encode("utf-16le").ljust(72, b"\x00")
+    entries_crc = _crc32(bytes(entries))
+    disk_guid = uuid.UUID(int=rng.getrandbits(128))
+    last_lba = total_disk_sectors - 1
+    primary = _gpt_header(1, last_lba, 34, last_lba - 33, disk_guid, 2, entries_crc)
+    backup = _gpt_header(last_lba, 1, 34, last_lba - 33, disk_guid, last_lba - 32, entries_crc)
+    pmbr = make_mbr_with_partitions([{
+        "type": 0xEE, "start_lba": 1, "num_sectors": min(total_disk_sectors - 1, 0xFFFFFFFF),
+    }])
+    pmbr = bytearray(pmbr)
+    pmbr[446] = 0x00  # Protective MBR không đánh dấu active
+    return bytes(pmbr), primary + bytes(entries), bytes(entries) + backup
+
+
+# --- NỘI DUNG FILE ---
+
+def _make_content(rng, ext, size):
+    head, tail = FILE_KINDS[ext]
+    if ext in (".txt", ".pdf"):
+        body = b" ".join(rng.choices(WORDS, k=size // 4 + 1))
+    else:
+        body = rng.randbytes(size)
+    data = (head + body)[:size]
+    if tail and size >= len(head) + len(tail):
+        data = data[:size - len(tail)] + tail
+    return data
+
+
+# --- CẤP PHÁT CLUSTER ---
+
+class _ClusterAllocator:
+    """Cấp phát cluster tuần tự, có chèn khoảng trống để tạo phân mảnh."""
+
+    def __init__(self, first_lcn, total_clusters, reserved, rng):
+        self.next_lcn = first_lcn
+        self.total_clusters = total_clusters
+        self.reserved = sorted(reserved)  # list (lcn, count) không được cấp phát
+        self.rng = rng
+
+    def _take(self, count):
+        while True:
+            lcn = self.next_lcn
+            clash = [r for r in self.reserved if lcn < r[0] + r[1] and r[0] < lcn + count]
+            if not clash:
+                break
+            self.next_lcn = clash[0][0] + clash[0][1]
+        if lcn + count > self.total_clusters:
+            raise ValueError("Ảnh quá nhỏ cho số lượng/kích thước file đã chọn")
+        self.next_lcn = lcn + count
+        return lcn
+
+    def allocate(self, count, fragmentation):
+        if count > 1 and self.rng.random() < fragmentation:
+            pieces = self.rng.randint(2, min(4, count))
+            cuts = sorted(self.rng.sample(range(1, count), pieces - 1))
+            sizes = [b - a for a, b in zip([0] + cuts, cuts + [count])]
+            extents = []
+            for size in sizes:
+                extents.append((self._take(size), size))
+                self.next_lcn += self.rng.randint(1, 8)
+            # Đảo thứ tự extent để runlist có offset âm
+            self.rng.shuffle(extents)
+            return extents
+        return [(self._take(count), count)]
+
+
+# --- SINH ẢNH ---
+
+def build_image(path, size_mb=64, scheme="mbr", records=2000, cluster_size=4096,
+                record_size=1024, fragmentation=0.0, deleted_ratio=0.3,
+                resident_ratio=0.3, sparse_ratio=0.0, compressed_ratio=0.0,
+                max_file_clusters=8, corrupt_vbr="none", seed=0):
+    """
+    Sinh một ảnh đĩa NTFS tổng hợp tại `path`.
+    scheme: "mbr", "gpt", "ebr" (phân vùng logic trong phân vùng mở rộng)
+            hoặc "raw" (volume bắt đầu ở offset 0).
+    corrupt_vbr: "none", "primary" hoặc "both" (hỏng cả VBR backup).
+    Trả về manifest (dict) mô tả hình học volume và từng file đã sinh.
+    """
+    if scheme not in ("mbr", "gpt", "ebr", "raw"):
+        raise ValueError(f"scheme không hợp lệ: {scheme}")
+    if cluster_size % SECTOR_SIZE or cluster_size // SECTOR_SIZE > 128:
+        raise ValueError(f"cluster_size không hợp lệ: {cluster_size}")
+    if records < SYSTEM_RECORDS:
+        raise ValueError(f"Cần ít nhất {SYSTEM_RECORDS} record")
+
+    rng = random.Random(seed)
+    disk_sectors = size_mb * 1024 * 1024 // SECTOR_SIZE
+    part_start = {"raw": 0, "ebr": 2 * PARTITION_START_LBA}.get(scheme, PARTITION_START_LBA)
+    part_end = disk_sectors - (33 if scheme == "gpt" else 0)   # exclusive
+    part_sectors = part_end - part_start
+    spc = cluster_size // SECTOR_SIZE
+    total_sectors = part_sectors - 1          # sector cuối dành cho VBR backup
+    total_clusters = total_sectors // spc
+    volume_offset = part_start * SECTOR_SIZE
+
+    mft_clusters = -(-records * record_size // cluster_size)
+    mirr_clusters = -(-4 * record_size // cluster_size)
+    mftmirr_lcn = total_clusters // 2
+    if MFT_LCN + mft_clusters >= mftmirr_lcn:
+        raise ValueError("Ảnh quá nhỏ cho số lượng MFT record đã chọn")
+
+    allocator = _ClusterAllocator(MFT_LCN + mft_clusters, total_clusters,
+                                  [(mftmirr_lcn, mirr_clusters)], rng)
+    mft = bytearray(records * record_size)
+    files = []
+    compressed_pool = {}
+
+    with open(path, "wb") as img:
+        img.truncate(disk_sectors * SECTOR_SIZE)
+
+        def write_clusters(lcn, data):
+            img.seek(volume_offset + lcn * cluster_size)
+            img.write(data)
+
+        def put_record(record_no, record):
+            mft[record_no * record_size:(record_no + 1) * record_size] = record
+
+        # Record hệ thống
+        for record_no in range(SYSTEM_RECORDS):
+            times = [BASE_FILETIME] * 4
+            name = SYSTEM_NAMES[record_no] if record_no < len(SYSTEM_NAMES) else ""
+            attrs = [resident_attribute(0x10, standard_information(times), 0)]
+            if name:
+                attrs.append(resident_attribute(0x30, file_name_content(
+                    name, (1 << 48) | 5, times, 0, 0, is_dir=(record_no == 5)), 1))
+            if record_no == 0:
+                attrs.append(nonresident_attribute(0x80, [(MFT_LCN, mft_clusters)], 2,
+                                                   records * record_size, cluster_size))
+            elif record_no == 1:
+                attrs.append(nonresident_attribute(0x80, [(mftmirr_lcn, mirr_clusters)], 2,
+                                                   4 * record_size, cluster_size))
+            elif record_no != 5:
+                attrs.append(resident_attribute(0x80, b"", 2))
+            put_record(record_no, build_file_record(record_no, record_size, attrs,
+                                                    is_dir=(record_no == 5)))
+
+        # Record người dùng
+        exts = sorted(FILE_KINDS)
+        for record_no in range(SYSTEM_RECORDS, records):
+            ext = rng.choice(exts)
+            name = f"file_{record_no:06d}{ext}"
+            deleted = rng.random() < deleted_ratio
+            created = BASE_FILETIME + rng.randrange(0, 365 * 86400) * 10_000_000
+            times = [created + i * rng.randrange(0, 86400) * 10_000_000 for i in range(4)]
+            attrs = [resident_attribute(0x10, standard_information(times), 0)]
+            entry = {"record_no": record_no, "name": name, "deleted": deleted,
+                     "offset": volume_offset + MFT_LCN * cluster_size + record_no * record_size}
+            kind = rng.random()
+
+            if kind < resident_ratio:
+                size = rng.randint(1, 256)
+                content = _make_content(rng, ext, size)
+                data_attr = resident_attribute(0x80, content, 2)
+                entry.update(kind="resident", runs=[])
+                alloc = 0
+            elif kind < resident_ratio + sparse_ratio:
+                lead = rng.randint(1, max_file_clusters)
+                hole = rng.randint(16, 256)
+                trail = rng.randint(1, max_file_clusters)
+                head = allocator.allocate(lead, fragmentation)
+                tail = allocator.allocate(trail, fragmentation)
+                runs = head + [(None, hole)] + tail
+                lead_data = _make_content(rng, ext, lead * cluster_size)
+                trail_data = _make_content(rng, ".bin", trail * cluster_size)
+                _write_runs(write_clusters, head, lead_data, cluster_size)
+                _write_runs(write_clusters, tail, trail_data, cluster_size)
+                content = lead_data + b"\x00" * (hole * cluster_size) + trail_data
+                size = len(content)
+                data_attr = nonresident_attribute(0x80, runs, 2, size, cluster_size, flags=0x8000)
+                entry.update(kind="sparse", runs=runs)
+                alloc = sum(c for _, c in runs) * cluster_size
+            elif kind < resident_ratio + sparse_ratio + compressed_ratio:
+                unit_clusters = 1 << COMPRESSION_UNIT
+                units = rng.randint(1, 3)
+                runs = []
+                blocks = []
+                stored = 0
+                for u in range(units):
+                    # Khối cuối có thể ngắn hơn một compression unit
+                    used_clusters = unit_clusters if u < units - 1 else rng.randint(1, unit_clusters)
+                    block, packed = _compressed_block(compressed_pool, rng, cluster_size,
+                                                      used_clusters)
+                    blocks.append(block)
+                    used = -(-len(packed) // cluster_size)
+                    if used < used_clusters:
+                        extents = allocator.allocate(used, 0.0)
+                        _write_runs(write_clusters, extents, packed, cluster_size)
+                        runs += extents + [(None, unit_clusters - used)]
+                    else:
+                        used = used_clusters
+                        extents = allocator.allocate(used, 0.0)
+                        _write_runs(write_clusters, extents, block, cluster_size)
+                        runs += extents
+                    stored += used
+                content = b"".join(blocks)
+                size = len(content) - rng.randint(0, cluster_size - 1)
+                content = content[:size]
+                data_attr = nonresident_attribute(0x80, runs, 2, size, cluster_size, flags=0x0001,
+                                                  compressed_size=stored * cluster_size)
+                entry.update(kind="compressed", runs=runs)
+                alloc = sum(c for _, c in runs) * cluster_size
+            else:
+                count = rng.randint(1, max_file_clusters)
+                size = (count - 1) * cluster_size + rng.randint(1, cluster_size)
+                content = _make_content(rng, ext, size)
+                runs = allocator.allocate(count, fragmentation)
+                _write_runs(write_clusters, runs, content, cluster_size)
+                data_attr = nonresident_attribute(0x80, runs, 2, size, cluster_size)
+                entry.update(kind="nonresident", runs=runs)
+                alloc = count * cluster_size
+
+            attrs.append(resident_attribute(0x30, file_name_content(
+                name, (1 << 48) | 5, times, size, alloc), 1))
+            attrs.append(data_attr)
+            put_record(record_no, build_file_record(record_no, record_size, attrs,
+                                                    in_use=not deleted))
+            entry.update(size=size, sha1=hashlib.sha1(content).hexdigest(), times=times)
+            files.append(entry)
+
+        write_clusters(MFT_LCN, mft)
+        write_clusters(mftmirr_lcn, mft[:4 * record_size])
+
+        boot = build_boot_sector(SECTOR_SIZE, spc, total_sectors, MFT_LCN, mftmirr_lcn,
+                                 record_size, hidden_sectors=part_start,
+                                 serial=rng.getrandbits(64))
+        primary_vbr = boot
+        backup_vbr = boot
+        if corrupt_vbr in ("primary", "both"):
+            primary_vbr = rng.randbytes(SECTOR_SIZE)
+        if corrupt_vbr == "both":
+            backup_vbr = rng.randbytes(SECTOR_SIZE)
+        img.seek(volume_offset)
+        img.write(primary_vbr)
+        img.seek((part_end - 1) * SECTOR_SIZE)
+        img.write(backup_vbr)
+
+        if scheme == "mbr":
+            img.seek(0)
+            img.write(make_mbr_with_partitions([{
+                "type": 0x07, "start_lba": part_start, "num_sectors": part_sectors,
+            }]))
+        elif scheme == "ebr":
+            # MBR: một phân vùng mở rộng; EBR đầu tiên chứa phân vùng logic NTFS
+            img.seek(0)
+            img.write(make_mbr_with_partitions([{
+                "type": 0x0F, "start_lba": PARTITION_START_LBA,
+                "num_sectors": disk_sectors - PARTITION_START_LBA,
+            }]))
+            ebr = bytearray(make_mbr_with_partitions([{
+                "type": 0x07, "start_lba": part_start - PARTITION_START_LBA,
+                "num_sectors": part_sectors,
+            }]))
+            ebr[446] = 0x00
+            img.seek(PARTITION_START_LBA * SECTOR_SIZE)
+            img.write(ebr)
+        elif scheme == "gpt":
+            pmbr, primary_gpt, backup_gpt = build_gpt(disk_sectors, part_start, part_end - 1, rng)
+            img.seek(0)
+            img.write(pmbr + primary_gpt)
+            img.seek((disk_sectors - 33) * SECTOR_SIZE)
+            img.write(backup_gpt)
+
+    return {
+        "image": path,
+        "scheme": scheme,
+        "seed": seed,
+        "image_size": disk_sectors * SECTOR_SIZE,
+        "partition_offset": volume_offset,
+        "partition_sectors": part_sectors,
+        "bytes_per_sector": SECTOR_SIZE,
+        "bytes_per_cluster": cluster_size,
+        "total_sectors": total_sectors,
+        "total_clusters": total_clusters,
+        "mft_lcn": MFT_LCN,
+        "mftmirr_lcn": mftmirr_lcn,
+        "record_size": record_size,
+        "records": records,
+        "corrupt_vbr": corrupt_vbr,
+        "files": files,
+    }
+
+def _compressed_block(pool, rng, cluster_size, clusters):
+    """
+    Lấy một khối văn bản `clusters` cluster và bản nén LZNT1 của nó.
+    Dùng lại một tập nhỏ khối mẫu để việc nén thuần Python không làm chậm bộ sinh.
+    """
+    index = rng.randrange(8)
+    source = pool.get(index)
+    if source is None:
+        unit = (1 << COMPRESSION_UNIT) * cluster_size
+        source = pool[index] = _make_content(random.Random(index), ".txt", unit)
+    block = source[:clusters * cluster_size]
+    packed = []
+    for start in range(0, len(block), 4096):
+        key = (index, start, min(4096, len(block) - start))
+        if key not in pool:
+            pool[key] = _lznt1_pack_chunk(block[start:start + 4096])
+        packed.append(pool[key])
+    return block, b"".join(packed)
+
+def _write_runs(write_clusters, runs, data, cluster_size):
+    """Ghi `data` lần lượt vào các extent (LCN, count) theo thứ tự VCN."""
+    pos = 0
+    for lcn, count in runs:
+        piece = data[pos:pos + count * cluster_size]
+        if piece:
+            write_clusters(lcn, piece)
+        pos += count * cluster_size
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sinh ảnh đĩa NTFS tổng hợp để benchmark/kiểm tra.")
+    ap.add_argument("image")
+    ap.add_argument("--size-mb", type=int, default=64)
+    ap.add_argument("--scheme", choices=["mbr", "gpt", "ebr", "raw"], default="mbr")
+    ap.add_argument("--records", type=int, default=2000)
+    ap.add_argument("--cluster-size", type=int, default=4096)
+    ap.add_argument("--record-size", type=int, default=1024)
+    ap.add_argument("--fragmentation", type=float, default=0.0)
+    ap.add_argument("--deleted-ratio", type=float, default=0.3)
+    ap.add_argument("--resident-ratio", type=float, default=0.3)
+    ap.add_argument("--sparse-ratio", type=float, default=0.0)
+    ap.add_argument("--compressed-ratio", type=float, default=0.0)
+    ap.add_argument("--corrupt-vbr", choices=["none", "primary", "both"], default="none")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    manifest = build_image(args.image, size_mb=args.size_mb, scheme=args.scheme,
+                           records=args.records, cluster_size=args.cluster_size,
+                           record_size=args.record_size, fragmentation=args.fragmentation,
+                           deleted_ratio=args.deleted_ratio, resident_ratio=args.resident_ratio,
+                           sparse_ratio=args.sparse_ratio, compressed_ratio=args.compressed_ratio,
+                           corrupt_vbr=args.corrupt_vbr, seed=args.seed)
+    manifest_path = args.image + ".json"
+    with open(manifest_path, "w") as mf:
+        json.dump(manifest, mf, indent=2)
+    print(f"[+] Đã sinh {args.image} ({len(manifest['files'])} file), manifest: {manifest_path}")
+
+if __name__ == "__main__":
+    main()
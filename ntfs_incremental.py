@@ -0,0 +1,222 @@
+# ntfs_incremental.py
+# Mục đích: quét lại MFT tăng dần cho các lần chụp ảnh lặp lại của cùng một volume (ổ đĩa sắp
+# hỏng, VM được image nhiều lần trong ngày).
+# - Vùng MFT được chia thành các khúc 1 MiB; mỗi khúc có digest blake2b của toàn bộ byte record.
+# - Kết quả phân tích từng khúc (record FILE, file đã xóa còn data runs) được lưu trong file trạng
+#   thái (<state>): một dòng JSON header, sau đó mỗi khúc một dòng JSON.
+# - Lần quét sau vẫn đọc hết MFT (phải đọc mới băm được) nhưng chỉ phân tích lại khúc có digest
+#   khác; khúc không đổi lấy nguyên kết quả cũ, không parse, không đọc record lần hai ở giai đoạn 3.
+# - So record của các khúc đổi với lần trước để lập báo cáo delta: record được tạo, bị xóa, bị sửa.
+
+import hashlib
+import json
+import os
+import struct
+import time
+from array import array
+
+from ntfs_archive import record_name_and_time
+from ntfs_metrics import METRICS
+from recovery_ntfs import (_iter_mft_records, parse_data_info, parse_file_name_attribute,
+                           parse_file_name_parent)
+
+CHUNK_BYTES = 1024 * 1024        # Đơn vị băm/so sánh của vùng MFT
+DIGEST_SIZE = 16                 # Digest của một khúc
+RECORD_DIGEST_SIZE = 8           # Digest của một record (phát hiện record bị sửa trong khúc đổi)
+STATE_VERSION = 1
+NO_NAME = "<không có tên>"       # Giá trị parse_file_name_attribute trả về khi không có $FILE_NAME
+DELTA_KINDS = ("created", "deleted", "modified")
+CHUNK_KEYS = {"chunk", "digest", "records", "candidates"}   # Khóa bắt buộc của một khúc trong STATE
+
+
+# --- FILE TRẠNG THÁI ---
+
+def _header(volume, ntfs_info):
+    return {"version": STATE_VERSION, "mft_offset": volume.absolute(ntfs_info["MFT_Offset"]),
+            "record_size": ntfs_info["BytesPerFileRecord"], "chunk_bytes": CHUNK_BYTES}
+
+def load_state(path, header):
+    """{chỉ số khúc: dict khúc} của lần quét trước, hoặc None nếu không có/không khớp hình học."""
+    try:
+        with open(path, encoding="utf-8") as sf:
+            saved = json.loads(sf.readline())
+            if {k: saved.get(k) for k in header} != header:
+                print(f"[!] Trạng thái '{path}' thuộc MFT khác (offset/kích thước record), quét lại từ đầu.")
+                return None
+            chunks = {}
+            for line in sf:
+                chunk = json.loads(line)
+                if not isinstance(chunk, dict) or not CHUNK_KEYS <= chunk.keys():
+                    raise ValueError(f"khúc hỏng: {line[:60]!r}")
+                chunks[chunk["chunk"]] = chunk
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[!] Không đọc được trạng thái '{path}': {e}. Quét lại từ đầu.")
+        return None
+    return chunks
+
+def save_state(path, header, chunks):
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as sf:
+            sf.write(json.dumps(dict(header, captured=time.time())) + "\n")
+            for index in sorted(chunks):
+                sf.write(json.dumps(chunks[index], ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"[!] Không ghi được trạng thái '{path}': {e}")
+
+
+# --- PHÂN TÍCH MỘT KHÚC ---
+
+def _parse_record(index, data):
+    """
+    (record, ứng viên | None) của một FILE record. record: [chỉ số, số record, sequence, cờ,
+    digest, tên]; ứng viên giống điều kiện của giai đoạn 3: đã xóa, có tên, có data run không thưa.
+    """
+    flags, = struct.unpack_from("<H", data, 0x16)
+    sequence, = struct.unpack_from("<H", data, 0x10)
+    record_no = struct.unpack_from("<I", data, 0x2C)[0] if len(data) >= 0x30 else index
+    name = parse_file_name_attribute(data)
+    record = [index, record_no, sequence, flags,
+              hashlib.blake2b(data, digest_size=RECORD_DIGEST_SIZE).hexdigest(), name]
+    if flags & 0x0001 or name == NO_NAME:
+        return record, None
+    info = parse_data_info(data)
+    if info is None or info["resident"] or all(lcn is None for lcn, _ in info["runs"]):
+        return record, None
+    primary, parent, mtime = record_name_and_time(data)
+    return record, {"index": index, "record_no": record_no, "flags": flags, "name": name,
+                    "parent_ref": parse_file_name_parent(data), "data": info,
+                    "primary": [primary, parent], "mtime": mtime}
+
+def _parse_chunk(number, digest, records):
+    chunk = {"chunk": number, "digest": digest, "records": [], "candidates": []}
+    for index, _, data in records:
+        if data[0:4] != b"FILE":
+            continue
+        record, candidate = _parse_record(index, data)
+        chunk["records"].append(record)
+        if candidate is not None:
+            chunk["candidates"].append(candidate)
+    METRICS.count("phase2_mft_scan.records_parsed", len(records))
+    return chunk
+
+
+# --- SO SÁNH HAI LẦN CHỤP ---
+
+def _delta_entry(record, base, record_size):
+    index, record_no, sequence, flags, _, name = record
+    return {"record_no": record_no, "offset": base + index * record_size, "name": name,
+            "sequence": sequence, "in_use": bool(flags & 0x0001)}
+
+def diff_records(old_records, new_records, delta, base, record_size):
+    """
+    Thêm vào `delta` các thay đổi giữa hai danh sách record của cùng một khúc:
+    created = slot có record đang dùng mới (hoặc được dùng lại với sequence khác),
+    deleted = record đang dùng không còn dùng, modified = cùng record nhưng nội dung khác
+    (kể cả record đã xóa bị ghi đè; mất hẳn chữ ký FILE thì in_use là None).
+    """
+    old = {r[0]: r for r in old_records}
+    new = {r[0]: r for r in new_records}
+    for index in sorted(old.keys() | new.keys()):
+        before, after = old.get(index), new.get(index)
+        if before is not None and after is not None and before[4] == after[4]:
+            continue
+        was_live = before is not None and before[3] & 0x0001
+        is_live = after is not None and after[3] & 0x0001
+        if is_live and (not was_live or before[1:3] != after[1:3]):
+            if was_live:
+                delta["deleted"].append(_delta_entry(before, base, record_size))
+            delta["created"].append(_delta_entry(after, base, record_size))
+        elif was_live and not is_live:
+            delta["deleted"].append(_delta_entry(after or before, base, record_size))
+        elif after is not None:
+            delta["modified"].append(_delta_entry(after, base, record_size))
+        elif before is not None:
+            delta["modified"].append(dict(_delta_entry(before, base, record_size), in_use=None))
+
+
+# --- QUÉT TĂNG DẦN ---
+
+def scan_mft_incremental(volume, ntfs_info, state_path, max_records, output_file, record_sink=None):
+    """
+    Thay cho read_mft_records + phần đọc/parse record của giai đoạn 3 khi quét lặp lại.
+    Trả về (offset record FILE trong volume, list ứng viên, delta). Ứng viên là dict (index,
+    record_no, flags, name, parent_ref, data, primary, mtime); delta là dict số liệu, kèm đường
+    dẫn báo cáo chi tiết <state>.delta.json khi có lần quét trước để so sánh.
+    record_sink và output_file giống read_mft_records (offset tuyệt đối).
+    """
+    start, record_size = ntfs_info["MFT_Offset"], ntfs_info["BytesPerFileRecord"]
+    base = volume.absolute(start)
+    per_chunk = max(1, CHUNK_BYTES // record_size)
+    header = _header(volume, ntfs_info)
+    previous = load_state(state_path, header)
+    chunks = {}
+    delta = {kind: [] for kind in DELTA_KINDS}
+    stats = {"chunks": 0, "chunks_reused": 0, "chunks_parsed": 0}
+    valid_records = array("Q")
+    print(f"[+] Quét tăng dần {max_records} record MFT tại offset {start} "
+          f"({'so với ' + state_path if previous is not None else 'lần đầu, tạo ' + state_path})...\n")
+
+    def finish_chunk(number, hasher, records):
+        digest = hasher.hexdigest()
+        old = previous.get(number) if previous is not None else None
+        stats["chunks"] += 1
+        if old is not None and old["digest"] == digest:
+            chunks[number] = old
+            stats["chunks_reused"] += 1
+            return
+        chunks[number] = _parse_chunk(number, digest, records)
+        stats["chunks_parsed"] += 1
+        if previous is not None:
+            diff_records(old["records"] if old else [], chunks[number]["records"], delta, base, record_size)
+
+    number, hasher, records = 0, hashlib.blake2b(digest_size=DIGEST_SIZE), []
+    scanned = 0
+    for i, record_offset, data in _iter_mft_records(volume.path, start, record_size, max_records, volume):
+        if len(data) < record_size:
+            print(f"[!] Record {i}: Dữ liệu không đủ. Dừng quét.")
+            break
+        scanned += 1
+        if i // per_chunk != number:
+            finish_chunk(number, hasher, records)
+            number, hasher, records = i // per_chunk, hashlib.blake2b(digest_size=DIGEST_SIZE), []
+        hasher.update(data)
+        records.append((i, record_offset, data))
+        if data[0:4] != b"FILE":
+            continue
+        deleted = not (struct.unpack_from("<H", data, 0x16)[0] & 0x0001)
+        METRICS.count("phase2_mft_scan.deleted" if deleted else "phase2_mft_scan.in_use")
+        valid_records.append(record_offset)
+        if record_sink is not None:
+            record_sink(i, volume.absolute(record_offset), data)
+    if records:
+        finish_chunk(number, hasher, records)
+    if previous is not None:
+        # Khúc của lần trước nằm ngoài lượt quét này (ảnh bị cắt ngắn): record đang dùng coi như bị xóa
+        for old_number in previous.keys() - chunks.keys():
+            diff_records(previous[old_number]["records"], [], delta, base, record_size)
+
+    METRICS.count("phase2_mft_scan.records", scanned)
+    for key in ("chunks_reused", "chunks_parsed"):
+        METRICS.count(f"phase2_mft_scan.{key}", stats[key])
+    with open(output_file, "w") as out_f:
+        for offset in valid_records:
+            out_f.write(f"{volume.absolute(offset)}\n")
+    if previous is None or stats["chunks_parsed"] or previous.keys() != chunks.keys():
+        save_state(state_path, header, chunks)   # Không đổi gì thì giữ nguyên file trạng thái
+
+    summary = dict(stats, baseline=previous is None)
+    if previous is not None:
+        summary.update({kind: len(delta[kind]) for kind in DELTA_KINDS})
+        summary["report"] = state_path + ".delta.json"
+        with open(summary["report"], "w", encoding="utf-8") as df:
+            json.dump(dict(summary, **delta), df, indent=2, ensure_ascii=False)
+        print(f"[+] Delta so với lần trước: {summary['created']} record tạo mới, "
+              f"{summary['deleted']} bị xóa, {summary['modified']} bị sửa -> '{summary['report']}'.")
+    print(f"[+] Phân tích lại {stats['chunks_parsed']}/{stats['chunks']} khúc MFT, "
+          f"dùng lại {stats['chunks_reused']} khúc. Đã ghi {len(valid_records)} offset vào '{output_file}'.")
+    candidates = [c for number in sorted(chunks) for c in chunks[number]["candidates"]]
+    return valid_records, candidates, summary
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# ntfs_knownfiles.py
+# Mục đích: lọc file "đã biết" (file hệ điều hành, ứng dụng...) khỏi kết quả khôi phục bằng một
+# tập hash kiểu NSRL (CSV có cột "SHA-1"/"MD5"/"SHA-256", hoặc text mỗi dòng một hash).
+# - Hash được nạp vào Bloom filter (vài bit mỗi hash) để loại nhanh phần lớn file không có trong
+#   tập; khi Bloom báo "có" thì xác nhận chính xác bằng tìm kiếm nhị phân trên mảng digest đã sắp
+#   xếp (bytes liền nhau, không tạo object cho từng hash).
+# - Cột tùy chọn "Head64K-SHA-1" (hash 64 KiB đầu, do lệnh `build` tạo ra) cho phép loại file lớn
+#   trước khi đọc hết nội dung.
+
+import argparse
+import csv
+import hashlib
+import math
+import os
+
+HEAD_SIZE = 64 * 1024                 # Hash phần đầu file dùng để loại sớm
+HEAD_CHECK_MIN_SIZE = 4 * 1024 * 1024  # Chỉ kiểm tra phần đầu với file từ 4 MiB trở lên
+DEFAULT_ERROR_RATE = 0.001
+HEAD_COLUMN = "Head64K-SHA-1"
+
+# Cột trong CSV (NSRL RDS) -> thuật toán hashlib; file text thì đoán theo độ dài hash
+COLUMNS = {"SHA-1": "sha1", "SHA1": "sha1", "MD5": "md5", "SHA-256": "sha256", "SHA256": "sha256"}
+HEX_LENGTHS = {32: "md5", 40: "sha1", 64: "sha256"}
+
+
+class BloomFilter:
+    """Bloom filter trên digest (vốn đã phân bố đều): vị trí bit lấy trực tiếp từ digest."""
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        capacity = max(1, capacity)
+        self.bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing: h1 + i*h2 từ hai nửa 8 byte đầu của digest
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest):
+        return all(self.array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+
+class SortedDigests:
+    """Tập digest độ dài cố định lưu trong một bytes đã sắp xếp; tra cứu bằng tìm kiếm nhị phân."""
+
+    def __init__(self, digests, size):
+        self.size = size
+        self.blob = b"".join(sorted(set(digests)))
+        self.count = len(self.blob) // size
+
+    def __contains__(self, digest):
+        lo, hi, size, blob = 0, self.count, self.size, self.blob
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = blob[mid * size:(mid + 1) * size]
+            if value < digest:
+                lo = mid + 1
+            elif value > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def __len__(self):
+        return self.count
+
+
+class KnownFileSet:
+    """
+    Tập hash file đã biết, mỗi thuật toán một cặp (BloomFilter, SortedDigests).
+    `head` (nếu có) là tập SHA-1 của 64 KiB đầu các file lớn.
+    """
+
+    def __init__(self, error_rate=DEFAULT_ERROR_RATE):
+        self.error_rate = error_rate
+        self.sets = {}     # algo -> (bloom, sorted digests)
+        self.head = None
+        self.stats = {"bloom_rejects": 0, "exact_checks": 0, "matches": 0, "head_matches": 0}
+
+    @classmethod
+    def load(cls, path, error_rate=DEFAULT_ERROR_RATE):
+        """Nạp CSV kiểu NSRL (có dòng tiêu đề) hoặc file text mỗi dòng một hash hex."""
+        known = cls(error_rate)
+        collected = {}
+        with open(path, newline="", encoding="utf-8", errors="replace") as hf:
+            first = hf.readline()
+            hf.seek(0)
+            if "," in first and any(col in first for col in list(COLUMNS) + [HEAD_COLUMN]):
+                for row in csv.DictReader(hf):
+                    for column, value in row.items():
+                        algo = COLUMNS.get((column or "").strip().upper())
+                        if column == HEAD_COLUMN:
+                            algo = "head"
+                        if algo and value:
+                            _collect(collected, algo, value)
+            else:
+                for line in hf:
+                    value = line.strip().split(",")[0].strip('"')
+                    algo = HEX_LENGTHS.get(len(value))
+                    if algo:
+                        _collect(collected, algo, value)
+        for algo, digests in collected.items():
+            exact = SortedDigests(digests, len(digests[0]))
+            bloom = BloomFilter(len(exact), error_rate)
+            for i in range(len(exact)):
+                bloom.add(exact.blob[i * exact.size:(i + 1) * exact.size])
+            if algo == "head":
+                known.head = (bloom, exact)
+            else:
+                known.sets[algo] = (bloom, exact)
+        return known
+
+    @property
+    def algorithms(self):
+        return sorted(self.sets)
+
+    def __len__(self):
+        return sum(len(exact) for _, exact in self.sets.values())
+
+    def _lookup(self, pair, digest):
+        bloom, exact = pair
+        if digest not in bloom:
+            self.stats["bloom_rejects"] += 1
+            return False
+        self.stats["exact_checks"] += 1
+        return digest in exact
+
+    def match(self, digests):
+        """digests: dict algo -> digest (bytes). Trả về thuật toán khớp đầu tiên hoặc None."""
+        for algo, digest in digests.items():
+            if algo in self.sets and self._lookup(self.sets[algo], digest):
+                self.stats["matches"] += 1
+                return algo
+        return None
+
+    def match_head(self, head):
+        """Khớp SHA-1 của 64 KiB đầu file (chỉ khi tập hash có cột Head64K-SHA-1)."""
+        if self.head is None or len(head) < HEAD_SIZE:
+            return False
+        if self._lookup(self.head, hashlib.sha1(head[:HEAD_SIZE]).digest()):
+            self.stats["head_matches"] += 1
+            return True
+        return False
+
+    def hasher(self):
+        return ContentHasher(self.algorithms)
+
+def _collect(collected, algo, value):
+    try:
+        digest = bytes.fromhex(value.strip().strip('"'))
+    except ValueError:
+        return
+    if digest:
+        collected.setdefault(algo, []).append(digest)
+
+
+class ContentHasher:
+    """Băm nội dung theo luồng bằng các thuật toán có trong tập hash."""
+
+    def __init__(self, algorithms):
+        self._hashes = {algo: hashlib.new(algo) for algo in algorithms}
+
+    def update(self, data):
+        for h in self._hashes.values():
+            h.update(data)
+
+    def digests(self):
+        return {algo: h.digest() for algo, h in self._hashes.items()}
+
+    def hexdigests(self):
+        return {algo: h.hexdigest() for algo, h in self._hashes.items()}
+
+
+# --- TẠO TẬP HASH TỪ THƯ MỤC FILE SẠCH ---
+
+def build_hash_set(directory, out_path, head_min_size=HEAD_CHECK_MIN_SIZE):
+    """
+    Băm mọi file trong `directory` (ví dụ một bản cài Windows sạch) ra CSV kiểu NSRL,
+    thêm cột Head64K-SHA-1 cho file từ `head_min_size` byte trở lên.
+    """
+    count = 0
+    with open(out_path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out, quoting=csv.QUOTE_ALL)
+        writer.writerow(["SHA-1", "MD5", "FileSize", "FileName", HEAD_COLUMN])
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                hasher = ContentHasher(("sha1", "md5"))
+                head = b""
+                size = 0
+                try:
+                    with open(path, "rb") as f:
+                        while True:
+                            chunk = f.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            if len(head) < HEAD_SIZE:
+                                head += chunk[:HEAD_SIZE - len(head)]
+                            hasher.update(chunk)
+                            size += len(chunk)
+                except OSError as e:
+                    print(f"[!] Bỏ qua {path}: {e}")
+                    continue
+                hexes = hasher.hexdigests()
+                head_hex = hashlib.sha1(head).hexdigest().upper() if size >= head_min_size else ""
+                writer.writerow([hexes["sha1"].upper(), hexes["md5"].upper(), size, name, head_hex])
+                count += 1
+    print(f"[+] Đã ghi {count} hash vào '{out_path}'.")
+    return count
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tập hash file đã biết (kiểu NSRL) cho bộ lọc khôi phục")
+    sub = ap.add_subparsers(dest="command", required=True)
+    bp = sub.add_parser("build", help="Băm một thư mục file sạch ra CSV")
+    bp.add_argument("directory")
+    bp.add_argument("output")
+    ip = sub.add_parser("info", help="Nạp tập hash và in thống kê")
+    ip.add_argument("hashes")
+    args = ap.parse_args()
+    if args.command == "build":
+        build_hash_set(args.directory, args.output)
+    else:
+        known = KnownFileSet.load(args.hashes)
+        for algo, (bloom, exact) in sorted(known.sets.items()):
+            print(f"  {algo}: {len(exact)} hash, Bloom {bloom.bits // 8} byte, {bloom.hashes} hàm băm")
+        if known.head is not None:
+            print(f"  head64k: {len(known.head[1])} hash")
+
+if __name__ == "__main__":
+    main()
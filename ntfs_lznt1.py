@@ -0,0 +1,210 @@
+# ntfs_lznt1.py
+# Mục đích: giải nén LZNT1 và ghép các compression unit của thuộc tính $DATA nén.
+# Một compression unit gồm 2^compression_unit cluster (thường 16): unit có ít cluster
+# thật hơn kích thước unit (phần đuôi là run thưa) là unit nén; unit đủ cluster lưu thô;
+# unit hoàn toàn thưa là toàn số 0.
+# Tối ưu: bảng (length_mask, offset_shift) dựng sẵn cho mọi vị trí trong chunk,
+# ghi vào một bytearray dùng lại, copy theo slice thay vì từng byte.
+
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 4096
+DEFAULT_UNIT_SHIFT = 4            # 2^4 = 16 cluster / compression unit
+POOL_MIN_BYTES = 8 * 1024 * 1024  # Dưới ngưỡng này giải nén tại chỗ, không đáng mở process pool
+UNIT_BATCH = 64                   # Số unit đọc/giải nén mỗi lô khi stream (64 x 16 cluster)
+
+
+def _build_split_table():
+    """Bảng (length_mask, offset_shift) theo vị trí giải nén trong chunk (0..4095)."""
+    table = []
+    for pos in range(CHUNK_SIZE):
+        length_mask, offset_shift = 0xFFF, 12
+        p = pos - 1
+        while p >= 0x10:
+            length_mask >>= 1
+            offset_shift -= 1
+            p >>= 1
+        table.append((length_mask, offset_shift))
+    return table
+
+_SPLIT = _build_split_table()
+
+
+def lznt1_decompress(data, out=None):
+    """
+    Giải nén một luồng LZNT1 (nhiều chunk). `out` (bytearray) cho phép dùng lại bộ đệm
+    giữa các lần gọi; dữ liệu giải nén được nối vào cuối `out`.
+    Chunk nén giải ra ít hơn 4096 byte mà chưa phải chunk cuối thì phần còn lại là số 0.
+    """
+    if out is None:
+        out = bytearray()
+    split = _SPLIT
+    n = len(data)
+    p = 0
+    while p + 2 <= n:
+        header = data[p] | (data[p + 1] << 8)
+        if header == 0:
+            break
+        size = (header & 0x0FFF) + 1
+        p += 2
+        end = min(p + size, n)
+        chunk_start = len(out)
+        if not header & 0x8000:
+            out += data[p:end]
+        else:
+            while p < end:
+                flags = data[p]
+                p += 1
+                if flags == 0:
+                    # 8 literal liền nhau: copy một lần
+                    out += data[p:min(p + 8, end)]
+                    p += 8
+                    continue
+                for _ in range(8):
+                    if p >= end:
+                        break
+                    if not flags & 1:
+                        out.append(data[p])
+                        p += 1
+                    else:
+                        if p + 1 >= end:
+                            p = end
+                            break
+                        token = data[p] | (data[p + 1] << 8)
+                        p += 2
+                        if len(out) - chunk_start >= CHUNK_SIZE:
+                            raise ValueError("LZNT1: chunk giải ra quá 4096 byte")
+                        length_mask, offset_shift = split[len(out) - chunk_start]
+                        offset = (token >> offset_shift) + 1
+                        length = (token & length_mask) + 3
+                        start = len(out) - offset
+                        if start < chunk_start:
+                            raise ValueError("LZNT1: back-reference ra ngoài chunk")
+                        if offset >= length:
+                            out += out[start:start + length]
+                        else:
+                            # Back-reference chồng lấn: lặp lại mẫu `offset` byte
+                            pattern = out[start:]
+                            out += (pattern * (length // offset + 1))[:length]
+                    flags >>= 1
+        p = end
+        produced = len(out) - chunk_start
+        if produced < CHUNK_SIZE and p + 2 <= n and (data[p] | (data[p + 1] << 8)):
+            out += bytes(CHUNK_SIZE - produced)
+    return out
+
+
+# --- COMPRESSION UNIT ---
+
+def split_compression_units(runs, unit_clusters):
+    """
+    Chia runlist (list (lcn | None, count)) thành các compression unit.
+    Trả về list (kind, extents, clusters): kind "sparse", "raw" hoặc "compressed";
+    extents là list (lcn, count) của các cluster thật trong unit.
+    """
+    units = []
+    extents, allocated, filled = [], 0, 0
+    for lcn, count in runs:
+        while count > 0:
+            take = min(count, unit_clusters - filled)
+            if lcn is not None:
+                if extents and extents[-1][0] + extents[-1][1] == lcn:
+                    extents[-1] = (extents[-1][0], extents[-1][1] + take)
+                else:
+                    extents.append((lcn, take))
+                allocated += take
+                lcn += take
+            filled += take
+            count -= take
+            if filled == unit_clusters:
+                units.append((_unit_kind(allocated, filled), extents, filled))
+                extents, allocated, filled = [], 0, 0
+    if filled:
+        # Unit cuối chưa đủ cluster (file kết thúc giữa unit)
+        units.append((_unit_kind(allocated, filled), extents, filled))
+    return units
+
+def _unit_kind(allocated, clusters):
+    if allocated == 0:
+        return "sparse"
+    return "raw" if allocated == clusters else "compressed"
+
+def decompress_unit(blob, unit_bytes):
+    """Giải nén một unit và đệm số 0 tới đúng unit_bytes."""
+    out = lznt1_decompress(blob)
+    if len(out) < unit_bytes:
+        out += bytes(unit_bytes - len(out))
+    return bytes(out[:unit_bytes])
+
+def _decompress_or_error(blob, unit_bytes):
+    """decompress_unit nhưng trả về ValueError thay vì ném (để một unit hỏng không làm hỏng cả lô)."""
+    try:
+        return decompress_unit(blob, unit_bytes)
+    except ValueError as e:
+        return e
+
+def iter_decompressed(units, blobs, cluster_size, real_size, workers=0, on_error=None):
+    """
+    Sinh dữ liệu file theo từng compression unit (kết quả split_compression_units).
+    `blobs` là iterable dữ liệu thô đã đọc của từng unit (cùng thứ tự; unit thưa có thể là b""),
+    được lấy dần theo lô UNIT_BATCH unit nên bộ nhớ chỉ cỡ một lô, không phải cả file.
+    Sinh tối đa real_size byte; unit đọc thiếu được đệm số 0 cho đủ kích thước unit.
+    workers > 1 và tổng dữ liệu nén đủ lớn: giải nén từng lô bằng một process pool
+    (giải nén thuần Python tốn CPU, không song song được bằng thread vì GIL).
+    Unit nén hỏng: có on_error thì gọi on_error(chỉ số unit, lỗi) và thay bằng số 0, không thì ném ValueError.
+    """
+    blobs = iter(blobs)
+    compressed = sum(count for kind, extents, _ in units if kind == "compressed"
+                     for _, count in extents) * cluster_size
+    pool = None
+    if workers > 1 and compressed >= POOL_MIN_BYTES:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        remaining = real_size
+        for start in range(0, len(units), UNIT_BATCH):
+            if remaining <= 0:
+                break
+            batch = units[start:start + UNIT_BATCH]
+            data = [next(blobs, b"") for _ in batch]
+            pending = [i for i, (kind, _, _) in enumerate(batch) if kind == "compressed"]
+            unit_bytes = max((batch[i][2] * cluster_size for i in pending), default=0)
+            if pool is not None and len(pending) > 1:
+                decoded = pool.map(_decompress_or_error, [data[i] for i in pending],
+                                   [unit_bytes] * len(pending),
+                                   chunksize=max(1, len(pending) // (workers * 4)))
+            else:
+                decoded = (_decompress_or_error(data[i], unit_bytes) for i in pending)
+            decoded = dict(zip(pending, decoded))
+            for i, (kind, _, clusters) in enumerate(batch):
+                if remaining <= 0:
+                    break
+                nbytes = clusters * cluster_size
+                if kind == "sparse":
+                    out = bytes(nbytes)
+                elif kind == "raw":
+                    out = data[i][:nbytes]
+                else:
+                    out = decoded[i]
+                    if isinstance(out, ValueError):
+                        if on_error is None:
+                            raise out
+                        on_error(start + i, out)
+                        out = bytes(nbytes)
+                    out = out[:nbytes]
+                if len(out) < nbytes:
+                    out += bytes(nbytes - len(out))
+                yield out[:remaining]
+                remaining -= nbytes
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+def assemble_compressed(units, unit_data, cluster_size, real_size, workers=0):
+    """
+    Ghép cả file trong bộ nhớ từ các unit và dữ liệu thô của từng unit (xem iter_decompressed).
+    Trả về bytes đã cắt đúng real_size.
+    """
+    return b"".join(iter_decompressed(units, unit_data, cluster_size, real_size, workers))
+
+def compression_unit_clusters(shift):
+    return 1 << (shift or DEFAULT_UNIT_SHIFT)
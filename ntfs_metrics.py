@@ -0,0 +1,146 @@
+# ntfs_metrics.py
+# Mục đích: lớp đo đạc dùng chung cho các script khôi phục NTFS.
+# - Bộ đếm thời gian theo giai đoạn (context manager) và bộ đếm sự kiện/byte.
+# - Xuất JSON (--metrics out.json), hook cProfile/tracemalloc tùy chọn.
+# - In tiến độ có giới hạn tần suất thay cho việc in từng record.
+
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Tập hợp thời gian theo giai đoạn và các bộ đếm (an toàn với nhiều luồng)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases = {}      # name -> {"seconds": float, "calls": int}
+            self.counters = {}    # name -> int
+            self.info = {}        # thông tin bổ sung (profile path, peak memory...)
+            self.started = time.time()
+
+    @contextmanager
+    def phase(self, name):
+        """Đo thời gian một khối lệnh; gọi nhiều lần thì cộng dồn."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                entry = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+                entry["seconds"] += elapsed
+                entry["calls"] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_read(self, nbytes, seeks=1):
+        """Ghi nhận một lần đọc đĩa (mỗi lần seek/read là một syscall)."""
+        with self._lock:
+            c = self.counters
+            c["io.read_calls"] = c.get("io.read_calls", 0) + 1
+            c["io.seek_calls"] = c.get("io.seek_calls", 0) + seeks
+            c["io.bytes_read"] = c.get("io.bytes_read", 0) + nbytes
+
+    def snapshot(self):
+        with self._lock:
+            phases = {k: dict(v) for k, v in self.phases.items()}
+            counters = dict(self.counters)
+            info = dict(self.info)
+        hits = counters.get("cache.hits", 0)
+        misses = counters.get("cache.misses", 0)
+        derived = {
+            "syscalls": counters.get("io.read_calls", 0) + counters.get("io.seek_calls", 0),
+            "cache_hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+        for name, entry in phases.items():
+            if entry["seconds"] > 0 and name in ("phase2_mft_scan", "phase3_parse"):
+                records = counters.get(f"{name}.records", 0)
+                derived[f"{name}.records_per_s"] = round(records / entry["seconds"], 1)
+        return {
+            "started": self.started,
+            "wall_seconds": round(time.time() - self.started, 4),
+            "phases": phases,
+            "counters": counters,
+            "derived": derived,
+            "info": info,
+        }
+
+    def export_json(self, path):
+        with open(path, "w") as out:
+            json.dump(self.snapshot(), out, indent=2)
+        print(f"[+] Đã ghi metrics vào '{path}'.")
+
+
+# Bộ đo mặc định dùng chung cho toàn bộ các module
+METRICS = Metrics()
+
+
+@contextmanager
+def profiling(cprofile_path=None, trace_memory=False, metrics=METRICS):
+    """
+    Bật cProfile (ghi stats ra `cprofile_path`) và/hoặc tracemalloc (ghi peak vào metrics.info)
+    trong phạm vi khối lệnh. Không bật gì thì không tốn chi phí.
+    """
+    profiler = cProfile.Profile() if cprofile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            metrics.info["cprofile"] = cprofile_path
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics.info["tracemalloc_current_bytes"] = current
+            metrics.info["tracemalloc_peak_bytes"] = peak
+
+
+class Progress:
+    """
+    In tiến độ tối đa một dòng mỗi `interval` giây, thay cho việc in từng record
+    (in từng dòng làm chậm chính vòng lặp đang đo).
+    """
+
+    def __init__(self, label, total=None, interval=1.0, stream=None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.done = 0
+        self.extra = {}
+        self.start = time.perf_counter()
+        self._last = self.start
+
+    def update(self, n=1, **extra):
+        self.done += n
+        self.extra.update(extra)
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._emit(now)
+
+    def close(self):
+        self._emit(time.perf_counter())
+
+    def _emit(self, now):
+        elapsed = max(now - self.start, 1e-9)
+        total = f"/{self.total}" if self.total else ""
+        extra = "".join(f" | {k}: {v}" for k, v in self.extra.items())
+        print(f"  [{self.label}] {self.done}{total} ({self.done / elapsed:.0f}/s){extra}",
+              file=self.stream, flush=True)
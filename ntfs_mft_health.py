@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# ntfs_mft_health.py
+# Mục đích: chẩn đoán sâu tình trạng MFT trước khi chọn chiến lược khôi phục (diagnose --deep).
+# - Đọc toàn bộ $MFT theo runlist của record 0, theo khối lớn, chia cho một process pool (kiểm tra
+#   record thuần Python tốn CPU, thread không song song được vì GIL).
+# - Mỗi record được kiểm tra: chữ ký FILE/BAAD, header, Update Sequence Array (fixup: 2 byte cuối
+#   mỗi sector phải bằng USN), số record ở 0x2C khớp vị trí, chuỗi thuộc tính (độ dài, căn 8 byte,
+#   loại tăng dần, có dấu kết thúc 0xFFFFFFFF).
+# - So 4 record đầu của $MFT với $MFTMirr.
+# - Tổng hợp tỉ lệ record hợp lệ, xếp loại sức khỏe và đề xuất chiến lược khôi phục.
+
+import argparse
+import json
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from ntfs_geometry import VALID_SECTOR_SIZES, nonresident_data, parse_record_header, undo_fixups
+
+CHUNK_BYTES = 8 * 1024 * 1024      # Mỗi task của process pool đọc và kiểm tra 8 MiB MFT
+FALLBACK_RECORDS = 65536           # Record 0 hỏng cả ở $MFTMirr: quét liên tục từ MFT LCN
+SYSTEM_RECORDS = 4                 # $MFT, $MFTMirr, $LogFile, $Volume: phần được $MFTMirr sao lưu
+MAX_SAMPLES = 20                   # Số record hỏng được liệt kê trong báo cáo
+
+# Trạng thái một record
+STATUSES = ("valid", "empty", "baad", "bad_signature", "header", "fixup", "attributes")
+
+# Ngưỡng xếp loại theo tỉ lệ record hợp lệ (trên số record không trống)
+GRADES = ((0.99, "healthy"), (0.90, "degraded"), (0.50, "damaged"), (0.0, "critical"))
+
+
+# --- KIỂM TRA MỘT RECORD ---
+
+_RECORD_LAYOUT = struct.Struct("<HHII")      # 0x14: offset thuộc tính đầu, cờ, used size, allocated size
+_ATTR_HEADER = struct.Struct("<IIBBH")       # loại, độ dài, non-resident, độ dài tên, offset tên
+_RESIDENT = struct.Struct("<IH")             # 0x10: độ dài nội dung, offset nội dung
+
+def check_attributes(record):
+    """Chuỗi thuộc tính của record đã gỡ fixup có hợp lệ không (đủ dài, căn 8, loại tăng dần, có kết thúc)."""
+    first, _, used, allocated = _RECORD_LAYOUT.unpack_from(record, 0x14)
+    if allocated != len(record) or used > allocated or first < 0x30 or first % 8 or first + 4 > used:
+        return False
+    p, last_type = first, 0
+    while p + 4 <= used:
+        if p + 0x18 > used:
+            # Chỉ còn chỗ cho dấu kết thúc
+            return record[p:p + 4] == b"\xff\xff\xff\xff" and used - p <= 8
+        attr_type, attr_len, nonresident, name_len, name_offset = _ATTR_HEADER.unpack_from(record, p)
+        if attr_type == 0xFFFFFFFF:
+            # Dấu kết thúc phải nằm cuối phần đã dùng (used size tính cả 8 byte kết thúc)
+            return used - p <= 8
+        if (attr_len < 0x18 or attr_len % 8 or p + attr_len > used or attr_type < last_type
+                or nonresident > 1 or (name_len and name_offset + 2 * name_len > attr_len)):
+            return False
+        if not nonresident:
+            content_len, content_offset = _RESIDENT.unpack_from(record, p + 0x10)
+            if content_offset + content_len > attr_len:
+                return False
+        elif attr_len < 0x40:
+            return False
+        last_type = attr_type
+        p += attr_len
+    return False
+
+def check_record(data, expected_no=None):
+    """
+    Kiểm tra một FILE record thô. Trả về (trạng thái, cờ header) với trạng thái thuộc STATUSES;
+    cờ header (in-use 0x1, thư mục 0x2) chỉ có nghĩa khi trạng thái là "valid".
+    Trạng thái "valid" kèm cờ 0x8000 khi số record ở 0x2C không khớp `expected_no`.
+    """
+    signature = data[:4]
+    if signature != b"FILE":
+        if signature == b"BAAD":
+            return "baad", 0
+        return ("empty", 0) if not data.strip(b"\x00") else ("bad_signature", 0)
+    header = parse_record_header(data)
+    if header is None or header["record_size"] != len(data) or header["sector_size"] not in VALID_SECTOR_SIZES:
+        return "header", 0
+    record = undo_fixups(data, header["sector_size"])
+    if record is None:
+        return "fixup", 0
+    if not check_attributes(record):
+        return "attributes", 0
+    flags = struct.unpack_from("<H", record, 0x16)[0] & 0x0003
+    if expected_no is not None and header["record_no"] != expected_no & 0xFFFFFFFF:
+        flags |= 0x8000
+    return "valid", flags
+
+
+# --- QUÉT SONG SONG ---
+
+def _scan_chunk(task):
+    """Task của process pool: đọc một khối MFT liên tục và đếm trạng thái từng record."""
+    path, offset, nbytes, first_index, record_size = task
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(nbytes)
+    counts = dict.fromkeys(STATUSES, 0)
+    counts.update(in_use=0, deleted=0, directories=0, misplaced=0, missing=0)
+    bad = []
+    for k in range(nbytes // record_size):
+        index = first_index + k
+        chunk = data[k * record_size:(k + 1) * record_size]
+        if len(chunk) < record_size:
+            counts["missing"] += 1
+            continue
+        status, flags = check_record(chunk, index)
+        counts[status] += 1
+        if status == "valid":
+            counts["in_use" if flags & 0x1 else "deleted"] += 1
+            counts["directories"] += bool(flags & 0x2)
+            if flags & 0x8000:
+                counts["misplaced"] += 1
+                status = "misplaced"
+        if status not in ("valid", "empty") and len(bad) < MAX_SAMPLES:
+            bad.append((index, status))
+    return counts, bad
+
+def _tasks(path, partition_offset, runs, bytes_per_cluster, record_size, total_records):
+    """Chia các run của $MFT thành task (path, offset tuyệt đối, số byte, record đầu, record_size)."""
+    index = 0
+    for lcn, count in runs:
+        if index >= total_records:
+            break
+        if lcn is None:
+            index += count * bytes_per_cluster // record_size
+            continue
+        start = partition_offset + lcn * bytes_per_cluster
+        run_bytes = min(count * bytes_per_cluster, (total_records - index) * record_size)
+        for off in range(0, run_bytes, CHUNK_BYTES):
+            nbytes = min(CHUNK_BYTES, run_bytes - off)
+            yield path, start + off, nbytes, index + off // record_size, record_size
+        index += count * bytes_per_cluster // record_size
+
+def scan_mft(path, partition_offset, runs, bytes_per_cluster, record_size, total_records, workers=None):
+    """Kiểm tra mọi record của $MFT, song song trên `workers` process. Trả về (counts, bad samples)."""
+    tasks = list(_tasks(path, partition_offset, runs, bytes_per_cluster, record_size, total_records))
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            results = list(pool.map(_scan_chunk, tasks))
+    else:
+        results = [_scan_chunk(task) for task in tasks]
+    counts, bad = {}, []
+    for part_counts, part_bad in results:
+        for key, value in part_counts.items():
+            counts[key] = counts.get(key, 0) + value
+        bad.extend(part_bad[:MAX_SAMPLES - len(bad)])
+    return counts, bad
+
+
+# --- HÌNH HỌC VÀ $MFTMirr ---
+
+def locate_mft(path):
+    """
+    Hình học volume đầu tiên: boot sector (chính hoặc backup) qua ntfs_discovery, không có thì suy ra
+    từ FILE record bằng ntfs_geometry. Trả về dict (partition_offset, bytes_per_cluster, mft_lcn,
+    mftmirr_lcn, record_size, geometry_source) hoặc None.
+    """
+    from ntfs_discovery import discover_partitions, ntfs_partitions
+    for part in ntfs_partitions(discover_partitions(path, scan_fallback=False)):
+        boot = part["boot"]
+        cpr = boot.get("clusters_per_file_record")
+        if not boot.get("bytes_per_cluster") or cpr is None or boot.get("mft_lcn", -1) < 0:
+            continue
+        record_size = cpr * boot["bytes_per_cluster"] if cpr > 0 else 2 ** abs(cpr)
+        return {"partition_offset": part["offset"], "bytes_per_cluster": boot["bytes_per_cluster"],
+                "mft_lcn": boot["mft_lcn"], "mftmirr_lcn": boot["mftmirr_lcn"],
+                "record_size": record_size, "geometry_source": part.get("boot_source") or "primary"}
+    from ntfs_geometry import infer_geometry
+    geometry = infer_geometry(path)
+    if geometry is None:
+        return None
+    return {"partition_offset": geometry["partition_offset"],
+            "bytes_per_cluster": geometry["bytes_per_cluster"], "mft_lcn": geometry["mft_lcn"],
+            "mftmirr_lcn": geometry["mftmirr_lcn"], "record_size": geometry["record_size"],
+            "geometry_source": "inferred"}
+
+def _read_records(f, offset, record_size, count):
+    f.seek(offset)
+    data = f.read(record_size * count)
+    return [data[i * record_size:(i + 1) * record_size] for i in range(count)]
+
+def _runs_from(record, record_size):
+    """(runs, real_size) của $DATA trong record 0 thô, hoặc None nếu record hỏng."""
+    header = parse_record_header(record)
+    if header is None or header["record_size"] != record_size:
+        return None
+    fixed = undo_fixups(record, header["sector_size"])
+    info = nonresident_data(fixed) if fixed is not None and check_attributes(fixed) else None
+    return (info["runs"], info["real_size"]) if info is not None else None
+
+def compare_mirror(mft_records, mirror_records):
+    """So từng record hệ thống của $MFT với bản sao trong $MFTMirr."""
+    result = {"records": len(mft_records), "matching": 0, "mismatched": [], "mft_bad": [],
+              "mirror_bad": []}
+    for i, (a, b) in enumerate(zip(mft_records, mirror_records)):
+        a_ok, b_ok = check_record(a, i)[0] == "valid", check_record(b, i)[0] == "valid"
+        if not a_ok:
+            result["mft_bad"].append(i)
+        if not b_ok:
+            result["mirror_bad"].append(i)
+        if a == b:
+            result["matching"] += 1
+        else:
+            result["mismatched"].append(i)
+    return result
+
+
+# --- TỔNG HỢP ---
+
+def grade_health(counts):
+    """(tỉ lệ record hợp lệ trên số record không trống, xếp loại)."""
+    used = sum(counts.get(s, 0) for s in STATUSES if s != "empty")
+    ratio = counts.get("valid", 0) / used if used else 0.0
+    for threshold, grade in GRADES:
+        if ratio >= threshold:
+            return ratio, grade
+    return ratio, "critical"
+
+def recommend(report):
+    """Chiến lược khôi phục đề xuất: (khóa, list câu hướng dẫn)."""
+    steps = []
+    if report.get("geometry_source") == "inferred":
+        steps.append("Cả hai VBR đều hỏng: dựng lại VBR bằng ntfs_geometry.py trước khi khôi phục.")
+    elif report.get("geometry_source") in ("backup", "scan_backup"):
+        steps.append("VBR chính hỏng: chép VBR backup về (ntfs_cli.py restore-vbr --backup).")
+    mirror = report.get("mirror") or {}
+    if report.get("grade") is None:
+        steps.append("Không đọc được MFT: chỉ còn cách carving theo chữ ký file trên toàn ảnh.")
+        return "carving", steps
+    if mirror.get("mft_bad") and not set(mirror["mft_bad"]) & set(mirror.get("mirror_bad", [])):
+        steps.append(f"Record hệ thống {mirror['mft_bad']} của $MFT hỏng nhưng $MFTMirr còn tốt: "
+                     "chép bản $MFTMirr đè lên rồi mới khôi phục theo MFT.")
+        strategy = "mft_with_mirror"
+    else:
+        strategy = "mft"
+    grade = report["grade"]
+    if grade == "healthy":
+        steps.append("MFT nguyên vẹn: khôi phục theo MFT (recovery_ntfs.py / ntfs_cli.py recover).")
+    elif grade == "degraded":
+        steps.append("MFT hỏng rải rác: khôi phục theo MFT, bật --triage-threshold để bỏ file đã bị "
+                     "ghi đè; record hỏng sẽ bị bỏ qua.")
+    elif grade == "damaged":
+        steps.append("MFT hỏng nhiều: khôi phục theo MFT cho phần record còn tốt, kiểm tra kỹ kết quả "
+                     "(--triage-threshold, verify) và carving bổ sung cho phần còn lại.")
+        strategy = "mft_partial"
+    else:
+        steps.append("MFT gần như không dùng được: khôi phục theo MFT sẽ thu được rất ít; dùng carving "
+                     "theo chữ ký file.")
+        strategy = "carving"
+    return strategy, steps
+
+def mft_health(path, workers=None):
+    """
+    Chẩn đoán sâu MFT của volume NTFS đầu tiên trong ảnh. Trả về dict báo cáo: hình học, số record,
+    đếm theo trạng thái, tỉ lệ hợp lệ, xếp loại, so sánh $MFTMirr, mẫu record hỏng, chiến lược.
+    """
+    report = {"image": path, "grade": None}
+    geometry = locate_mft(path)
+    if geometry is None:
+        report["strategy"], report["recommendations"] = recommend(report)
+        return dict(report, error="Không xác định được vị trí MFT")
+    report.update(geometry)
+    offset, bpc, record_size = geometry["partition_offset"], geometry["bytes_per_cluster"], geometry["record_size"]
+    mft_start = offset + geometry["mft_lcn"] * bpc
+    with open(path, "rb") as f:
+        mft_head = _read_records(f, mft_start, record_size, SYSTEM_RECORDS)
+        mirror_head = _read_records(f, offset + geometry["mftmirr_lcn"] * bpc, record_size, SYSTEM_RECORDS)
+    report["mirror"] = compare_mirror(mft_head, mirror_head)
+
+    # Runlist của $MFT: từ record 0, hỏng thì từ bản trong $MFTMirr, hỏng nốt thì quét liên tục
+    located = _runs_from(mft_head[0], record_size)
+    report["mft_runlist_source"] = "mft"
+    if located is None:
+        located = _runs_from(mirror_head[0], record_size)
+        report["mft_runlist_source"] = "mftmirr"
+    if located is None:
+        runs = [(geometry["mft_lcn"], -(-FALLBACK_RECORDS * record_size // bpc))]
+        total_records = FALLBACK_RECORDS
+        report["mft_runlist_source"] = "none"
+    else:
+        runs, real_size = located
+        total_records = real_size // record_size
+    report["total_records"] = total_records
+    report["mft_bytes"] = total_records * record_size
+    report["mft_fragments"] = sum(1 for lcn, _ in runs if lcn is not None)
+
+    counts, bad = scan_mft(path, offset, runs, bpc, record_size, total_records, workers)
+    report["counts"] = counts
+    report["bad_samples"] = bad
+    report["valid_ratio"], report["grade"] = grade_health(counts)
+    if report["mirror"]["mft_bad"] and report["grade"] == "healthy":
+        report["grade"] = "degraded"
+    report["strategy"], report["recommendations"] = recommend(report)
+    return report
+
+def print_health(report):
+    """In tóm tắt sức khỏe MFT và chiến lược đề xuất."""
+    print("\n Sức khỏe MFT (--deep):")
+    if report.get("error"):
+        print(f"  [!] {report['error']}")
+    else:
+        counts = report["counts"]
+        print(f"  Hình học: {report['geometry_source']}, partition 0x{report['partition_offset']:X}, "
+              f"cluster {report['bytes_per_cluster']}, record {report['record_size']} byte")
+        print(f"  $MFT: {report['total_records']} record, {report['mft_fragments']} mảnh "
+              f"(runlist từ {report['mft_runlist_source']})")
+        print(f"  Hợp lệ: {counts['valid']} ({report['valid_ratio']:.1%} record không trống) - "
+              f"đang dùng {counts['in_use']}, đã xóa {counts['deleted']}, thư mục {counts['directories']}")
+        print(f"  Trống: {counts['empty']} | BAAD: {counts['baad']} | sai chữ ký: {counts['bad_signature']} | "
+              f"header: {counts['header']} | fixup/USA: {counts['fixup']} | thuộc tính: "
+              f"{counts['attributes']} | lệch số record: {counts['misplaced']}")
+        mirror = report["mirror"]
+        print(f"  $MFTMirr: {mirror['matching']}/{mirror['records']} record khớp"
+              + (f", lệch {mirror['mismatched']}" if mirror["mismatched"] else ""))
+        if report["bad_samples"]:
+            print("  Mẫu record hỏng: " + ", ".join(f"#{i} {s}" for i, s in report["bad_samples"][:10]))
+        print(f"  Xếp loại: {report['grade'].upper()}")
+    print(f"  Chiến lược đề xuất ({report['strategy']}):")
+    for step in report["recommendations"]:
+        print(f"   → {step}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Chẩn đoán sâu MFT (fixup, $MFTMirr, chuỗi thuộc tính)")
+    ap.add_argument("image")
+    ap.add_argument("--workers", type=int, default=None, help="Số process (mặc định: số CPU)")
+    ap.add_argument("--json", default=None, help="Ghi báo cáo JSON")
+    args = ap.parse_args()
+    report = mft_health(args.image, workers=args.workers)
+    print_health(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
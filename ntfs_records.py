@@ -0,0 +1,252 @@
+# ntfs_records.py
+# Mục đích: bảng record dạng cột cho danh sách file ứng viên của giai đoạn 3-4, thay cho list dict
+# (mỗi file một dict + dict $DATA + list tuple runlist, vài KB/file).
+# - Mỗi trường là một cột `array` kiểu cố định (số record, cờ, kích thước, parent ref, offset...).
+# - Tên file/đường dẫn nằm chung một buffer UTF-8 (StringPool), tên lặp lại được dùng chung.
+# - Runlist của mọi file nằm trong một mảng int64 phẳng (lcn, count xen kẽ) + mảng chỉ mục đầu run.
+# - Khóa phụ hiếm gặp (triage, overlaps, runlist_issues) nằm trong dict `extras` theo chỉ số.
+# RecordView cho phép code cũ đọc `file_info["name"]`, `file_info["data"]`... như với dict.
+
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:  # numpy là tùy chọn; không có thì sắp xếp bằng Python trên array
+    numpy = None
+
+SPARSE_LCN = -1               # LCN của run thưa trong mảng runlist phẳng (None trong parse_data_info)
+INTERN_LIMIT = 4096           # Số tên gần nhất được nhớ để dùng chung; quá thì xóa bộ nhớ đệm
+
+# Cờ record: 2 bit thấp giống cờ header FILE record, các bit sau mô tả $DATA
+FLAG_IN_USE = 0x0001
+FLAG_DIRECTORY = 0x0002
+FLAG_RESIDENT = 0x0100
+FLAG_COMPRESSED = 0x0200
+FLAG_SPARSE = 0x0400
+
+
+class StringPool:
+    """Buffer UTF-8 chung cho mọi chuỗi; chuỗi được tham chiếu bằng id (chỉ số trong `starts`)."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.starts = array("Q", [0])
+        self._recent = {}
+
+    def add(self, text):
+        sid = self._recent.get(text)
+        if sid is not None:
+            return sid
+        if len(self._recent) >= INTERN_LIMIT:
+            self._recent.clear()
+        self.buffer += text.encode("utf-8", errors="surrogatepass")
+        self.starts.append(len(self.buffer))
+        sid = len(self.starts) - 2
+        self._recent[text] = sid
+        return sid
+
+    def get(self, sid):
+        return self.buffer[self.starts[sid]:self.starts[sid + 1]].decode("utf-8", errors="surrogatepass")
+
+    @property
+    def nbytes(self):
+        return len(self.buffer) + self.starts.itemsize * len(self.starts)
+
+
+class RecordTable:
+    """
+    Bảng file ứng viên dạng cột. `append` nhận kết quả parse_data_info; `table[i]` trả về
+    RecordView, `for view in table` duyệt tuần tự. `select` tạo bảng con (lọc/sắp xếp lại),
+    dùng chung StringPool với bảng gốc.
+    """
+
+    COLUMNS = {"record_no": "Q", "flags": "H", "real_size": "Q", "parent_ref": "Q",
+               "offset": "Q", "compression_unit": "H", "name_id": "Q", "path_id": "q",
+               "mtime": "d"}
+
+    def __init__(self, strings=None):
+        for column, code in self.COLUMNS.items():
+            setattr(self, column, array(code))
+        self.run_data = array("q")           # lcn, count, lcn, count... (lcn = SPARSE_LCN: run thưa)
+        self.run_index = array("Q", [0])     # Run của hàng i: run_data[run_index[i]:run_index[i + 1]]
+        self.strings = strings if strings is not None else StringPool()
+        self.extras = {}
+
+    def __len__(self):
+        return len(self.offset)
+
+    def append(self, record_no, offset, name, data_info, flags=0, parent_ref=0, path=None,
+               mtime=None, runs=None):
+        """Thêm một hàng; `runs` (nếu có) thay cho data_info["runs"]. Trả về chỉ số hàng."""
+        if data_info["resident"]:
+            flags |= FLAG_RESIDENT
+        if data_info["compressed"]:
+            flags |= FLAG_COMPRESSED
+        if data_info["sparse"]:
+            flags |= FLAG_SPARSE
+        self.record_no.append(record_no)
+        self.flags.append(flags)
+        self.real_size.append(data_info["real_size"])
+        self.parent_ref.append(parent_ref)
+        self.offset.append(offset)
+        self.compression_unit.append(data_info["compression_unit"])
+        self.name_id.append(self.strings.add(name))
+        self.path_id.append(self.strings.add(path) if path is not None else -1)
+        self.mtime.append(math.nan if mtime is None else mtime)
+        for lcn, count in (data_info["runs"] if runs is None else runs):
+            self.run_data.append(SPARSE_LCN if lcn is None else lcn)
+            self.run_data.append(count)
+        self.run_index.append(len(self.run_data))
+        return len(self) - 1
+
+    def copy_row(self, source, i, runs=None):
+        """Chép hàng `i` của bảng `source` (cùng StringPool) sang cuối bảng này, kèm extras."""
+        for column in self.COLUMNS:
+            getattr(self, column).append(getattr(source, column)[i])
+        if runs is None:
+            self.run_data.extend(source.run_data[source.run_index[i]:source.run_index[i + 1]])
+        else:
+            for lcn, count in runs:
+                self.run_data.append(SPARSE_LCN if lcn is None else lcn)
+                self.run_data.append(count)
+        self.run_index.append(len(self.run_data))
+        j = len(self) - 1
+        if i in source.extras:
+            self.extras[j] = dict(source.extras[i])
+        return j
+
+    def select(self, indices):
+        """Bảng mới gồm các hàng `indices` theo đúng thứ tự đó."""
+        table = RecordTable(self.strings)
+        for i in indices:
+            table.copy_row(self, i)
+        return table
+
+    # --- Truy cập theo hàng ---
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return RecordView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield RecordView(self, i)
+
+    def name(self, i):
+        return self.strings.get(self.name_id[i])
+
+    def path(self, i):
+        sid = self.path_id[i]
+        return self.strings.get(sid) if sid >= 0 else None
+
+    def runs(self, i):
+        """Runlist của hàng `i` dạng list (lcn, count), run thưa có lcn = None."""
+        data = self.run_data[self.run_index[i]:self.run_index[i + 1]]
+        return [(None if lcn == SPARSE_LCN else lcn, count) for lcn, count in zip(data[::2], data[1::2])]
+
+    def data_info(self, i):
+        """Dict cùng dạng với parse_data_info (tạo mới mỗi lần gọi)."""
+        flags = self.flags[i]
+        return {"resident": bool(flags & FLAG_RESIDENT), "runs": self.runs(i),
+                "real_size": self.real_size[i], "compressed": bool(flags & FLAG_COMPRESSED),
+                "sparse": bool(flags & FLAG_SPARSE), "compression_unit": self.compression_unit[i]}
+
+    def intervals(self):
+        """
+        Sinh (lcn đầu, lcn cuối + 1, chỉ số hàng) của mọi run không thưa, theo lcn tăng dần.
+        Sắp xếp trên cột (numpy nếu có), không dựng list tuple cho toàn bộ run.
+        """
+        pairs = len(self.run_data) // 2
+        if not pairs:
+            return
+        if numpy is not None:
+            data = numpy.frombuffer(self.run_data, dtype=numpy.int64).reshape(-1, 2)
+            bounds = numpy.frombuffer(self.run_index, dtype=numpy.uint64).astype(numpy.int64) // 2
+            owners = numpy.repeat(numpy.arange(len(self)), numpy.diff(bounds))
+            real = numpy.nonzero(data[:, 0] != SPARSE_LCN)[0]
+            order = real[numpy.argsort(data[real, 0], kind="stable")]
+            for k in order.tolist():
+                lcn, count = int(data[k, 0]), int(data[k, 1])
+                yield lcn, lcn + count, int(owners[k])
+            return
+        owners = array("Q", bytes(8 * pairs))
+        for i in range(len(self)):
+            for k in range(self.run_index[i] // 2, self.run_index[i + 1] // 2):
+                owners[k] = i
+        starts = self.run_data[::2]
+        order = sorted((k for k in range(pairs) if starts[k] != SPARSE_LCN), key=starts.__getitem__)
+        for k in order:
+            yield starts[k], starts[k] + self.run_data[2 * k + 1], owners[k]
+
+    def column(self, name):
+        """Cột `name` dạng numpy array (không sao chép) nếu có numpy, ngược lại là array."""
+        values = getattr(self, name)
+        if numpy is not None:
+            return numpy.frombuffer(values, dtype=values.typecode)
+        return values
+
+    @property
+    def nbytes(self):
+        """Dung lượng các cột + runlist + buffer chuỗi (không tính extras)."""
+        columns = sum(getattr(self, c).itemsize * len(getattr(self, c)) for c in self.COLUMNS)
+        return (columns + self.run_data.itemsize * len(self.run_data)
+                + self.run_index.itemsize * len(self.run_index) + self.strings.nbytes)
+
+
+class RecordView:
+    """
+    Một hàng của RecordTable, đọc được như dict ứng viên cũ: "name", "offset", "record_no",
+    "parent_ref", "data", "clusters", "path", "mtime" và các khóa trong extras. Gán khóa mới
+    (ví dụ "triage") được lưu vào extras của bảng.
+    """
+
+    __slots__ = ("table", "index")
+    _FIELDS = ("name", "offset", "record_no", "parent_ref", "data", "clusters", "path", "mtime")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    def _field(self, key):
+        t, i = self.table, self.index
+        if key == "name":
+            return t.name(i)
+        if key == "data":
+            return t.data_info(i)
+        if key == "clusters":
+            return [(lcn, count) for lcn, count in t.runs(i) if lcn is not None]
+        if key == "path":
+            return t.path(i)
+        if key == "mtime":
+            value = t.mtime[i]
+            return None if math.isnan(value) else value
+        return getattr(t, key)[i]
+
+    def __getitem__(self, key):
+        if key in self._FIELDS:
+            return self._field(key)
+        extras = self.table.extras.get(self.index)
+        if extras is not None and key in extras:
+            return extras[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key):
+        if key in self._FIELDS:
+            return self._field(key) is not None
+        return key in self.table.extras.get(self.index, ())
+
+    def __setitem__(self, key, value):
+        if key in self._FIELDS:
+            raise KeyError(f"{key} là cột cố định của RecordTable")
+        self.table.extras.setdefault(self.index, {})[key] = value
@@ -5,6 +5,9 @@ import sys
 import shutil
 from datetime import datetime
 
+from ntfs_discovery import find_ntfs_partition, validate_ntfs_boot
+from ntfs_geometry import rebuild_vbr
+
 # --- CẤU HÌNH ---
 VHD_FILE_PATH = r"D:\anToanVaPhucHoi\demo_2.safecopy.vhd"
 BACKUP_SUFFIX = ".backup"
@@ -22,14 +25,18 @@ class NTFSError:
     VBR_CORRUPTED = "vbr_corrupted"          # VBR bị hỏng
     MFT_CORRUPTED = "mft_corrupted"          # MFT bị hỏng
 
-def create_backup(file_path):
-    """Tạo bản sao lưu VHD trước khi sửa"""
+def create_backup(file_path, overwrite=None):
+    """
+    Tạo bản sao lưu VHD trước khi sửa.
+    overwrite=None: hỏi người dùng nếu backup đã tồn tại; True/False: không hỏi (chạy batch).
+    """
     backup_path = file_path + BACKUP_SUFFIX
     
     if os.path.exists(backup_path):
         print(f"Bản backup đã tồn tại: {backup_path}")
-        response = input("Ghi đè backup cũ? (y/n): ")
-        if response.lower() != 'y':
+        if overwrite is None:
+            overwrite = input("Ghi đè backup cũ? (y/n): ").lower() == 'y'
+        if not overwrite:
             print("Sử dụng backup hiện có.")
             return backup_path
     
@@ -42,9 +49,11 @@ def create_backup(file_path):
         print(f"Lỗi khi tạo backup: {e}")
         return None
 
-def diagnose_ntfs(vhd_path):
+def diagnose_ntfs(vhd_path, deep=False, workers=None):
     """
     Chẩn đoán các lỗi NTFS trong VHD
+    deep=True: đọc toàn bộ MFT để kiểm tra fixup, $MFTMirr và chuỗi thuộc tính của từng record
+    (ntfs_mft_health, song song trên `workers` process); kết quả nằm ở boot_info['mft_health'].
     Trả về: dict với các loại lỗi và thông tin chi tiết
     """
     errors = {}
@@ -65,24 +74,18 @@ def diagnose_ntfs(vhd_path):
             if mbr_sig != 0xAA55:
                 errors['mbr_signature'] = f"MBR signature sai: 0x{mbr_sig:04X} (expected 0xAA55)"
             
-            # Tìm phân vùng NTFS
+            # Tìm phân vùng NTFS: GPT -> MBR/EBR -> raw (không quét brute-force ở bước chẩn đoán)
             partition_offset = 0
-            partition_found = False
+            partition = find_ntfs_partition(vhd_path, scan_fallback=False)
             
-            for i in range(4):
-                entry_offset = 0x1BE + (i * 16)
-                partition_type = mbr_data[entry_offset + 4]
-                
-                if partition_type == 0x07:  # NTFS
-                    lba_start = struct.unpack('<I', mbr_data[entry_offset + 8:entry_offset + 12])[0]
-                    partition_offset = lba_start * SECTOR_SIZE
-                    partition_found = True
-                    boot_info['partition_offset'] = partition_offset
-                    break
-            
-            if not partition_found:
-                # Thử đọc boot sector tại offset 0 (raw NTFS volume)
-                partition_offset = 0
+            if partition is not None:
+                partition_offset = partition['offset']
+                boot_info['partition_offset'] = partition_offset
+                boot_info['partition_scheme'] = partition['scheme']
+                boot_info['partition_sectors'] = partition['num_sectors']
+                if partition['issues']:
+                    boot_info['partition_issues'] = partition['issues']
+            # Không tìm thấy: thử đọc boot sector tại offset 0 (raw NTFS volume)
             
             # Đọc boot sector
             f.seek(partition_offset)
@@ -138,6 +141,17 @@ def diagnose_ntfs(vhd_path):
     
     except Exception as e:
         errors['exception'] = str(e)
+
+    if deep and 'critical' not in errors:
+        from ntfs_mft_health import mft_health
+        health = mft_health(vhd_path, workers=workers)
+        boot_info['mft_health'] = health
+        if health['grade'] in (None, 'damaged', 'critical'):
+            errors[NTFSError.MFT_CORRUPTED] = {
+                'grade': health['grade'] or 'unknown',
+                'valid_ratio': round(health.get('valid_ratio', 0.0), 3),
+                'strategy': health['strategy'],
+            }
     
     return errors, boot_info
 
@@ -157,6 +171,12 @@ def print_diagnosis(errors, boot_info):
         print(f"  Boot Signature: 0x{boot_info.get('signature', 0):04X}")
         if 'partition_offset' in boot_info:
             print(f"  Partition Offset: 0x{boot_info['partition_offset']:X}")
+            print(f"  Partition Scheme: {boot_info.get('partition_scheme', 'N/A')}")
+        if boot_info.get('partition_issues'):
+            print(f"  Partition Issues: {', '.join(boot_info['partition_issues'])}")
+    if 'mft_health' in boot_info:
+        from ntfs_mft_health import print_health
+        print_health(boot_info['mft_health'])
     
     if not errors:
         print("\nKhông phát hiện lỗi - Volume NTFS hợp lệ!")
@@ -169,6 +189,7 @@ def print_diagnosis(errors, boot_info):
         NTFSError.VOLUME_ERROR: "Tham số sai của Volume - Bytes/sector hoặc sectors/cluster không đúng",
         NTFSError.CLUSTER_ERROR: "Bảng thư mục và bảng Cluster sai - Vị trí MFT bất thường",
         NTFSError.FILE_ERROR: "Boot signature sai - VBR có thể bị ghi đè",
+        NTFSError.MFT_CORRUPTED: "MFT bị hỏng - nhiều record không qua kiểm tra fixup/thuộc tính",
         'mbr_signature': "MBR signature không hợp lệ",
     }
     
@@ -196,24 +217,20 @@ def recover_vbr(file_path, boot_info):
     print("="*60)
     
     try:
-        partition_offset = boot_info.get('partition_offset', 0)
+        # Lấy thông tin phân vùng từ GPT/MBR/EBR (quét sector nếu bảng hỏng)
+        partition = find_ntfs_partition(file_path)
+        if partition is None or partition['num_sectors'] == 0:
+            print("Không tìm thấy thông tin phân vùng hợp lệ trong bảng phân vùng")
+            # Suy ra vị trí phân vùng và hình học từ chính MFT
+            if rebuild_vbr(file_path) is not None:
+                return True
+            print("   Không thể phục hồi VBR tự động")
+            return False
+        
+        lba_start = partition['start_lba']
+        total_sectors = partition['num_sectors']
         
         with open(file_path, 'rb+') as f:
-            # Đọc MBR để lấy thông tin phân vùng
-            f.seek(0)
-            mbr_data = f.read(SECTOR_SIZE)
-            
-            lba_start_addr = 0x1BE + 0x08
-            total_sectors_addr = 0x1BE + 0x0C
-            
-            lba_start = struct.unpack('<I', mbr_data[lba_start_addr:lba_start_addr + 4])[0]
-            total_sectors = struct.unpack('<I', mbr_data[total_sectors_addr:total_sectors_addr + 4])[0]
-            
-            if lba_start == 0 or total_sectors == 0:
-                print("Không tìm thấy thông tin phân vùng hợp lệ trong MBR")
-                print("   Không thể phục hồi VBR tự động")
-                return False
-            
             main_vbr_offset = lba_start * SECTOR_SIZE
             backup_vbr_offset = (lba_start + total_sectors - 1) * SECTOR_SIZE
             
@@ -231,10 +248,15 @@ def recover_vbr(file_path, boot_info):
                 return False
             
             # Kiểm tra VBR backup
-            if backup_vbr[510:512] == b'\x55\xAA':
+            backup_info, backup_issues = validate_ntfs_boot(backup_vbr, lba_start, total_sectors)
+            if backup_info is not None and not backup_issues:
                 print("VBR backup hợp lệ (signature 0x55AA)")
             else:
-                print("VBR backup không có signature hợp lệ - có thể cũng bị hỏng")
+                print("VBR backup không hợp lệ - có thể cũng bị hỏng")
+                # Thử dựng lại boot sector từ runlist của $MFT/$MFTMirr trước khi hỏi
+                if rebuild_vbr(file_path, partition) is not None:
+                    print("Phục hồi VBR thành công!")
+                    return True
                 response = input("Tiếp tục phục hồi? (y/n): ")
                 if response.lower() != 'y':
                     return False
@@ -254,34 +276,28 @@ def recover_vbr(file_path, boot_info):
 
 def recover_files(file_path):
     """
-    Khôi phục file bằng cách quét MFT records
+    Khôi phục file bằng cách quét MFT records của mọi phân vùng NTFS trong VHD
+    (offset phân vùng được cộng vào mọi lệnh đọc, xem ntfs_volume.Volume)
     """
     print("\n" + "="*60)
     print("BƯỚC 2: KHÔI PHỤC FILES TỪ MFT RECORDS")
     print("="*60)
     
-    # Import và chạy restore_cluster.py
     try:
-        # Thêm đường dẫn hiện tại vào sys.path
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        if script_dir not in sys.path:
-            sys.path.insert(0, script_dir)
-        
-        # Import module restore_cluster
-        import restore_cluster
-        
-        # Cập nhật cấu hình
-        restore_cluster.VHD_FILE_PATH = file_path
-        restore_cluster.RECOVERY_PATH = RECOVERY_PATH
+        from recovery_ntfs import run_recovery
         
         # Tạo thư mục khôi phục
         if not os.path.exists(RECOVERY_PATH):
             os.makedirs(RECOVERY_PATH)
         
         # Chạy quá trình khôi phục
-        restore_cluster.main_recovery_scan(file_path)
+        summary = run_recovery(file_path, output_dir=RECOVERY_PATH,
+                               mft_list_file=os.path.join(RECOVERY_PATH, "mft_record_list.txt"))
+        if summary["status"] != "ok":
+            print(f"Lỗi khi khôi phục files: {summary.get('error')}")
+            return False
         
-        print("\nQuá trình khôi phục file hoàn tất!")
+        print(f"\nQuá trình khôi phục file hoàn tất! ({summary['recovered']} file)")
         return True
         
     except Exception as e:
@@ -290,8 +306,8 @@ def recover_files(file_path):
         traceback.print_exc()
         return False
 
-def main():
-    """Hàm chính"""
+def main(deep=False):
+    """Hàm chính. deep=True: chẩn đoán sâu toàn bộ MFT (--deep)."""
     print("="*60)
     print("CÔNG CỤ KHÔI PHỤC VHD NTFS")
     print("="*60)
@@ -307,7 +323,7 @@ def main():
     
     # Bước 1: Chẩn đoán
     print("\nBước 1: Chẩn đoán VHD...")
-    errors, boot_info = diagnose_ntfs(VHD_FILE_PATH)
+    errors, boot_info = diagnose_ntfs(VHD_FILE_PATH, deep=deep)
     print_diagnosis(errors, boot_info)
     
     # Nếu không có lỗi hoặc chỉ có lỗi nhẹ
@@ -325,6 +341,11 @@ def main():
     
     needs_vbr_recovery = False
     needs_file_recovery = False
+
+    if NTFSError.MFT_CORRUPTED in errors:
+        print("🔸 Phát hiện lỗi: MFT bị hỏng (chẩn đoán sâu)")
+        for step in boot_info['mft_health']['recommendations']:
+            print(f"   → {step}")
     
     if NTFSError.CLUSTER_ERROR in errors:
         print("🔸 Phát hiện lỗi: Bảng thư mục và bảng Cluster sai")
@@ -344,6 +365,10 @@ def main():
         print("   → Sẽ thử phục hồi VBR từ backup")
         needs_vbr_recovery = True
         needs_file_recovery = True
+
+    elif NTFSError.MFT_CORRUPTED in errors:
+        print("   → Sẽ thử khôi phục files trực tiếp từ phần MFT còn tốt")
+        needs_file_recovery = True
     
     else:
         print("🔸 Phát hiện lỗi khác")
@@ -370,6 +395,10 @@ def main():
         vbr_ok = recover_vbr(VHD_FILE_PATH, boot_info)
         if not vbr_ok:
             print("\nPhục hồi VBR thất bại - tiếp tục với file recovery")
+        else:
+            # Xác nhận chính xác những gì đã bị ghi so với bản backup
+            from ntfs_verify import print_verify, verify_images
+            print_verify(verify_images(VHD_FILE_PATH, backup_path))
     
     if needs_file_recovery:
         files_ok = recover_files(VHD_FILE_PATH)
@@ -394,7 +423,7 @@ def main():
 
 if __name__ == "__main__":
     try:
-        main()
+        main(deep="--deep" in sys.argv[1:])
     except KeyboardInterrupt:
         print("\n\nĐã hủy bởi người dùng")
     except Exception as e:
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# ntfs_rescue.py
+# Mục đích: sao chép ảnh/ổ đĩa đang hỏng theo kiểu ddrescue và đọc xuyên qua map file.
+# - Lượt 1 (copy): khối lớn, gặp lỗi thì đánh dấu khối và nhảy cóc ra xa (vùng bỏ qua để sau).
+# - Lượt 2 (copy): đọc nốt các vùng đã nhảy cóc, không nhảy nữa.
+# - Lượt 3 (trim): từ hai đầu mỗi khối lỗi, đọc từng sector vào tới sector lỗi đầu tiên.
+# - Lượt 4 (scrape): đọc từng sector phần giữa còn lại.
+# - Lượt 5+ (retry): thử lại các sector lỗi.
+# Map file cùng định dạng với GNU ddrescue (có thể tiếp tục khi bị ngắt, hoặc dùng mapfile
+# do ddrescue tạo ra). MappedReader cho phép pipeline khôi phục đọc ảnh qua map: vùng tốt đọc
+# bình thường, vùng lỗi/chưa đọc trả về số 0 mà không chạm vào đĩa.
+
+import argparse
+import bisect
+import os
+import time
+
+from ntfs_metrics import METRICS, Progress
+from ntfs_prefetch import DEFAULT_DEPTH, DEFAULT_WINDOW, PrefetchReader
+
+# Trạng thái trong map file (giống ddrescue)
+NON_TRIED = "?"
+NON_TRIMMED = "*"
+NON_SCRAPED = "/"
+BAD_SECTOR = "-"
+FINISHED = "+"
+STATUSES = NON_TRIED + NON_TRIMMED + NON_SCRAPED + BAD_SECTOR + FINISHED
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_MAX_SKIP = 64 * 1024 * 1024
+SAVE_INTERVAL = 5.0               # Ghi map file tối đa mỗi 5 giây trong lúc chạy
+
+
+# --- MAP FILE ---
+
+class RescueMap:
+    """Danh sách đoạn liên tiếp [start, size, status] phủ kín [0, size)."""
+
+    def __init__(self, size, segments=None):
+        self.size = size
+        self.segments = segments or [[0, size, NON_TRIED]]
+        self.current_pos = 0
+        self.current_status = NON_TRIED
+        self.current_pass = 1
+        self._starts = None
+
+    @classmethod
+    def load(cls, path, size=None):
+        """Đọc map file; chưa có file thì tạo map mới toàn NON_TRIED (cần `size`)."""
+        if not os.path.exists(path):
+            if size is None:
+                raise FileNotFoundError(f"Không có map file '{path}'")
+            return cls(size)
+        status_line = None
+        segments = []
+        with open(path) as mf:
+            for line in mf:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                if status_line is None:
+                    status_line = fields
+                    continue
+                start, length, status = int(fields[0], 0), int(fields[1], 0), fields[2]
+                if status not in STATUSES:
+                    raise ValueError(f"Trạng thái không hợp lệ trong map file: {status}")
+                segments.append([start, length, status])
+        end = segments[-1][0] + segments[-1][1] if segments else 0
+        rescue_map = cls(max(end, size or 0), segments or None)
+        if size is not None and size > end:
+            rescue_map.segments.append([end, size - end, NON_TRIED])
+        if status_line:
+            rescue_map.current_pos = int(status_line[0], 0)
+            rescue_map.current_status = status_line[1]
+            if len(status_line) > 2:
+                rescue_map.current_pass = int(status_line[2])
+        rescue_map._merge()
+        return rescue_map
+
+    def save(self, path):
+        """Ghi map file (ghi file tạm rồi đổi tên để không hỏng map khi bị ngắt)."""
+        tmp = path + ".tmp"
+        with open(tmp, "w") as mf:
+            mf.write("# Mapfile. Created by ntfs_rescue.py\n")
+            mf.write("# current_pos  current_status  current_pass\n")
+            mf.write(f"0x{self.current_pos:08X}     {self.current_status}               {self.current_pass}\n")
+            mf.write("#      pos        size  status\n")
+            for start, length, status in self.segments:
+                mf.write(f"0x{start:08X}  0x{length:08X}  {status}\n")
+        os.replace(tmp, path)
+
+    def mark(self, start, length, status):
+        """Gán trạng thái cho [start, start + length), tách/gộp các đoạn lân cận."""
+        end = min(start + length, self.size)
+        if end <= start:
+            return
+        i = self._index(start)
+        j = i
+        while j < len(self.segments) and self.segments[j][0] < end:
+            j += 1
+        first, last = self.segments[i], self.segments[j - 1]
+        new = []
+        if first[0] < start:
+            new.append([first[0], start - first[0], first[2]])
+        new.append([start, end - start, status])
+        if last[0] + last[1] > end:
+            new.append([end, last[0] + last[1] - end, last[2]])
+        self.segments[i:j] = new
+        self._merge(max(i - 1, 0), i + len(new) + 1)
+
+    def _merge(self, lo=0, hi=None):
+        """Gộp các đoạn kề nhau cùng trạng thái trong khoảng chỉ số [lo, hi)."""
+        segs = self.segments
+        hi = len(segs) if hi is None else hi
+        k = lo + 1
+        while k < min(hi, len(segs)):
+            if segs[k - 1][2] == segs[k][2]:
+                segs[k - 1][1] += segs[k][1]
+                del segs[k]
+                hi -= 1
+            else:
+                k += 1
+        self._starts = None
+
+    def _index(self, offset):
+        if self._starts is None:
+            self._starts = [s for s, _, _ in self.segments]
+        return max(bisect.bisect_right(self._starts, offset) - 1, 0)
+
+    def iter_segments(self, offset, size, statuses=None):
+        """Sinh (start, length, status) của các đoạn giao với [offset, offset + size), đã cắt mép."""
+        end = offset + size
+        for s, l, st in self.segments[self._index(offset):]:
+            if s >= end:
+                break
+            lo, hi = max(s, offset), min(s + l, end)
+            if hi > lo and (statuses is None or st in statuses):
+                yield lo, hi - lo, st
+
+    def total(self, status):
+        return sum(l for _, l, st in self.segments if st == status)
+
+    def summary(self):
+        return {st: self.total(st) for st in STATUSES}
+
+
+# --- SAO CHÉP CÓ CHỊU LỖI ---
+
+class RescueImager:
+    """Sao chép `source` sang `dest` theo các lượt copy/trim/scrape/retry, ghi map vào `mapfile`."""
+
+    def __init__(self, source, dest, mapfile, block_size=DEFAULT_BLOCK_SIZE, sector_size=512,
+                 max_skip=DEFAULT_MAX_SKIP, retries=1, size=None):
+        if block_size % sector_size:
+            raise ValueError("block_size phải là bội số của sector_size")
+        self.source = source
+        self.dest = dest
+        self.mapfile = mapfile
+        self.block_size = block_size
+        self.sector_size = sector_size
+        self.max_skip = max_skip
+        self.retries = retries
+        self._fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        self.size = size or os.lseek(self._fd, 0, os.SEEK_END)
+        self.map = RescueMap.load(mapfile, self.size)
+        self._last_save = 0.0
+
+    def _read_source(self, offset, size):
+        if hasattr(os, "pread"):
+            data = os.pread(self._fd, size, offset)
+        else:
+            os.lseek(self._fd, offset, os.SEEK_SET)
+            data = os.read(self._fd, size)
+        METRICS.record_read(len(data))
+        return data
+
+    def _try_read(self, offset, size):
+        """Đọc nguồn; trả về None nếu lỗi I/O hoặc đọc thiếu (sector không đọc được)."""
+        try:
+            data = self._read_source(offset, size)
+        except OSError:
+            METRICS.count("rescue.read_errors")
+            return None
+        if len(data) < size:
+            METRICS.count("rescue.read_errors")
+            return None
+        return data
+
+    def _store(self, out, offset, data, status=FINISHED):
+        out.seek(offset)
+        out.write(data)
+        self.map.mark(offset, len(data), status)
+        self.map.current_pos = offset + len(data)
+        METRICS.count("rescue.bytes_rescued", len(data))
+
+    def _checkpoint(self, force=False):
+        now = time.monotonic()
+        if force or now - self._last_save >= SAVE_INTERVAL:
+            self.map.save(self.mapfile)
+            self._last_save = now
+
+    # --- Các lượt ---
+
+    def copy_pass(self, out, skip):
+        """Đọc các vùng NON_TRIED theo khối lớn; skip=True thì nhảy cóc khi gặp lỗi."""
+        self.map.current_status = NON_TRIED
+        progress = Progress("copy" if skip else "copy (vùng đã bỏ qua)",
+                            total=self.map.total(NON_TRIED))
+        skip_size = 0
+        for start, length, _ in list(self.map.iter_segments(0, self.size, NON_TRIED)):
+            pos, end = start, start + length
+            while pos < end:
+                n = min(self.block_size, end - pos)
+                data = self._try_read(pos, n)
+                if data is not None:
+                    self._store(out, pos, data)
+                    skip_size = 0
+                    pos += n
+                else:
+                    self.map.mark(pos, n, NON_TRIMMED)
+                    pos += n
+                    if skip:
+                        # Lỗi liên tiếp thì nhảy xa dần; vùng nhảy qua để lượt sau đọc
+                        skip_size = min(max(skip_size * 2, self.block_size), self.max_skip)
+                        pos += skip_size
+                progress.update(n, bad=self.map.total(NON_TRIMMED))
+                self._checkpoint()
+        progress.close()
+        self._checkpoint(force=True)
+
+    def _read_sector(self, out, offset):
+        data = self._try_read(offset, self.sector_size)
+        if data is None:
+            self.map.mark(offset, self.sector_size, BAD_SECTOR)
+            return False
+        self._store(out, offset, data)
+        return True
+
+    def trim_pass(self, out):
+        """Với mỗi khối lỗi: đọc từng sector từ hai đầu vào tới sector lỗi đầu tiên."""
+        self.map.current_status = NON_TRIMMED
+        for start, length, _ in list(self.map.iter_segments(0, self.size, NON_TRIMMED)):
+            lo, hi = start, start + length
+            while lo < hi and self._read_sector(out, lo):
+                lo += self.sector_size
+            lo += self.sector_size
+            while hi - self.sector_size >= lo and self._read_sector(out, hi - self.sector_size):
+                hi -= self.sector_size
+            hi -= self.sector_size
+            if hi > lo:
+                self.map.mark(lo, hi - lo, NON_SCRAPED)
+            self._checkpoint()
+        self._checkpoint(force=True)
+
+    def scrape_pass(self, out, status=NON_SCRAPED):
+        """Đọc từng sector của các đoạn `status` (NON_SCRAPED, hoặc BAD_SECTOR khi retry)."""
+        self.map.current_status = status
+        for start, length, _ in list(self.map.iter_segments(0, self.size, status)):
+            for offset in range(start, start + length, self.sector_size):
+                self._read_sector(out, offset)
+                self._checkpoint()
+        self._checkpoint(force=True)
+
+    def run(self):
+        mode = "r+b" if os.path.exists(self.dest) else "wb"
+        with open(self.dest, mode) as out:
+            if out.seek(0, os.SEEK_END) < self.size:
+                out.truncate(self.size)
+            with METRICS.phase("rescue.copy"):
+                self.map.current_pass = 1
+                self.copy_pass(out, skip=True)
+                self.map.current_pass = 2
+                self.copy_pass(out, skip=False)
+            with METRICS.phase("rescue.trim"):
+                self.map.current_pass = 3
+                self.trim_pass(out)
+            with METRICS.phase("rescue.scrape"):
+                self.map.current_pass = 4
+                self.scrape_pass(out)
+            with METRICS.phase("rescue.retry"):
+                for attempt in range(self.retries):
+                    self.map.current_pass = 5 + attempt
+                    self.scrape_pass(out, BAD_SECTOR)
+        self.map.current_status = FINISHED
+        self._checkpoint(force=True)
+        return self.map.summary()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+# --- ĐỌC QUA MAP FILE ---
+
+class MappedReader(PrefetchReader):
+    """
+    PrefetchReader chỉ đọc các vùng FINISHED ("+") trong map file; vùng lỗi hoặc chưa đọc
+    trả về số 0 và không gửi lệnh đọc nào xuống thiết bị.
+    Dùng được ở mọi chỗ pipeline nhận `reader` (quét MFT, đọc cluster, quét boot sector).
+    """
+
+    def __init__(self, path, mapfile, depth=DEFAULT_DEPTH, window=DEFAULT_WINDOW, budget=None, size=None):
+        super().__init__(path, depth=depth, window=window, budget=budget, size=size)
+        self.rescue_map = RescueMap.load(mapfile, self.size)
+
+    def _pread(self, offset, size):
+        parts = []
+        covered = offset
+        for start, length, status in self.rescue_map.iter_segments(offset, size):
+            if status == FINISHED:
+                data = super()._pread(start, length)
+                parts.append(data + bytes(length - len(data)))
+            else:
+                parts.append(bytes(length))
+                METRICS.count("rescue.unreadable_bytes", length)
+            covered = start + length
+        # Phần nằm ngoài map (sau cuối thiết bị) đọc như bình thường
+        end = offset + size if self.size is None else min(offset + size, self.size)
+        if covered < end:
+            parts.append(super()._pread(covered, end - covered))
+        return b"".join(parts)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sao chép ổ đĩa/ảnh hỏng theo kiểu ddrescue (có map file)")
+    ap.add_argument("source", help=r"Ổ đĩa hoặc ảnh nguồn (vd: \\.\E: hoặc disk.safecopy.vhd)")
+    ap.add_argument("dest", help="File ảnh đích")
+    ap.add_argument("mapfile", help="Map file (tạo mới hoặc tiếp tục)")
+    ap.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    ap.add_argument("--sector-size", type=int, default=512)
+    ap.add_argument("--max-skip", type=int, default=DEFAULT_MAX_SKIP)
+    ap.add_argument("--retries", type=int, default=1, help="Số lượt thử lại sector lỗi")
+    ap.add_argument("--size", type=int, default=None, help="Kích thước nguồn (byte) nếu không tự đọc được")
+    args = ap.parse_args()
+
+    imager = RescueImager(args.source, args.dest, args.mapfile, block_size=args.block_size,
+                          sector_size=args.sector_size, max_skip=args.max_skip,
+                          retries=args.retries, size=args.size)
+    try:
+        summary = imager.run()
+    finally:
+        imager.close()
+    print(f"[+] Đã cứu {summary[FINISHED]} byte, sector lỗi: {summary[BAD_SECTOR]} byte, "
+          f"chưa đọc: {summary[NON_TRIED] + summary[NON_TRIMMED] + summary[NON_SCRAPED]} byte.")
+    print(f"[+] Map file: {args.mapfile}")
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,37 @@
 import struct
 import sys
 
+from ntfs_discovery import find_ntfs_partition, validate_ntfs_boot
+from ntfs_geometry import rebuild_vbr
+
 # -------------------------------
 VHD_FILE_PATH = r"D:\anToanVaPhucHoi\demo_2.vhd"
 # -------------------------------
 
 SECTOR_SIZE = 512
 
-# Vị trí các trường trong MBR
-# Bảng phân vùng (Partition Table) bắt đầu từ byte 446 (0x1BE)
-PARTITION_TABLE_OFFSET = 0x1BE
-# Mỗi partition entry dài 16 bytes
-PARTITION_ENTRY_SIZE = 16
-
-# Chúng ta chỉ quan tâm đến Partition 1
-PARTITION_1_OFFSET = PARTITION_TABLE_OFFSET
-
-# Offset (tương đối so với đầu partition entry)
-# 0x08: 4 bytes, Little-Endian, LBA Start (sector bắt đầu của phân vùng)
-LBA_START_OFFSET_IN_ENTRY = 0x08
-# 0x0C: 4 bytes, Little-Endian, Total Sectors (tổng số sector trong phân vùng)
-TOTAL_SECTORS_OFFSET_IN_ENTRY = 0x0C
-
 def recover_vbr_from_backup(file_path):
     """
     Phục hồi toàn bộ Volume Boot Record (VBR) bằng cách 
     sao chép từ VBR backup (ở cuối volume) đè lên VBR chính (ở đầu volume).
+    Trả về True nếu đã ghi VBR, False nếu thất bại.
     """
     try:
         with open(file_path, 'rb+') as f:
             print(f"Đang mở file: {file_path}")
 
-            # 1. Đọc MBR (Sector 0)
-            f.seek(0)
-            mbr_data = f.read(SECTOR_SIZE)
-            
-            if len(mbr_data) < SECTOR_SIZE:
-                print("LỖI: Không thể đọc MBR. File quá nhỏ hoặc bị hỏng nặng.")
-                return
-
-            # 2. Phân tích MBR để tìm thông tin Partition 1
-            # Vị trí tuyệt đối của các trường trong MBR
-            lba_start_addr = PARTITION_1_OFFSET + LBA_START_OFFSET_IN_ENTRY
-            total_sectors_addr = PARTITION_1_OFFSET + TOTAL_SECTORS_OFFSET_IN_ENTRY
-
-            # Dùng 'struct.unpack' để chuyển 4 bytes (little-endian '<I') thành số
-            lba_start = struct.unpack('<I', mbr_data[lba_start_addr : lba_start_addr + 4])[0]
-            total_sectors = struct.unpack('<I', mbr_data[total_sectors_addr : total_sectors_addr + 4])[0]
+            # 1-2. Tìm phân vùng NTFS qua bảng phân vùng (GPT, MBR, chuỗi EBR),
+            #      chỉ quét từng sector khi các bảng đều không dùng được
+            partition = find_ntfs_partition(file_path)
+            if partition is None or partition['num_sectors'] == 0:
+                print("LỖI: Không tìm thấy thông tin phân vùng hợp lệ trong bảng phân vùng.")
+                # Không còn bảng lẫn boot sector: suy ra vị trí và hình học từ chính MFT
+                return rebuild_vbr(file_path) is not None
 
-            if lba_start == 0 or total_sectors == 0:
-                print("LỖI: Không tìm thấy thông tin phân vùng hợp lệ trong MBR.")
-                print(f"LBA Start đọc được: {lba_start}, Total Sectors đọc được: {total_sectors}")
-                return
+            lba_start = partition['start_lba']
+            total_sectors = partition['num_sectors']
 
-            print("--- Thông tin phân vùng (đọc từ MBR) ---")
+            print(f"--- Thông tin phân vùng (đọc từ {partition['scheme'].upper()}) ---")
             print(f"  Phân vùng bắt đầu tại Sector (LBA): {lba_start}")
             print(f"  Tổng số Sector của phân vùng: {total_sectors}")
 
@@ -76,14 +54,17 @@ def recover_vbr_from_backup(file_path):
             
             if len(backup_vbr_data) != SECTOR_SIZE:
                 print("LỖI: Không thể đọc đủ 512 bytes từ VBR sao lưu!")
-                return
+                return False
             
             # Kiểm tra nhanh xem nó có phải VBR hợp lệ không (chữ ký 0x55AA ở cuối)
-            if backup_vbr_data[510:512] == b'\x55\xAA':
+            backup_info, backup_issues = validate_ntfs_boot(backup_vbr_data, lba_start, total_sectors)
+            if backup_info is not None and not backup_issues:
                 print("  Đã đọc VBR sao lưu. (Chữ ký 0x55AA hợp lệ)")
             else:
-                print("  CẢNH BÁO: VBR sao lưu không có chữ ký 0x55AA. Có thể nó cũng bị hỏng.")
-                # Chúng ta vẫn tiếp tục, vì nó có thể tốt hơn cái VBR chính
+                print("  CẢNH BÁO: VBR sao lưu cũng bị hỏng "
+                      f"({', '.join(backup_issues) or 'không phải boot sector NTFS'}).")
+                # Dựng lại boot sector từ runlist của $MFT/$MFTMirr thay vì chép VBR hỏng
+                return rebuild_vbr(file_path, partition) is not None
 
             # 5. Ghi đè VBR chính (hỏng) bằng VBR sao lưu
             print(f"Đang ghi đè 512 bytes lên VBR chính tại 0x{main_vbr_offset:X}...")
@@ -91,6 +72,7 @@ def recover_vbr_from_backup(file_path):
             f.write(backup_vbr_data)
             
             print("\n✅ Phục hồi hoàn tất! Toàn bộ 512 bytes của VBR đã được khôi phục.")
+            return True
 
     except FileNotFoundError:
         print(f"LỖI: Không tìm thấy file tại '{file_path}'")
@@ -100,6 +82,7 @@ def recover_vbr_from_backup(file_path):
         print("Và hãy thử chạy script với quyền Administrator.")
     except Exception as e:
         print(f"Đã xảy ra lỗi không mong muốn: {e}")
+    return False
 
 # --- Chạy hàm chính ---
 if __name__ == "__main__":
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+# ntfs_service.py
+# Mục đích: dịch vụ khôi phục chạy lâu dài trên localhost (HTTP/JSON) cho phiên làm việc tương tác:
+# chẩn đoán, xem danh sách file đã xóa, khôi phục từng nhóm file nhỏ trên cùng một ảnh mà không
+# phải mở ảnh, dò phân vùng và quét MFT lại mỗi lần như khi gọi CLI.
+# - Mỗi ảnh có một ImageState giữ ấm: SharedSource (handle + cache khối), các Volume, kết quả chẩn
+#   đoán và bảng file ứng viên (RecordTable) của từng volume. Các trạng thái nằm trong một cache
+#   LRU giới hạn theo ngân sách bộ nhớ; ảnh bị sửa (kích thước/mtime đổi) thì được nạp lại.
+# - Job chạy trên thread pool; log [+]/[!] và tiến độ của từng job được tách theo luồng
+#   (_ThreadLogRouter) và stream về client dạng NDJSON.
+#
+# API (JSON):
+#   POST   /jobs                 {"command": "diagnose"|"scan"|"recover", "image": ..., ...} -> {"id"}
+#   GET    /jobs                 danh sách job
+#   GET    /jobs/<id>?wait=S     trạng thái + kết quả, chờ tối đa S giây nếu job chưa xong
+#   GET    /jobs/<id>/events     log của job (mỗi dòng một JSON), dòng cuối là trạng thái + kết quả
+#   GET    /images               các ảnh đang được giữ trong cache, dung lượng ước tính
+#   DELETE /images?path=...      bỏ một ảnh khỏi cache
+
+import argparse
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from ntfs_cli import _ThreadLogRouter, add_serve_arguments
+from ntfs_volume import SharedSource, open_volumes
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_BUDGET = 512 * 1024 * 1024   # Tổng bộ nhớ ước tính cho mọi ảnh giữ trong cache
+IMAGE_CACHE_BYTES = 32 * 1024 * 1024  # Cache khối của SharedSource cho mỗi ảnh
+CANDIDATE_OVERHEAD = 64              # Ước lượng thêm cho mỗi ứng viên (extras, summary)
+MAX_EVENTS = 20000                   # Số dòng log tối đa giữ cho một job
+JOB_HISTORY = 200                    # Số job đã xong được giữ lại để tra cứu
+DEFAULT_LIMIT = 500                  # Số ứng viên trả về mặc định cho lệnh scan
+
+
+# --- TRẠNG THÁI ẢNH (GIỮ ẤM GIỮA CÁC JOB) ---
+
+def _signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+class ImageState:
+    """
+    Mọi thứ đã tính cho một ảnh: nguồn đọc và volume (mở một lần), kết quả chẩn đoán theo
+    chế độ deep, và kết quả scan_volume của từng volume. Job trên cùng ảnh chạy tuần tự (lock).
+    """
+
+    def __init__(self, path, workdir):
+        self.path = path
+        self.signature = _signature(path)
+        self.lock = threading.RLock()
+        self.key = hashlib.sha1(path.encode("utf-8", errors="surrogatepass")).hexdigest()[:12]
+        self.workdir = workdir
+        self.source = None
+        self.volumes = None
+        self.diagnosis = {}
+        self.scans = None
+        self.last_used = time.time()
+
+    def open(self):
+        if self.volumes is None:
+            source = SharedSource(self.path, cache_bytes=IMAGE_CACHE_BYTES)
+            self.source, self.volumes = open_volumes(self.path, source=source)
+        return self.volumes
+
+    def diagnose(self, deep=False, workers=None):
+        """(errors, boot_info, cached) của diagnose_ntfs; tính một lần cho mỗi chế độ."""
+        cached = deep in self.diagnosis
+        if not cached:
+            from ntfs_recovery_main import diagnose_ntfs
+            self.diagnosis[deep] = diagnose_ntfs(self.path, deep=deep, workers=workers)
+        errors, boot_info = self.diagnosis[deep]
+        return errors, boot_info, cached
+
+    def scan(self):
+        """
+        (list (volume, summary, ntfs_info, RecordTable), cached). Quét một lần; bảng giữ đường dẫn
+        đầy đủ dựng từ MFT để liệt kê và lọc theo thư mục.
+        """
+        if self.scans is not None:
+            return self.scans, True
+        from recovery_ntfs import scan_volume
+        scans = []
+        for volume in self.open():
+            mft_list_file = os.path.join(self.workdir, f"{self.key}.p{volume.index}.mft_records.txt")
+            summary, ntfs_info, table = scan_volume(volume, mft_list_file, resolve_paths=True)
+            summary.pop("candidates", None)   # Đã có trong bảng, không giữ thêm bản dict
+            scans.append((volume, summary, ntfs_info, table))
+        self.scans = scans
+        return scans, False
+
+    @property
+    def nbytes(self):
+        total = self.source.cached_bytes if self.source is not None else 0
+        for _, _, _, table in self.scans or ():
+            if table is not None:
+                total += table.nbytes + CANDIDATE_OVERHEAD * len(table)
+        return total
+
+    def describe(self):
+        return {"path": self.path, "size": self.signature[0], "nbytes": self.nbytes,
+                "volumes": len(self.volumes or ()), "scanned": self.scans is not None,
+                "diagnosed": sorted(self.diagnosis), "idle_seconds": round(time.time() - self.last_used, 1)}
+
+    def close(self):
+        if self.source is not None:
+            self.source.close()
+        self.source = self.volumes = self.scans = None
+        self.diagnosis = {}
+
+class ImageCache:
+    """Cache LRU các ImageState theo đường dẫn tuyệt đối, bỏ ảnh ít dùng nhất khi vượt ngân sách."""
+
+    def __init__(self, budget=DEFAULT_BUDGET, workdir="service_work"):
+        self.budget = budget
+        self.workdir = workdir
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            raise ValueError(f"Không tìm thấy ảnh: {path}")
+        with self._lock:
+            state = self._states.get(path)
+            if state is not None and state.signature != _signature(path):
+                print(f"[!] Ảnh '{path}' đã thay đổi từ lần nạp trước, nạp lại.")
+                self._states.pop(path)
+                state.close()
+                state = None
+            if state is None:
+                state = ImageState(path, self.workdir)
+                self._states[path] = state
+            self._states.move_to_end(path)
+            state.last_used = time.time()
+            return state
+
+    def evict(self, path=None):
+        """Bỏ ảnh `path` (hoặc các ảnh cũ nhất cho tới khi vừa ngân sách). Trả về list đường dẫn đã bỏ."""
+        removed = []
+        with self._lock:
+            if path is not None:
+                state = self._states.get(os.path.abspath(path))
+                if state is not None and state.lock.acquire(blocking=False):
+                    try:
+                        self._states.pop(state.path)
+                        state.close()
+                        removed.append(state.path)
+                    finally:
+                        state.lock.release()
+                return removed
+            total = sum(s.nbytes for s in self._states.values())
+            for state in list(self._states.values()):
+                if total <= self.budget or len(self._states) <= 1:
+                    break
+                if not state.lock.acquire(blocking=False):
+                    continue   # Đang có job trên ảnh này
+                try:
+                    total -= state.nbytes
+                    self._states.pop(state.path)
+                    state.close()
+                    removed.append(state.path)
+                finally:
+                    state.lock.release()
+        for p in removed:
+            print(f"[+] Bỏ ảnh '{p}' khỏi cache (ngân sách {self.budget // (1024 * 1024)} MiB).")
+        return removed
+
+    def describe(self):
+        with self._lock:
+            states = [s.describe() for s in self._states.values()]
+        return {"budget": self.budget, "nbytes": sum(s["nbytes"] for s in states), "images": states}
+
+
+# --- JOB ---
+
+class Job:
+    """Một yêu cầu của client: trạng thái queued/running/done/error, log theo dòng và kết quả."""
+
+    def __init__(self, command, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.params = params
+        self.status = "queued"
+        self.result = None
+        self.events = []
+        self.dropped = 0
+        self.created = time.time()
+        self.seconds = None
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def emit(self, line):
+        with self._cond:
+            if len(self.events) < MAX_EVENTS:
+                self.events.append(line)
+            else:
+                self.dropped += 1
+            self._cond.notify_all()
+
+    def finish(self, status, result):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.seconds = round(time.time() - self.created, 3)
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished, timeout)
+        return self.finished
+
+    def events_since(self, index, timeout):
+        """(các dòng log từ `index`, job đã xong chưa); chờ tối đa `timeout` giây nếu chưa có gì mới."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > index or self.finished, timeout)
+            return self.events[index:], self.finished
+
+    def describe(self, with_result=True):
+        info = {"id": self.id, "command": self.command, "image": self.params.get("image"),
+                "status": self.status, "seconds": self.seconds, "events": len(self.events)}
+        if with_result:
+            info["result"] = self.result
+        return info
+
+class JobLog(io.TextIOBase):
+    """Luồng ghi gắn vào _ThreadLogRouter: cắt output của job thành dòng và đẩy vào Job.emit."""
+
+    def __init__(self, job):
+        self.job = job
+        self._partial = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        lines = (self._partial + text).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            if line.strip():
+                self.job.emit(line.rstrip())
+        return len(text)
+
+    def close(self):
+        if self._partial.strip():
+            self.job.emit(self._partial.rstrip())
+        self._partial = ""
+
+
+# --- XỬ LÝ LỆNH ---
+
+def _candidate_ids(scans, params):
+    """{chỉ số scan: [hàng]} theo "ids" ("<phân vùng>:<hàng>"), hoặc "pattern"/"min_size"."""
+    selected = {}
+    if params.get("ids") is not None:
+        for cid in params["ids"]:
+            try:
+                vol, row = (int(x) for x in str(cid).split(":"))
+            except ValueError:
+                raise ValueError(f"Id ứng viên không hợp lệ: {cid!r} (dạng <phân vùng>:<hàng>)")
+            if not 0 <= vol < len(scans) or scans[vol][3] is None or not 0 <= row < len(scans[vol][3]):
+                raise ValueError(f"Không có ứng viên {cid}")
+            selected.setdefault(vol, []).append(row)
+        return selected
+    pattern = params.get("pattern") or "*"
+    min_size = int(params.get("min_size") or 0)
+    for vol, (_, _, _, table) in enumerate(scans):
+        if table is None:
+            continue
+        rows = [i for i in range(len(table))
+                if table.real_size[i] >= min_size
+                and (pattern == "*" or fnmatch.fnmatch(table.name(i), pattern)
+                     or fnmatch.fnmatch(table.path(i) or "", pattern))]
+        if rows:
+            selected[vol] = rows
+    return selected
+
+def _describe_candidate(scans, vol, row):
+    volume, _, _, table = scans[vol]
+    view = table[row]
+    info = {"id": f"{vol}:{row}", "partition": volume.index, "name": view["name"],
+            "path": view["path"], "offset": view["offset"], "size": table.real_size[row],
+            "mtime": view["mtime"]}
+    for key in ("triage", "overlaps", "runlist_issues"):
+        if key in view:
+            info[key] = view[key]
+    return info
+
+def _run_diagnose(state, params):
+    from ntfs_recovery_main import print_diagnosis
+    errors, boot_info, cached = state.diagnose(bool(params.get("deep")), params.get("deep_workers"))
+    print_diagnosis(errors, boot_info)
+    return {"status": "ok", "cached": cached, "errors": errors, "boot_info": boot_info}
+
+def _run_scan(state, params):
+    scans, cached = state.scan()
+    if cached:
+        print(f"[+] Dùng kết quả quét đã có của '{state.path}'.")
+    selected = _candidate_ids(scans, dict(params, ids=None))
+    matches = [(vol, row) for vol in sorted(selected) for row in selected[vol]]
+    start = int(params.get("start") or 0)
+    limit = int(params.get("limit") or DEFAULT_LIMIT)
+    statuses = [summary["status"] for _, summary, _, _ in scans]
+    return {"status": "ok" if "ok" in statuses else statuses[0], "cached": cached,
+            "volumes": [summary for _, summary, _, _ in scans], "total": len(matches),
+            "candidates": [_describe_candidate(scans, vol, row)
+                           for vol, row in matches[start:start + limit]]}
+
+def _run_recover(state, params):
+    from recovery_ntfs import extract_files
+    output_dir = params.get("output_dir")
+    if not output_dir:
+        raise ValueError("recover cần \"output_dir\"")
+    scans, _ = state.scan()
+    selected = _candidate_ids(scans, params)
+    results = []
+    for vol, rows in sorted(selected.items()):
+        volume, summary, ntfs_info, table = scans[vol]
+        target = output_dir if len(scans) == 1 else os.path.join(output_dir, f"partition_{volume.index}")
+        # Bản summary mới cho mỗi lần khôi phục, kết quả quét giữ nguyên để dùng lại
+        result = extract_files(volume, ntfs_info, table.select(rows),
+                               dict(summary, recovered=0, failed=0, output_dir=None), target,
+                               decompress_workers=int(params.get("decompress_workers") or 0))
+        results.append(result)
+    return {"status": "ok", "selected": sum(len(r) for r in selected.values()),
+            "recovered": sum(r.get("recovered", 0) for r in results),
+            "failed": sum(r.get("failed", 0) for r in results), "volumes": results}
+
+COMMANDS = {"diagnose": _run_diagnose, "scan": _run_scan, "recover": _run_recover}
+
+
+class RecoveryService:
+    """Hàng đợi job + cache ảnh; dùng chung cho mọi kết nối HTTP."""
+
+    def __init__(self, budget=DEFAULT_BUDGET, workdir="service_work", workers=2):
+        os.makedirs(workdir, exist_ok=True)
+        self.images = ImageCache(budget, workdir)
+        self.jobs = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.router = None
+
+    def submit(self, params):
+        command = params.get("command")
+        if command not in COMMANDS:
+            raise ValueError(f"Lệnh không hỗ trợ: {command!r} (chọn {', '.join(COMMANDS)})")
+        if not params.get("image"):
+            raise ValueError("Thiếu \"image\"")
+        job = Job(command, params)
+        with self._jobs_lock:
+            self.jobs[job.id] = job
+            done = [j for j in self.jobs.values() if j.finished]
+            for old in done[:max(0, len(done) - JOB_HISTORY)]:
+                self.jobs.pop(old.id)
+        self._pool.submit(self._run, job)
+        return job
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            return self.jobs.get(job_id)
+
+    def _run(self, job):
+        log = JobLog(job)
+        if self.router is not None:
+            self.router.bind(log)
+        try:
+            state = self.images.get(job.params["image"])
+            with state.lock:
+                job.status = "running"
+                result = COMMANDS[job.command](state, job.params)
+                state.last_used = time.time()
+            job.finish("done", result)
+        except Exception as e:
+            print(f"[!] Job {job.id} lỗi: {e}")
+            job.finish("error", {"status": "error", "error": str(e)})
+        finally:
+            log.close()
+            if self.router is not None:
+                self.router.unbind()
+        self.images.evict()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        for path in [s["path"] for s in self.images.describe()["images"]]:
+            self.images.evict(path)
+
+
+# --- HTTP ---
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, default=str).encode("utf-8")
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "ntfs-service/1"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, code, obj):
+        body = _dumps(obj)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urlsplit(self.path)
+        return [p for p in url.path.split("/") if p], {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+    def do_POST(self):
+        parts, query = self._route()
+        if parts != ["jobs"]:
+            return self._send_json(404, {"error": "Không có endpoint"})
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            params = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(params, dict):
+                raise ValueError("Body phải là object JSON")
+            job = self.service.submit(params)
+        except ValueError as e:   # json.JSONDecodeError cũng là ValueError
+            return self._send_json(400, {"error": str(e)})
+        wait = float(params.get("wait") or query.get("wait") or 0)
+        if wait > 0 and job.wait(wait):
+            return self._send_json(200, job.describe())
+        self._send_json(202, job.describe(with_result=False))
+
+    def do_GET(self):
+        parts, query = self._route()
+        if parts == ["images"]:
+            return self._send_json(200, self.service.images.describe())
+        if parts == ["jobs"]:
+            with self.service._jobs_lock:
+                jobs = list(self.service.jobs.values())
+            return self._send_json(200, [j.describe(with_result=False) for j in jobs])
+        if len(parts) in (2, 3) and parts[0] == "jobs":
+            job = self.service.get_job(parts[1])
+            if job is None:
+                return self._send_json(404, {"error": f"Không có job {parts[1]}"})
+            if len(parts) == 3 and parts[2] == "events":
+                return self._stream_events(job)
+            if len(parts) == 2:
+                wait = float(query.get("wait") or 0)
+                if wait > 0:
+                    job.wait(wait)
+                return self._send_json(200, job.describe())
+        self._send_json(404, {"error": "Không có endpoint"})
+
+    def do_DELETE(self):
+        parts, query = self._route()
+        if parts != ["images"] or "path" not in query:
+            return self._send_json(404, {"error": "Dùng DELETE /images?path=<ảnh>"})
+        self._send_json(200, {"evicted": self.service.images.evict(query["path"])})
+
+    def _stream_events(self, job):
+        """NDJSON: {"line": ...} cho từng dòng log, cuối cùng là {"status", "result"}."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        index = 0
+        try:
+            while True:
+                lines, finished = job.events_since(index, timeout=1.0)
+                for line in lines:
+                    self.wfile.write(_dumps({"line": line}) + b"\n")
+                index += len(lines)
+                if finished and not lines:
+                    self.wfile.write(_dumps({"status": job.status, "seconds": job.seconds,
+                                             "result": job.result}) + b"\n")
+                    break
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return
+        self.close_connection = True
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, budget=DEFAULT_BUDGET, workdir="service_work",
+          workers=2):
+    """Chạy dịch vụ tới khi Ctrl+C. Chỉ nên bind localhost: API đọc/ghi file theo đường dẫn client gửi."""
+    service = RecoveryService(budget, workdir, workers)
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.service = service
+    service.router = _ThreadLogRouter(sys.stdout)
+    sys.stdout = service.router
+    print(f"[+] Dịch vụ khôi phục NTFS tại http://{host}:{server.server_port} "
+          f"(ngân sách cache {budget // (1024 * 1024)} MiB, {workers} job song song)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[+] Dừng dịch vụ.")
+    finally:
+        server.server_close()
+        service.shutdown()
+        sys.stdout = service.router.fallback
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Dịch vụ khôi phục NTFS trên localhost (HTTP/JSON)")
+    add_serve_arguments(ap)
+    args = ap.parse_args(argv)
+    serve(args.host, args.port, args.memory_budget * 1024 * 1024, args.workdir, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# ntfs_timeline.py
+# Mục đích: xuất timeline MACB từ metadata MFT ($STANDARD_INFORMATION và $FILE_NAME)
+# ngay trong lúc quét MFT (không đọc lại đĩa lần hai), dạng bodyfile (mactime), CSV hoặc JSONL.
+# Các dòng được gom theo lô; FILETIME -> epoch được đổi theo cả cột (numpy nếu có).
+
+import argparse
+import csv
+import json
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+
+try:
+    import numpy
+except ImportError:  # numpy là tùy chọn; không có thì đổi từng giá trị bằng Python
+    numpy = None
+
+from ntfs_geometry import undo_fixups
+
+FILETIME_EPOCH_DIFF = 116444736000000000   # 100ns từ 1601-01-01 tới 1970-01-01
+FILETIME_PER_SECOND = 10_000_000
+BATCH_ROWS = 65536
+FORMATS = ("bodyfile", "csv", "jsonl")
+TIME_FIELDS = ("created", "modified", "mft_modified", "accessed")   # thứ tự B, M, C, A trên đĩa
+CSV_FIELDS = ("record_no", "offset", "in_use", "is_dir", "source", "name", "parent_record",
+              "size") + TIME_FIELDS
+
+# Không gian tên của $FILE_NAME: 0 POSIX, 1 Win32, 2 DOS (8.3), 3 Win32 & DOS
+NAMESPACE_DOS = 2
+
+
+# --- ĐỔI FILETIME ---
+
+def filetimes_to_epoch(values):
+    """Đổi một cột FILETIME sang epoch (giây, float); giá trị 0 -> None."""
+    if numpy is not None and len(values) > 0:
+        arr = numpy.asarray(values, dtype=numpy.int64)
+        epoch = (arr - FILETIME_EPOCH_DIFF) / FILETIME_PER_SECOND
+        return [None if v == 0 else e for v, e in zip(values, epoch.tolist())]
+    return [None if v == 0 else (v - FILETIME_EPOCH_DIFF) / FILETIME_PER_SECOND for v in values]
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def filetimes_to_iso(values):
+    """Đổi một cột FILETIME sang chuỗi ISO 8601 UTC (độ chính xác micro giây); 0 -> ""."""
+    if numpy is not None and len(values) > 0:
+        micros = (numpy.asarray(values, dtype=numpy.int64) - FILETIME_EPOCH_DIFF) // 10
+        text = numpy.datetime_as_string(micros.astype("datetime64[us]"), unit="us")
+        return ["" if v == 0 else t + "Z" for v, t in zip(values, text.tolist())]
+    out = []
+    for v in values:
+        try:
+            out.append("" if v == 0 else (_EPOCH + timedelta(microseconds=(v - FILETIME_EPOCH_DIFF) // 10))
+                       .strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+        except OverflowError:
+            out.append("")
+    return out
+
+
+# --- PHÂN TÍCH RECORD ---
+
+def parse_record_times(data, sector_size=512):
+    """
+    Đọc cờ, $STANDARD_INFORMATION, mọi $FILE_NAME và kích thước $DATA của một FILE record.
+    Trả về dict (in_use, is_dir, si, names, size) hoặc None nếu record không đọc được.
+    si: tuple 4 FILETIME hoặc None; names: list (name, namespace, parent_record, 4 FILETIME).
+    """
+    if len(data) < 0x30 or data[0:4] != b"FILE":
+        return None
+    record = undo_fixups(data, sector_size) or data   # record rách: vẫn dùng bản thô
+    flags = struct.unpack_from("<H", record, 0x16)[0]
+    result = {"in_use": bool(flags & 0x01), "is_dir": bool(flags & 0x02),
+              "si": None, "names": [], "size": 0}
+    p = struct.unpack_from("<H", record, 0x14)[0]
+    while p + 0x18 <= len(record):
+        attr_type, attr_len = struct.unpack_from("<II", record, p)
+        if attr_type == 0xFFFFFFFF or attr_len < 0x18 or p + attr_len > len(record):
+            break
+        non_resident = record[p + 8]
+        if not non_resident:
+            content_len, content_off = struct.unpack_from("<IH", record, p + 0x10)
+            c = p + content_off
+            if c + content_len > p + attr_len:    # Nội dung tràn ra ngoài thuộc tính: bỏ qua
+                p += attr_len
+                continue
+            if attr_type == 0x10 and content_len >= 0x20:
+                result["si"] = struct.unpack_from("<QQQQ", record, c)
+            elif attr_type == 0x30 and content_len >= 0x42:
+                parent_ref = struct.unpack_from("<Q", record, c)[0]
+                times = struct.unpack_from("<QQQQ", record, c + 0x08)
+                name_len, namespace = record[c + 0x40], record[c + 0x41]
+                name = record[c + 0x42:c + 0x42 + name_len * 2].decode("utf-16le", errors="replace")
+                result["names"].append((name, namespace, parent_ref & 0xFFFFFFFFFFFF, times))
+            elif attr_type == 0x80 and record[p + 9] == 0:
+                result["size"] = content_len
+        elif attr_type == 0x80 and record[p + 9] == 0 and attr_len >= 0x38:
+            result["size"] = struct.unpack_from("<Q", record, p + 0x30)[0]
+        p += attr_len
+    return result
+
+
+# --- GHI TIMELINE ---
+
+class TimelineWriter:
+    """
+    Nhận từng FILE record từ bộ quét MFT (add), gom thành lô dạng cột rồi ghi ra file.
+    Mỗi record cho một dòng SI và một dòng cho mỗi $FILE_NAME (bỏ tên DOS 8.3 nếu đã có tên dài).
+    """
+
+    def __init__(self, path, fmt=None, batch_rows=BATCH_ROWS):
+        self.path = path
+        self.fmt = fmt or format_from_path(path)
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Định dạng timeline không hỗ trợ: {self.fmt}")
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.records = 0
+        self._out = open(path, "w", encoding="utf-8", newline="")
+        self._csv = None
+        if self.fmt == "csv":
+            self._csv = csv.writer(self._out)
+            self._csv.writerow(CSV_FIELDS)
+        self._reset()
+
+    def _reset(self):
+        self._meta = []                           # (record_no, offset, in_use, is_dir, source, name, parent, size)
+        self._times = [[] for _ in TIME_FIELDS]   # 4 cột FILETIME
+
+    def add(self, record_no, offset, data):
+        info = parse_record_times(data)
+        if info is None:
+            return
+        self.records += 1
+        names = info["names"]
+        if any(ns != NAMESPACE_DOS for _, ns, _, _ in names):
+            names = [n for n in names if n[1] != NAMESPACE_DOS]
+        base = (record_no, offset, info["in_use"], info["is_dir"])
+        display = names[0][0] if names else ""
+        parent = names[0][2] if names else None
+        if info["si"] is not None:
+            self._append(base + ("SI", display, parent, info["size"]), info["si"])
+        for name, _, parent_record, times in names:
+            self._append(base + ("FN", name, parent_record, info["size"]), times)
+        if len(self._meta) >= self.batch_rows:
+            self.flush()
+
+    def _append(self, meta, times):
+        self._meta.append(meta)
+        for column, value in zip(self._times, times):
+            column.append(value)
+
+    def flush(self):
+        if not self._meta:
+            return
+        if self.fmt == "bodyfile":
+            columns = [filetimes_to_epoch(col) for col in self._times]
+            for (record_no, _, in_use, is_dir, source, name, _, size), b, m, c, a in zip(self._meta, *columns):
+                label = name if source == "SI" else f"{name} ($FILE_NAME)"
+                if not in_use:
+                    label += " (deleted)"
+                mode = "d/drwxrwxrwx" if is_dir else "r/rrwxrwxrwx"
+                # MD5|name|inode|mode|UID|GID|size|atime|mtime|ctime|crtime
+                self._out.write("0|{}|{}|{}|0|0|{}|{}|{}|{}|{}\n".format(
+                    label.replace("|", "_"), record_no, mode, size,
+                    _bodyfile_time(a), _bodyfile_time(m), _bodyfile_time(c), _bodyfile_time(b)))
+        else:
+            columns = [filetimes_to_iso(col) for col in self._times]
+            for meta, *times in zip(self._meta, *columns):
+                row = meta + tuple(times)
+                if self._csv is not None:
+                    self._csv.writerow(row)
+                else:
+                    self._out.write(json.dumps(dict(zip(CSV_FIELDS, row)), ensure_ascii=False) + "\n")
+        self.rows += len(self._meta)
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self._out.close()
+        print(f"[+] Đã ghi timeline {self.fmt} ({self.rows} dòng, {self.records} record) vào '{self.path}'.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _bodyfile_time(epoch):
+    return "0" if epoch is None else f"{epoch:.7f}".rstrip("0").rstrip(".")
+
+def format_from_path(path):
+    ext = os.path.splitext(path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl"}.get(ext, "bodyfile")
+
+
+# --- XUẤT TỪ DANH SÁCH OFFSET ĐÃ LƯU ---
+
+def export_from_index(drive_path, index_file, record_size, out_path, fmt=None, reader=None):
+    """
+    Xuất timeline từ danh sách offset record đã lưu (mft_record_list.txt của GIAI ĐOẠN 2):
+    chỉ đọc đúng các record trong danh sách, không quét lại MFT.
+    """
+    with open(index_file) as idx:
+        offsets = [int(line) for line in idx if line.strip()]
+    with TimelineWriter(out_path, fmt) as timeline:
+        if reader is not None:
+            records = reader.read_ranges((off, record_size) for off in offsets)
+        else:
+            records = _read_sequential(drive_path, offsets, record_size)
+        for offset, data in zip(offsets, records):
+            timeline.add(_record_number(data), offset, data)
+    return timeline
+
+def _read_sequential(drive_path, offsets, record_size):
+    with open(drive_path, "rb") as f:
+        for offset in offsets:
+            f.seek(offset)
+            yield f.read(record_size)
+
+def _record_number(data):
+    return struct.unpack_from("<I", data, 0x2C)[0] if len(data) >= 0x30 else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Xuất timeline MACB từ danh sách MFT record đã quét")
+    ap.add_argument("drive", help="Ổ đĩa hoặc file ảnh")
+    ap.add_argument("index", help="File danh sách offset record (mft_record_list.txt)")
+    ap.add_argument("output", help="File timeline (.body, .csv hoặc .jsonl)")
+    ap.add_argument("--format", choices=FORMATS, default=None)
+    ap.add_argument("--record-size", type=int, default=1024)
+    args = ap.parse_args()
+    export_from_index(args.drive, args.index, args.record_size, args.output, args.format)
+
+if __name__ == "__main__":
+    main()
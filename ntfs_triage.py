@@ -0,0 +1,192 @@
+# ntfs_triage.py
+# Mục đích: chấm điểm nhanh các file đã xóa trước khi khôi phục, chỉ bằng một lần đọc
+# cluster đầu (và tùy chọn cluster cuối) của mỗi file.
+# Điểm (0..1) kết hợp: chữ ký đầu/cuối file so với phần mở rộng, entropy Shannon, tỉ lệ byte 0.
+# File điểm cao được khôi phục trước; file dưới ngưỡng (rác, đã bị ghi đè/xóa trắng) bị bỏ qua.
+
+import math
+import os
+from collections import Counter
+
+from ntfs_metrics import METRICS
+
+# Chữ ký đầu file (offset, bytes) theo phần mở rộng
+MAGIC = {
+    ".jpg": [(0, b"\xFF\xD8\xFF")],
+    ".jpeg": [(0, b"\xFF\xD8\xFF")],
+    ".png": [(0, b"\x89PNG\r\n\x1a\n")],
+    ".gif": [(0, b"GIF87a"), (0, b"GIF89a")],
+    ".bmp": [(0, b"BM")],
+    ".pdf": [(0, b"%PDF-")],
+    ".zip": [(0, b"PK\x03\x04"), (0, b"PK\x05\x06")],
+    ".docx": [(0, b"PK\x03\x04")],
+    ".xlsx": [(0, b"PK\x03\x04")],
+    ".pptx": [(0, b"PK\x03\x04")],
+    ".doc": [(0, b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1")],
+    ".xls": [(0, b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1")],
+    ".ppt": [(0, b"\xD0\xCF\x11\xE0\xA1\xB1\x1A\xE1")],
+    ".rar": [(0, b"Rar!\x1A\x07")],
+    ".7z": [(0, b"7z\xBC\xAF\x27\x1C")],
+    ".gz": [(0, b"\x1F\x8B")],
+    ".exe": [(0, b"MZ")],
+    ".dll": [(0, b"MZ")],
+    ".mp3": [(0, b"ID3"), (0, b"\xFF\xFB")],
+    ".mp4": [(4, b"ftyp")],
+    ".mov": [(4, b"ftyp"), (4, b"moov")],
+    ".avi": [(0, b"RIFF")],
+    ".wav": [(0, b"RIFF")],
+    ".sqlite": [(0, b"SQLite format 3\x00")],
+    ".vhd": [(0, b"conectix")],
+    ".vhdx": [(0, b"vhdxfile")],
+}
+
+# Chữ ký cuối file (kiểm tra trong cluster cuối, bỏ qua phần đệm 0)
+TRAILERS = {
+    ".jpg": b"\xFF\xD9",
+    ".jpeg": b"\xFF\xD9",
+    ".png": b"IEND\xAE\x42\x60\x82",
+    ".pdf": b"%%EOF",
+}
+
+TEXT_EXTS = {".txt", ".csv", ".log", ".xml", ".html", ".htm", ".json", ".ini", ".md", ".py",
+             ".c", ".h", ".js", ".css", ".bat", ".ps1", ".reg"}
+# Định dạng vốn đã nén: entropy cao là bình thường
+COMPRESSED_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".zip", ".docx", ".xlsx", ".pptx", ".rar",
+                   ".7z", ".gz", ".mp3", ".mp4", ".mov"}
+
+DEFAULT_THRESHOLD = 0.3
+_PRINTABLE = frozenset(range(0x20, 0x7F)) | {0x09, 0x0A, 0x0D}
+
+
+def shannon_entropy(data):
+    """Entropy Shannon (bit/byte, 0..8)."""
+    if not data:
+        return 0.0
+    n = len(data)
+    return -sum(c / n * math.log2(c / n) for c in Counter(data).values())
+
+def detect_type(head):
+    """Trả về phần mở rộng đầu tiên có chữ ký khớp với `head`, hoặc None."""
+    for ext, sigs in MAGIC.items():
+        if any(head[off:off + len(sig)] == sig for off, sig in sigs):
+            return ext
+    return None
+
+def score_sample(name, head, tail=None, compressed=False):
+    """
+    Chấm điểm một file từ cluster đầu (`head`) và cluster cuối (`tail`, tùy chọn).
+    compressed=True (file nén NTFS): dữ liệu trên đĩa là LZNT1 nên không so chữ ký.
+    Trả về dict: score, magic ("match"/"mismatch"/"unknown"/"skipped"), detected, entropy,
+    zero_ratio, reasons.
+    """
+    ext = os.path.splitext(name)[1].lower()
+    reasons = []
+    entropy = shannon_entropy(head)
+    zero_ratio = head.count(0) / len(head) if head else 1.0
+    result = {"magic": "unknown", "detected": None, "entropy": round(entropy, 3),
+              "zero_ratio": round(zero_ratio, 3), "reasons": reasons}
+
+    if not head or zero_ratio > 0.98:
+        reasons.append("cluster đầu toàn số 0 (đã bị xóa trắng hoặc chưa từng ghi)")
+        return dict(result, score=0.0)
+
+    score = 0.5
+    if compressed:
+        result["magic"] = "skipped"
+    else:
+        detected = detect_type(head)
+        result["detected"] = detected
+        if ext in MAGIC:
+            if any(head[off:off + len(sig)] == sig for off, sig in MAGIC[ext]):
+                result["magic"] = "match"
+                score += 0.4
+            else:
+                result["magic"] = "mismatch"
+                score -= 0.4
+                reasons.append(f"không có chữ ký {ext}"
+                               + (f" (giống {detected})" if detected else ""))
+        elif detected:
+            # Phần mở rộng lạ nhưng nội dung là định dạng đã biết: vẫn là dữ liệu có cấu trúc
+            score += 0.2
+
+        if tail is not None and ext in TRAILERS:
+            if TRAILERS[ext] in tail.rstrip(b"\x00")[-512:]:
+                score += 0.1
+            else:
+                score -= 0.1
+                reasons.append("không thấy chữ ký cuối file")
+
+    if ext in TEXT_EXTS and not compressed:
+        printable = sum(1 for b in head.rstrip(b"\x00") if b in _PRINTABLE)
+        ratio = printable / max(len(head.rstrip(b"\x00")), 1)
+        if ratio > 0.95 and entropy < 6.0:
+            score += 0.3
+        else:
+            score -= 0.3
+            reasons.append(f"không giống văn bản (printable {ratio:.0%}, entropy {entropy:.1f})")
+    elif ext not in COMPRESSED_EXTS and entropy > 7.9 and result["magic"] != "match":
+        # Nhiễu ngẫu nhiên không có chữ ký: thường là cluster đã bị file khác ghi đè
+        score -= 0.2
+        reasons.append(f"entropy rất cao ({entropy:.2f}) mà không có chữ ký")
+
+    if zero_ratio > 0.5:
+        score -= 0.2 * zero_ratio
+        reasons.append(f"{zero_ratio:.0%} byte 0")
+    return dict(result, score=round(min(max(score, 0.0), 1.0), 3))
+
+
+def _first_last_lcn(runs):
+    real = [(lcn, count) for lcn, count in runs if lcn is not None]
+    if not real:
+        return None, None
+    return real[0][0], real[-1][0] + real[-1][1] - 1
+
+def triage_candidates(drive_path, candidates, bytes_per_cluster, reader=None, check_tail=False):
+    """
+    Chấm điểm các file ứng viên (dict có "name" và "data" = kết quả parse_data_info):
+    một lần đọc cluster đầu (thêm cluster cuối nếu check_tail) cho mỗi file, gom các lần đọc
+    theo thứ tự offset để giảm seek. Gắn kết quả vào khóa "triage" và trả về danh sách đã sắp
+    xếp theo điểm giảm dần.
+    """
+    reads = []   # (offset, candidate index, "head"/"tail")
+    for i, cand in enumerate(candidates):
+        first, last = _first_last_lcn(cand["data"]["runs"])
+        if first is None:
+            continue
+        reads.append((first * bytes_per_cluster, i, "head"))
+        if check_tail and last != first:
+            reads.append((last * bytes_per_cluster, i, "tail"))
+    reads.sort()
+
+    samples = {}
+    if reader is not None:
+        blobs = reader.read_ranges((off, bytes_per_cluster) for off, _, _ in reads)
+    else:
+        blobs = _read_sequential(drive_path, [off for off, _, _ in reads], bytes_per_cluster)
+    for (_, i, which), data in zip(reads, blobs):
+        samples[(i, which)] = data
+    METRICS.count("triage.clusters_read", len(reads))
+
+    for i, cand in enumerate(candidates):
+        head = samples.get((i, "head"), b"")
+        real_size = cand["data"].get("real_size")
+        if real_size:
+            # File nhỏ hơn một cluster: phần đệm sau real_size không phải dữ liệu của file
+            head = head[:real_size]
+        tail = samples.get((i, "tail")) if check_tail else None
+        if check_tail and tail is None:
+            tail = head
+        cand["triage"] = score_sample(cand["name"], head, tail, compressed=cand["data"]["compressed"])
+    return sorted(candidates, key=lambda c: c["triage"]["score"], reverse=True)
+
+def _read_sequential(drive_path, offsets, size):
+    with open(drive_path, "rb") as f:
+        for offset in offsets:
+            try:
+                f.seek(offset)
+                data = f.read(size)
+            except OSError:
+                METRICS.count("io.read_errors")
+                data = b""
+            METRICS.record_read(len(data))
+            yield data
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# ntfs_verify.py
+# Mục đích: so sánh nhanh một ảnh với bản .backup của nó (hoặc hai ảnh bất kỳ) để biết chính
+# xác vùng nào đã bị thay đổi sau khi sửa (recover_vbr, apply MBR...).
+# - Băm cả hai file theo khối cố định, song song (blake2b nhả GIL nên thread pool đủ dùng).
+# - Bỏ qua vùng hole của file thưa (SEEK_DATA/SEEK_HOLE): khối hole có sẵn digest của khối 0.
+# - Digest từng khối được lưu cache cạnh file (<ảnh>.blockhash); file không đổi (kích thước,
+#   mtime) thì lần kiểm tra sau không đọc lại, bị ngắt giữa chừng thì tiếp tục từ chỗ dừng.
+# - Khối khác nhau được so từng byte và ánh xạ về cấu trúc: MBR/GPT, VBR, VBR backup, $MFT,
+#   $MFTMirr, dữ liệu, ngoài phân vùng.
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ntfs_metrics import METRICS, Progress
+from ntfs_prefetch import PrefetchReader
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DIGEST_SIZE = 16
+CACHE_SUFFIX = ".blockhash"
+CACHE_VERSION = 1
+SAVE_INTERVAL = 10.0              # Ghi cache tối đa mỗi 10 giây trong lúc băm
+SECTOR_SIZE = 512
+NOT_HASHED = bytes(DIGEST_SIZE)   # Ô cache chưa tính (digest thật gần như không thể toàn 0)
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+# --- CACHE DIGEST ---
+
+class BlockHashCache:
+    """
+    Digest của từng khối `block_size` byte của một file, lưu ở `cache_path`:
+    một dòng JSON (version, size, mtime_ns, block_size) rồi các digest nối liền.
+    Cache chỉ dùng lại khi kích thước, mtime và block_size khớp với file hiện tại.
+    """
+
+    def __init__(self, path, block_size, cache_path=None):
+        self.path = path
+        self.block_size = block_size
+        self.cache_path = cache_path
+        st = os.stat(path)
+        self.size = _file_size(path)
+        self.mtime_ns = st.st_mtime_ns
+        self.blocks = (self.size + block_size - 1) // block_size
+        self.digests = bytearray(self.blocks * DIGEST_SIZE)
+        self.loaded = 0
+        if cache_path:
+            self._load()
+
+    def _header(self):
+        return {"version": CACHE_VERSION, "size": self.size, "mtime_ns": self.mtime_ns,
+                "block_size": self.block_size, "digest_size": DIGEST_SIZE}
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "rb") as cf:
+                header = json.loads(cf.readline())
+                body = cf.read()
+        except (OSError, ValueError):
+            return
+        if header != self._header() or len(body) != len(self.digests):
+            return   # File đã đổi (hoặc cache của block size khác): băm lại từ đầu
+        self.digests[:] = body
+        self.loaded = self.blocks - len(self.missing())
+
+    def save(self):
+        if not self.cache_path:
+            return
+        tmp = self.cache_path + ".tmp"
+        try:
+            with open(tmp, "wb") as cf:
+                cf.write(json.dumps(self._header()).encode() + b"\n")
+                cf.write(self.digests)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"[!] Không ghi được cache '{self.cache_path}': {e}")
+
+    def get(self, index):
+        return bytes(self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE])
+
+    def put(self, index, digest):
+        self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE] = digest
+
+    def missing(self):
+        return [i for i in range(self.blocks) if self.get(i) == NOT_HASHED]
+
+def _file_size(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)   # os.stat trả 0 với ổ đĩa vật lý
+        return f.tell()
+
+def default_cache_path(path, cache_dir=None):
+    """Cache cạnh file ảnh; ổ đĩa vật lý (không phải file thường) thì không cache."""
+    if not os.path.isfile(path):
+        return None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        return os.path.join(cache_dir, os.path.basename(path) + CACHE_SUFFIX)
+    return path + CACHE_SUFFIX
+
+
+# --- VÙNG HOLE ---
+
+def data_extents(path, size):
+    """
+    Danh sách (start, end) các vùng có dữ liệu theo SEEK_DATA/SEEK_HOLE.
+    Hệ điều hành/filesystem không hỗ trợ thì coi cả file là dữ liệu.
+    """
+    if not hasattr(os, "SEEK_DATA"):
+        return [(0, size)]
+    extents = []
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        pos = 0
+        while pos < size:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError:
+                break   # ENXIO: phần còn lại là hole
+            end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+            extents.append((start, end))
+            pos = end
+    except OSError:
+        return [(0, size)]
+    finally:
+        os.close(fd)
+    return extents
+
+def _hole_blocks(extents, size, block_size):
+    """Tập chỉ số khối nằm trọn trong hole (không cần đọc)."""
+    blocks = (size + block_size - 1) // block_size
+    has_data = bytearray(blocks)
+    for start, end in extents:
+        for i in range(start // block_size, (end - 1) // block_size + 1):
+            has_data[i] = 1
+    return {i for i in range(blocks) if not has_data[i]}
+
+
+# --- BĂM SONG SONG ---
+
+def hash_file(path, block_size=DEFAULT_BLOCK_SIZE, workers=8, cache_dir=None, use_cache=True,
+              label=None):
+    """
+    Trả về BlockHashCache đã đủ digest của mọi khối. Chỉ đọc các khối chưa có trong cache
+    và không nằm trong hole; tối đa `workers` khối được đọc + băm cùng lúc.
+    """
+    cache = BlockHashCache(path, block_size,
+                           default_cache_path(path, cache_dir) if use_cache else None)
+    todo = cache.missing()
+    stats = {"blocks": cache.blocks, "cached": cache.loaded, "holes": 0, "hashed": 0}
+    if todo and os.path.isfile(path):
+        holes = _hole_blocks(data_extents(path, cache.size), cache.size, block_size)
+        zero_digest = None
+        for i in todo:
+            if i in holes:
+                length = min(block_size, cache.size - i * block_size)
+                if zero_digest is None or length != block_size:
+                    digest = _digest(bytes(length))
+                    if length == block_size:
+                        zero_digest = digest
+                else:
+                    digest = zero_digest
+                cache.put(i, digest)
+                stats["holes"] += 1
+        todo = [i for i in todo if i not in holes]
+
+    if todo:
+        progress = Progress(f"hash {label or os.path.basename(path)}", total=len(todo))
+        reader = PrefetchReader(path, depth=1)
+        last_save = time.monotonic()
+
+        def work(i):
+            return i, _digest(reader.pread(i * block_size, block_size))
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="hash") as pool:
+                pending = deque()
+                it = iter(todo)
+                for i in it:
+                    pending.append(pool.submit(work, i))
+                    if len(pending) >= workers * 2:
+                        break
+                while pending:
+                    index, digest = pending.popleft().result()
+                    cache.put(index, digest)
+                    stats["hashed"] += 1
+                    progress.update()
+                    nxt = next(it, None)
+                    if nxt is not None:
+                        pending.append(pool.submit(work, nxt))
+                    if time.monotonic() - last_save >= SAVE_INTERVAL:
+                        cache.save()
+                        last_save = time.monotonic()
+        finally:
+            reader.close()
+            cache.save()   # Bị ngắt giữa chừng thì lần sau tiếp tục từ các khối đã băm
+            progress.close()
+    elif stats["holes"]:
+        cache.save()
+    METRICS.count("verify.blocks_hashed", stats["hashed"])
+    METRICS.count("verify.blocks_cached", stats["cached"])
+    METRICS.count("verify.blocks_holes", stats["holes"])
+    cache.stats = stats
+    return cache
+
+
+# --- CẤU TRÚC ĐĨA ---
+
+def describe_layout(path):
+    """
+    Các vùng cấu trúc đã biết của ảnh: list (start, end, label) theo byte, dựa trên bảng phân
+    vùng, boot sector và runlist của $MFT (record 0). Vùng còn lại trong phân vùng là "dữ liệu".
+    """
+    from ntfs_discovery import discover_partitions, ntfs_partitions
+    from ntfs_geometry import nonresident_data, undo_fixups
+
+    discovery = discover_partitions(path, scan_fallback=False)
+    regions = []
+    if discovery["scheme"] in ("mbr", "gpt"):
+        regions.append((0, SECTOR_SIZE, "MBR"))
+        if discovery["scheme"] == "gpt":
+            regions.append((SECTOR_SIZE, 34 * SECTOR_SIZE, "GPT header/entries"))
+    with open(path, "rb") as f:
+        for part in ntfs_partitions(discovery):
+            base = part["offset"]
+            end = base + part["num_sectors"] * SECTOR_SIZE
+            name = f"phân vùng {part.get('index', 0)}"
+            regions.append((base, base + SECTOR_SIZE, f"VBR ({name})"))
+            regions.append((base + SECTOR_SIZE, base + 16 * SECTOR_SIZE, f"$Boot ({name})"))
+            regions.append((end - SECTOR_SIZE, end, f"VBR backup ({name})"))
+            boot = part["boot"] or {}
+            bpc = boot.get("bytes_per_cluster") or 0
+            if not bpc or boot.get("mft_lcn") is None:
+                continue
+            cpr = boot.get("clusters_per_file_record") or 0
+            record_size = cpr * bpc if cpr > 0 else 1 << -cpr
+            f.seek(base + boot["mft_lcn"] * bpc)
+            record = f.read(record_size)
+            info = None
+            if record[:4] == b"FILE":
+                fixed = undo_fixups(record, boot.get("bytes_per_sector") or SECTOR_SIZE)
+                info = nonresident_data(fixed) if fixed else None
+            if info:
+                for lcn, count in info["runs"]:
+                    if lcn is not None:
+                        regions.append((base + lcn * bpc, base + (lcn + count) * bpc, f"$MFT ({name})"))
+            else:
+                regions.append((base + boot["mft_lcn"] * bpc,
+                                base + boot["mft_lcn"] * bpc + record_size * 16, f"$MFT ({name})"))
+            if boot.get("mftmirr_lcn"):
+                mirr = base + boot["mftmirr_lcn"] * bpc
+                regions.append((mirr, mirr + max(bpc, 4 * record_size), f"$MFTMirr ({name})"))
+            regions.append((base, end, f"dữ liệu ({name})"))
+    return regions
+
+def label_range(regions, start, end):
+    """Tách [start, end) theo các vùng cấu trúc (vùng cụ thể hơn được ưu tiên) -> list (s, e, label)."""
+    # Vùng khai báo trước (nhỏ, cụ thể) thắng vùng "dữ liệu" bao quanh
+    cuts = {start, end}
+    for rs, re_, _ in regions:
+        if start < rs < end:
+            cuts.add(rs)
+        if start < re_ < end:
+            cuts.add(re_)
+    points = sorted(cuts)
+    out = []
+    for s, e in zip(points, points[1:]):
+        label = next((lb for rs, re_, lb in regions if rs <= s and e <= re_), "ngoài phân vùng")
+        if out and out[-1][2] == label and out[-1][1] == s:
+            out[-1] = (out[-1][0], e, label)
+        else:
+            out.append((s, e, label))
+    return out
+
+
+# --- SO SÁNH ---
+
+def _diff_spans(a, b, base):
+    """Các đoạn byte khác nhau giữa hai khối (so theo sector, rồi thu hẹp tới byte)."""
+    spans = []
+    n = min(len(a), len(b))
+    for off in range(0, n, SECTOR_SIZE):
+        sa, sb = a[off:off + SECTOR_SIZE], b[off:off + SECTOR_SIZE]
+        if sa == sb:
+            continue
+        first = next(i for i in range(len(sa)) if sa[i] != sb[i])
+        last = next(i for i in range(len(sa) - 1, -1, -1) if sa[i] != sb[i])
+        s, e = base + off + first, base + off + last + 1
+        if spans and s - spans[-1][1] < SECTOR_SIZE:
+            spans[-1] = (spans[-1][0], e)
+        else:
+            spans.append((s, e))
+    return spans
+
+def verify_images(image, other=None, block_size=DEFAULT_BLOCK_SIZE, workers=8, cache_dir=None,
+                  use_cache=True):
+    """
+    So sánh `image` với `other` (mặc định <image>.backup).
+    Trả về dict: identical, size_a, size_b, blocks, differing_blocks, ranges (list
+    {start, end, length, structure}), stats băm của từng file.
+    """
+    other = other or image + ".backup"
+    with METRICS.phase("verify_hash"):
+        ha = hash_file(image, block_size, workers, cache_dir, use_cache, label="ảnh")
+        hb = hash_file(other, block_size, workers, cache_dir, use_cache, label="bản so sánh")
+    common = min(ha.blocks, hb.blocks)
+    differing = [i for i in range(common) if ha.get(i) != hb.get(i)]
+
+    spans = []
+    with METRICS.phase("verify_compare"):
+        if differing:
+            with open(image, "rb") as fa, open(other, "rb") as fb:
+                for i in differing:
+                    fa.seek(i * block_size)
+                    fb.seek(i * block_size)
+                    spans.extend(_diff_spans(fa.read(block_size), fb.read(block_size), i * block_size))
+        if ha.size != hb.size:
+            spans.append((min(ha.size, hb.size), max(ha.size, hb.size)))
+
+    ranges = []
+    if spans:
+        regions = describe_layout(image) or describe_layout(other)
+        for s, e in spans:
+            for rs, re_, label in label_range(regions, s, e):
+                ranges.append({"start": rs, "end": re_, "length": re_ - rs, "structure": label})
+    return {
+        "image": image, "other": other, "identical": not ranges,
+        "size_a": ha.size, "size_b": hb.size, "block_size": block_size,
+        "blocks": max(ha.blocks, hb.blocks), "differing_blocks": len(differing),
+        "ranges": ranges, "hash_stats": {"image": ha.stats, "other": hb.stats},
+    }
+
+def print_verify(result, limit=50):
+    print(f"[+] So sánh '{result['image']}' với '{result['other']}' "
+          f"({result['blocks']} khối x {result['block_size']} byte)")
+    for key, stats in result["hash_stats"].items():
+        print(f"  {key}: băm {stats['hashed']}, từ cache {stats['cached']}, hole {stats['holes']}")
+    if result["identical"]:
+        print("[+] Hai file giống hệt nhau.")
+        return
+    if result["size_a"] != result["size_b"]:
+        print(f"[!] Kích thước khác nhau: {result['size_a']} vs {result['size_b']}")
+    by_structure = {}
+    for r in result["ranges"]:
+        by_structure[r["structure"]] = by_structure.get(r["structure"], 0) + r["length"]
+    print(f"[!] {len(result['ranges'])} đoạn khác nhau ({result['differing_blocks']} khối):")
+    for label, nbytes in by_structure.items():
+        print(f"  {label}: {nbytes} byte")
+    for r in result["ranges"][:limit]:
+        print(f"    0x{r['start']:X} - 0x{r['end']:X} ({r['length']} byte) {r['structure']}")
+    if len(result["ranges"]) > limit:
+        print(f"    ... và {len(result['ranges']) - limit} đoạn khác")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="So sánh ảnh với bản .backup theo khối (song song, có cache)")
+    ap.add_argument("image", help="File ảnh")
+    ap.add_argument("other", nargs="?", help="File so sánh (mặc định <image>.backup)")
+    ap.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    ap.add_argument("--workers", type=int, default=min(8, (os.cpu_count() or 1) * 2))
+    ap.add_argument("--cache-dir", default=None, help="Thư mục cache digest (mặc định cạnh file ảnh)")
+    ap.add_argument("--no-cache", action="store_true", help="Không đọc/ghi cache digest")
+    ap.add_argument("--json", help="Ghi kết quả ra file JSON")
+    args = ap.parse_args()
+    result = verify_images(args.image, args.other, args.block_size, args.workers,
+                           args.cache_dir, not args.no_cache)
+    print_verify(result)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as jf:
+            json.dump(result, jf, indent=2, ensure_ascii=False)
+    return 0 if result["identical"] else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,156 @@
+# ntfs_volume.py
+# Mục đích: một đối tượng Volume mang offset phân vùng + hình học NTFS, để mọi lệnh đọc của
+# pipeline khôi phục (boot sector, MFT, cluster dữ liệu, triage) tính theo vị trí trong volume
+# thay vì từ đầu thiết bị. Trên ảnh có bảng phân vùng (VHD, ổ đĩa vật lý), LCN * BytesPerCluster
+# chỉ đúng khi cộng thêm offset của phân vùng.
+# Nhiều phân vùng của cùng một ảnh dùng chung một SharedSource: một handle (PrefetchReader hoặc
+# MappedReader) và một cache khối nhỏ cho các lần đọc lẻ (boot sector, từng MFT record).
+
+import threading
+from collections import OrderedDict
+
+from ntfs_metrics import METRICS
+from ntfs_prefetch import PrefetchReader
+
+SECTOR_SIZE = 512
+CACHE_BLOCK = 64 * 1024             # Đơn vị cache cho các lần đọc nhỏ
+CACHE_BYTES = 32 * 1024 * 1024      # Tổng dung lượng cache dùng chung cho mọi volume
+
+
+class SharedSource:
+    """
+    Nguồn đọc dùng chung cho mọi volume của một ảnh. Lệnh đọc nhỏ (<= CACHE_BLOCK) đi qua cache
+    LRU theo khối thẳng hàng; lệnh đọc lớn và read_ranges đi thẳng xuống reader.
+    reader=None: tự mở PrefetchReader depth 1 (tương đương đọc tuần tự) và tự đóng khi close();
+    `size` (byte) khi đó dùng thay cho kích thước tự đọc. size None: không biết kích thước.
+    """
+
+    def __init__(self, path, reader=None, cache_bytes=CACHE_BYTES, block_size=CACHE_BLOCK, size=None):
+        self.path = path
+        self._own_reader = reader is None
+        self.reader = reader if reader is not None else PrefetchReader(path, depth=1, size=size)
+        self.size = self.reader.size
+        self.window = self.reader.window
+        self.block_size = block_size
+        self.capacity = max(1, cache_bytes // block_size)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pread(self, offset, size):
+        if size > self.block_size:
+            return self.reader.pread(offset, size)
+        first, last = offset // self.block_size, (offset + size - 1) // self.block_size
+        data = b"".join(self._block(i) for i in range(first, last + 1))
+        start = offset - first * self.block_size
+        return data[start:start + size]
+
+    def _block(self, index):
+        with self._lock:
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+                METRICS.count("cache.hits")
+                return block
+        block = self.reader.pread(index * self.block_size, self.block_size)
+        METRICS.count("cache.misses")
+        with self._lock:
+            self._cache[index] = block
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return block
+
+    def read_ranges(self, ranges):
+        return self.reader.read_ranges(ranges)
+
+    def iter_blocks(self, start, end=None, block_size=None):
+        return self.reader.iter_blocks(start, end, block_size)
+
+    @property
+    def cached_bytes(self):
+        """Dung lượng đang nằm trong cache khối."""
+        return len(self._cache) * self.block_size
+
+    def close(self):
+        self._cache.clear()
+        if self._own_reader:
+            self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Volume:
+    """
+    Một volume NTFS trong ảnh. Có cùng giao diện đọc với PrefetchReader (pread, read_ranges,
+    iter_blocks, size, window) nhưng offset tính từ đầu volume, nên truyền được làm `reader`
+    cho mọi hàm của recovery_ntfs. Đọc không vượt quá cuối volume (không lấn sang phân vùng sau);
+    không biết kích thước (size None) thì không cắt lệnh đọc.
+    """
+
+    def __init__(self, source, offset=0, size=None, index=0, scheme="raw", boot_source="primary"):
+        self.source = source
+        self.path = source.path
+        self.offset = offset
+        if source.size is None:
+            self.size = size
+        else:
+            self.size = source.size - offset if size is None else min(size, source.size - offset)
+        self.index = index
+        self.scheme = scheme
+        self.boot_source = boot_source
+        self.window = source.window
+
+    def absolute(self, offset):
+        """Offset trong volume -> offset trên thiết bị/ảnh."""
+        return self.offset + offset
+
+    def _clamp(self, offset, size):
+        if self.size is None:
+            return size
+        return max(0, min(size, self.size - offset))
+
+    def pread(self, offset, size):
+        size = self._clamp(offset, size)
+        return self.source.pread(self.offset + offset, size) if size else b""
+
+    def read_ranges(self, ranges):
+        return self.source.read_ranges((self.offset + off, self._clamp(off, size))
+                                       for off, size in ranges)
+
+    def iter_blocks(self, start, end=None, block_size=None):
+        if self.size is not None:
+            end = self.size if end is None else min(end, self.size)
+        if end is None:
+            raise ValueError("Không biết kích thước volume: cần truyền end")
+        for off, data in self.source.iter_blocks(self.offset + start, self.offset + end, block_size):
+            yield off - self.offset, data
+
+    def boot_sector(self):
+        """Boot sector dùng để phân tích: bản chính, hoặc bản backup ở sector cuối nếu bản chính hỏng."""
+        if self.boot_source in ("backup", "scan_backup") and self.size is not None:
+            return self.pread(self.size - SECTOR_SIZE, SECTOR_SIZE)
+        return self.pread(0, SECTOR_SIZE)
+
+    def describe(self):
+        return {"index": self.index, "scheme": self.scheme, "offset": self.offset,
+                "size": self.size, "boot_source": self.boot_source}
+
+
+def open_volumes(path, reader=None, scan_fallback=True, source=None):
+    """
+    Tìm mọi phân vùng NTFS của ảnh (bảng GPT/MBR/EBR, quét sector nếu bảng không dùng được)
+    và trả về (SharedSource, list Volume) dùng chung một nguồn đọc.
+    Không tìm thấy phân vùng nào: trả về một volume raw tại offset 0 như trước đây.
+    """
+    from ntfs_discovery import discover_partitions, ntfs_partitions
+    source = source or SharedSource(path, reader)
+    discovery = discover_partitions(path, scan_fallback=scan_fallback, reader=source.reader)
+    volumes = [Volume(source, p["offset"], p["num_sectors"] * SECTOR_SIZE, index=i,
+                      scheme=p["scheme"], boot_source=p.get("boot_source") or "primary")
+               for i, p in enumerate(ntfs_partitions(discovery))]
+    if not volumes:
+        volumes = [Volume(source)]
+    return source, volumes
@@ -49,7 +49,24 @@ def parse_ntfs_boot(sec):
         info["mft_byte_offset"] = None
     return info
 
-def scan_image_for_ntfs(image_path, max_sectors=None):
+def _iter_sectors(f, max_scan, reader=None):
+    """Sinh (lba, sector) cho max_scan sector đầu; có reader thì đọc theo khối lớn song song."""
+    if reader is None:
+        for lba in range(0, max_scan):
+            yield lba, read_sector(f, lba)
+        return
+    block_size = max(SECTOR_SIZE, reader.window // SECTOR_SIZE * SECTOR_SIZE)
+    for block_offset, block in reader.iter_blocks(0, max_scan * SECTOR_SIZE, block_size):
+        first_lba = block_offset // SECTOR_SIZE
+        # Tìm chữ ký bằng bytes.find thay vì cắt từng sector; chỉ nhận vị trí offset 3 của sector
+        hit = block.find(b'NTFS    ')
+        while hit != -1:
+            pos = hit - 3
+            if pos % SECTOR_SIZE == 0:
+                yield first_lba + pos // SECTOR_SIZE, block[pos:pos + SECTOR_SIZE]
+            hit = block.find(b'NTFS    ', hit + 1)
+
+def scan_image_for_ntfs(image_path, max_sectors=None, reader=None):
     candidates = []
     with open(image_path, "rb") as f:
         f.seek(0, os.SEEK_END)
@@ -57,8 +74,7 @@ def scan_image_for_ntfs(image_path, max_sectors=None):
         total_sectors_image = total_bytes // SECTOR_SIZE
         max_scan = total_sectors_image if max_sectors is None else min(total_sectors_image, max_sectors)
         print(f"[+] Image size: {total_bytes} bytes, sectors: {total_sectors_image}. Scanning first {max_scan} sectors.")
-        for lba in range(0, max_scan):
-            sec = read_sector(f, lba)
+        for lba, sec in _iter_sectors(f, max_scan, reader):
             if is_ntfs_boot_sector(sec):
                 try:
                     info = parse_ntfs_boot(sec)
@@ -160,15 +176,32 @@ def propose_partitions_from_candidates(candidates, image_total_sectors):
         })
     return proposals
 
+def find_candidates(image_path, max_sectors=None, reader=None, force_scan=False):
+    """
+    Lấy danh sách boot sector NTFS: ưu tiên bảng phân vùng (GPT/MBR/EBR, ít lần đọc),
+    chỉ quét từng sector khi bảng không chỉ ra phân vùng NTFS nào hoặc khi force_scan.
+    """
+    if not force_scan:
+        from ntfs_discovery import discover_partitions, ntfs_partitions
+        discovery = discover_partitions(image_path, scan_fallback=False)
+        found = ntfs_partitions(discovery)
+        if found:
+            print(f"[+] Partition table ({discovery['scheme']}) resolves {len(found)} NTFS partition(s) "
+                  f"in {discovery['reads']} reads; skipping sector scan.")
+            return [dict(p["boot"], boot_lba=p["start_lba"], sanity="table",
+                         boot_source=p["boot_source"], issues=p["issues"]) for p in found]
+    return scan_image_for_ntfs(image_path, max_sectors=max_sectors, reader=reader)
+
 def main():
     ap = argparse.ArgumentParser(description="Scan image for NTFS boot sectors and propose partition table (MBR).")
     ap.add_argument("--image", required=True)
     ap.add_argument("--out", required=False, help="If provided and --apply, write new image with rebuilt MBR")
     ap.add_argument("--apply", action="store_true", help="Apply changes (write out new image). Must provide --out")
     ap.add_argument("--max-sectors", type=int, default=None, help="Max sectors to scan (for speed)")
+    ap.add_argument("--force-scan", action="store_true", help="Ignore partition tables and scan every sector")
     args = ap.parse_args()
 
-    candidates = scan_image_for_ntfs(args.image, max_sectors=args.max_sectors)
+    candidates = find_candidates(args.image, max_sectors=args.max_sectors, force_scan=args.force_scan)
     if not candidates:
         print("[!] No NTFS boot sectors found.")
         return
@@ -1,24 +1,47 @@
+import argparse
+import contextlib
+import json
 import os
 import struct
 import string
 import sys
+from array import array
+
+from ntfs_metrics import METRICS, Progress, profiling
+from ntfs_archive import FORMATS as ARCHIVE_FORMATS, ArchiveWriter, PathResolver, record_path_and_time
+from ntfs_knownfiles import HEAD_CHECK_MIN_SIZE, HEAD_SIZE, KnownFileSet
+from ntfs_lznt1 import UNIT_BATCH, compression_unit_clusters, iter_decompressed, split_compression_units
+from ntfs_prefetch import DEFAULT_WINDOW, PrefetchReader
+from ntfs_records import RecordTable
+from ntfs_rescue import MappedReader
+from ntfs_timeline import FORMATS, TimelineWriter
+from ntfs_triage import triage_candidates
+from ntfs_volume import open_volumes
 
 # --- CẤU HÌNH CHUNG ---
 # (Đã xóa biến DRIVE, sẽ hỏi người dùng khi chạy)
 MFT_LIST_FILE = "mft_record_list.txt" # File tạm để lưu danh sách MFT record
 OUTPUT_DIR = "recovered_files"    # Thư mục chứa file khôi phục
 MAX_MFT_RECORDS_TO_SCAN = 50000   # Số lượng MFT record tối đa cần quét
+STREAM_CHUNK = 4 * 1024 * 1024    # Kích thước mỗi lần đọc/ghi khi khôi phục file lớn
+CANDIDATE_SAMPLE = 100            # Số ứng viên giữ trong summary; danh sách đầy đủ ở .candidates.jsonl
+INT64_MAX = (1 << 63) - 1         # Giới hạn của mảng runlist array("q") trong RecordTable
 
 # --- GIAI ĐOẠN 1: HÀM ĐỌC VÀ PHÂN TÍCH BOOT SECTOR ---
 
-def read_disk_sector(drive_path, offset=0, size=512):
+def read_disk_sector(drive_path, offset=0, size=512, reader=None):
     """
     Đọc một lượng byte nhất định (mặc định là 1 sector) từ ổ đĩa tại offset.
+    Có `reader` (PrefetchReader/MappedReader) thì đọc qua reader.
     """
     try:
-        with open(drive_path, "rb") as f:
-            f.seek(offset)
-            data = f.read(size)
+        with METRICS.phase("io.read_disk_sector"):
+            if reader is not None:
+                return reader.pread(offset, size)
+            with open(drive_path, "rb") as f:
+                f.seek(offset)
+                data = f.read(size)
+        METRICS.record_read(len(data))
         return data
     except PermissionError:
         print(f"[!] LỖI: Không có quyền truy cập {drive_path}.")
@@ -58,6 +81,8 @@ def parse_boot_sector(bs):
         info["SectorsPerCluster"] = bs[13]
         info["BytesPerCluster"] = info["BytesPerSector"] * info["SectorsPerCluster"]
 
+        info["TotalSectors"] = int.from_bytes(bs[40:48], "little")
+        info["TotalClusters"] = info["TotalSectors"] // max(info["SectorsPerCluster"], 1)
         info["MFT_LCN"] = int.from_bytes(bs[48:56], "little")
         info["MFTMirr_LCN"] = int.from_bytes(bs[56:64], "little")
 
@@ -76,36 +101,75 @@ def parse_boot_sector(bs):
 
 # --- GIAI ĐOẠN 2: HÀM QUÉT MFT ---
 
-def read_mft_records(drive_path, start_offset, record_size, max_records, output_file):
+def _iter_mft_records(drive_path, start_offset, record_size, max_records, reader=None):
+    """
+    Sinh (chỉ số, offset, dữ liệu) cho từng record MFT.
+    Có `reader` (PrefetchReader) thì đọc theo khối lớn với nhiều request song song.
+    """
+    if reader is None:
+        with open(drive_path, "rb") as f:
+            for i in range(max_records):
+                record_offset = start_offset + i * record_size
+                try:
+                    f.seek(record_offset)
+                    data = f.read(record_size)
+                except OSError as e:
+                    # Sector lỗi: bỏ qua record này thay vì dừng cả lượt quét
+                    # (dùng ntfs_rescue + --mapfile cho ổ đĩa nhiều sector lỗi)
+                    METRICS.count("io.read_errors")
+                    print(f"[!] Record {i}: lỗi đọc tại offset {record_offset}: {e}")
+                    data = bytes(record_size)
+                else:
+                    METRICS.record_read(len(data))
+                yield i, record_offset, data
+        return
+
+    block_size = max(record_size, reader.window // record_size * record_size)
+    end_offset = start_offset + max_records * record_size
+    i = 0
+    for block_offset, block in reader.iter_blocks(start_offset, end_offset, block_size):
+        for pos in range(0, len(block), record_size):
+            yield i, block_offset + pos, block[pos:pos + record_size]
+            i += 1
+    if i < max_records:
+        yield i, start_offset + i * record_size, b""  # Hết dữ liệu trước khi đủ số record
+
+def read_mft_records(drive_path, start_offset, record_size, max_records, output_file, reader=None,
+                     record_sink=None, base_offset=0):
     """
     Đọc các MFT record, kiểm tra tính hợp lệ và ghi offset vào file.
+    `record_sink(record_no, offset, data)` (tùy chọn) nhận mỗi FILE record hợp lệ ngay khi đọc,
+    ví dụ TimelineWriter.add, để không phải đọc lại MFT lần hai.
+    base_offset: offset phân vùng khi `reader` là Volume. Danh sách trả về là offset trong volume
+    (dùng để đọc lại qua reader); file `output_file` và `record_sink` nhận offset tuyệt đối.
     """
-    valid_records = []
+    valid_records = array("Q")   # 8 byte/record thay vì một object int
+    scanned = 0
     print(f"[+] Đang đọc {max_records} record đầu tiên trong MFT tại offset {start_offset}...\n")
     
-    with open(drive_path, "rb") as f:
-        for i in range(max_records):
-            record_offset = start_offset + i * record_size
-            f.seek(record_offset)
-            data = f.read(record_size)
+    for i, record_offset, data in _iter_mft_records(drive_path, start_offset, record_size,
+                                                    max_records, reader):
+        if len(data) < record_size:
+            print(f"[!] Record {i}: Dữ liệu không đủ. Dừng quét.")
+            break
+        scanned += 1
 
-            if len(data) < record_size:
-                print(f"[!] Record {i}: Dữ liệu không đủ. Dừng quét.")
-                break
-
-            signature = data[0:4]
-            if signature != b"FILE":
-                continue # Bỏ qua, không cần in ra
+        signature = data[0:4]
+        if signature != b"FILE":
+            continue # Bỏ qua, không cần in ra
 
-            flags = struct.unpack("<H", data[22:24])[0]
-            deleted = not (flags & 0x0001)
+        flags = struct.unpack("<H", data[22:24])[0]
+        deleted = not (flags & 0x0001)
 
-            # print(f"  [{i:04}] ✅ Hợp lệ | {'ĐÃ XÓA' if deleted else 'TỒN TẠI'} | Offset: {record_offset}")
-            valid_records.append(record_offset)
+        METRICS.count("phase2_mft_scan.deleted" if deleted else "phase2_mft_scan.in_use")
+        valid_records.append(record_offset)
+        if record_sink is not None:
+            record_sink(i, base_offset + record_offset, data)
 
+    METRICS.count("phase2_mft_scan.records", scanned)
     with open(output_file, "w") as out_f:
         for offset in valid_records:
-            out_f.write(f"{offset}\n")
+            out_f.write(f"{base_offset + offset}\n")
             
     print(f"\n[+] Đã ghi {len(valid_records)} offset record hợp lệ vào '{output_file}'.")
     return valid_records
@@ -140,94 +204,276 @@ def parse_file_name_attribute(record):
     
     return "<không có tên>"
 
-def parse_data_attribute(record):
+def parse_file_name_parent(record):
+    """Số record thư mục cha (48 bit thấp parent reference của $FILE_NAME đầu tiên), 0 nếu không có."""
+    try:
+        attr_offset = struct.unpack("<H", record[20:22])[0]
+        while attr_offset + 8 <= len(record):
+            attr_type, attr_len = struct.unpack("<II", record[attr_offset:attr_offset + 8])
+            if attr_type == 0xFFFFFFFF or attr_len == 0:
+                break
+            if attr_type == 0x30:
+                content_offset = struct.unpack("<H", record[attr_offset+0x14:attr_offset+0x16])[0]
+                ref = record[attr_offset + content_offset:attr_offset + content_offset + 8]
+                return int.from_bytes(ref[:6], "little") if len(ref) == 8 else 0
+            attr_offset += attr_len
+    except struct.error:
+        pass
+    return 0
+
+def parse_data_info(record):
     """
-    *** HÀM MỚI ***
-    Trích xuất danh sách cluster (data runs) từ thuộc tính 0x80 ($DATA).
-    Trả về danh sách các tuple (LCN, ClusterCount).
+    Đọc thuộc tính 0x80 ($DATA) không tên.
+    Trả về dict: resident, runs (list (LCN, ClusterCount), LCN None = run thưa), real_size,
+    compressed, sparse, compression_unit; hoặc None nếu không có $DATA.
     """
     try:
         attr_offset = struct.unpack("<H", record[20:22])[0]
-        
-        while attr_offset + 4 <= len(record):
+
+        while attr_offset + 0x18 <= len(record):
             attr_type = struct.unpack("<I", record[attr_offset:attr_offset+4])[0]
             if attr_type == 0xFFFFFFFF: # End
                 break
             attr_len = struct.unpack("<I", record[attr_offset+4:attr_offset+8])[0]
-            if attr_len == 0:
+            if attr_len == 0 or attr_offset + attr_len > len(record):
                 break
 
-            if attr_type == 0x80:  # $DATA attribute
+            # Chỉ lấy luồng dữ liệu chính (không tên), bỏ qua Alternate Data Stream
+            if attr_type == 0x80 and record[attr_offset+9] == 0:
                 non_resident_flag = record[attr_offset+8]
+                attr_flags = struct.unpack("<H", record[attr_offset+0x0C:attr_offset+0x0E])[0]
+                info = {"resident": non_resident_flag == 0, "runs": [],
+                        "compressed": bool(attr_flags & 0x0001), "sparse": bool(attr_flags & 0x8000),
+                        "compression_unit": 0}
                 if non_resident_flag == 0:
-                    # Data is resident (nằm trong MFT), không thể khôi phục cách này
-                    return None 
+                    # Data nằm trong MFT
+                    info["real_size"] = struct.unpack("<I", record[attr_offset+0x10:attr_offset+0x14])[0]
+                    return info
 
-                # Non-resident. Bắt đầu phân tích runlist.
                 runlist_offset = struct.unpack("<H", record[attr_offset+0x20:attr_offset+0x22])[0]
-                runlist_end = struct.unpack("<H", record[attr_offset+0x18:attr_offset+0x1A])[0] # Kích thước phân bổ
-                
-                clusters = []
+                info["compression_unit"] = struct.unpack("<H", record[attr_offset+0x22:attr_offset+0x24])[0]
+                info["real_size"] = struct.unpack("<Q", record[attr_offset+0x30:attr_offset+0x38])[0]
+
                 current_lcn = 0
                 p = attr_offset + runlist_offset # Con trỏ chạy trong runlist
-                
-                while p < attr_offset + runlist_end:
+                # Runlist kết thúc ở byte 0x00 hoặc ở cuối thuộc tính
+                while p < attr_offset + attr_len:
                     header_byte = record[p]
                     if header_byte == 0x00: # Kết thúc runlist
                         break
                     p += 1
-                    
+
                     len_bytes = header_byte & 0x0F
                     offset_bytes = (header_byte >> 4) & 0x0F
-                    
-                    if p + len_bytes + offset_bytes > len(record):
+
+                    if p + len_bytes + offset_bytes > attr_offset + attr_len:
                         return None # Runlist bị hỏng
 
                     # 1. Đọc số lượng cluster (run_length)
-                    run_length_bytes = record[p : p + len_bytes]
-                    run_length = int.from_bytes(run_length_bytes + b'\x00' * (8 - len_bytes), 'little')
+                    run_length = int.from_bytes(record[p : p + len_bytes], 'little')
                     p += len_bytes
-                    
-                    # 2. Đọc LCN (run_offset)
+
+                    # 2. Đọc LCN (run_offset, có dấu, tương đối với run trước)
                     run_offset_bytes = record[p : p + offset_bytes]
                     p += offset_bytes
-                    
-                    if run_offset_bytes:
-                        # Xử lý số âm (two's complement)
-                        if run_offset_bytes[-1] & 0x80:
-                            run_offset_bytes += b'\xFF' * (8 - offset_bytes)
-                        else:
-                            run_offset_bytes += b'\x00' * (8 - offset_bytes)
-                        run_offset = int.from_bytes(run_offset_bytes, 'little', signed=True)
-                    else:
-                        run_offset = 0
-                    
-                    current_lcn += run_offset 
-                    
-                    if run_length > 0:
-                        clusters.append((current_lcn, run_length))
-                        
-                return clusters
+
+                    if run_length == 0:
+                        continue
+                    if not run_offset_bytes:
+                        # Không có offset: run thưa (toàn số 0, không chiếm cluster)
+                        info["runs"].append((None, run_length))
+                        continue
+                    current_lcn += int.from_bytes(run_offset_bytes, 'little', signed=True)
+                    info["runs"].append((current_lcn, run_length))
+
+                return info
 
             attr_offset += attr_len
     except Exception as e:
-        print(f"[!] Lỗi khi parse_data_attribute: {e}")
-    
-    return None # Không tìm thấy $DATA hoặc data là resident
+        print(f"[!] Lỗi khi parse_data_info: {e}")
+
+    return None # Không tìm thấy $DATA
+
+def parse_data_attribute(record):
+    """
+    Trích xuất danh sách cluster (data runs) từ thuộc tính 0x80 ($DATA).
+    Trả về danh sách các tuple (LCN, ClusterCount); run thưa có LCN = None.
+    Trả về None nếu không có $DATA hay data là resident.
+    """
+    info = parse_data_info(record)
+    if info is None or info["resident"]:
+        return None
+    return info["runs"]
+
+# --- GIAI ĐOẠN 3: KIỂM TRA RUNLIST THEO HÌNH HỌC VOLUME ---
+
+def metadata_extents(drive_path, ntfs_info, reader=None):
+    """
+    Các vùng cluster (lcn, count) chắc chắn là metadata: $Boot (8 KiB đầu), $MFT (theo runlist
+    của record 0, không đọc được thì 16 record đầu), $MFTMirr và boot sector backup ở cluster cuối.
+    """
+    bpc = ntfs_info['BytesPerCluster']
+    record_size = ntfs_info['BytesPerFileRecord']
+    extents = [(0, max(1, 8192 // bpc))]
+    record = read_disk_sector(drive_path, ntfs_info['MFT_Offset'], record_size, reader=reader)
+    mft = parse_data_info(record) if record and record[0:4] == b"FILE" else None
+    if mft is not None and not mft["resident"] and mft["runs"]:
+        extents.extend((lcn, count) for lcn, count in mft["runs"] if lcn is not None)
+    else:
+        extents.append((ntfs_info['MFT_LCN'], max(1, 16 * record_size // bpc)))
+    extents.append((ntfs_info['MFTMirr_LCN'], max(1, 4 * record_size // bpc)))
+    if ntfs_info.get('TotalClusters'):
+        extents.append((ntfs_info['TotalClusters'] - 1, 1))
+    return sorted(extents)
+
+def validate_runs(data_info, total_clusters, bytes_per_cluster, reserved=()):
+    """
+    Kiểm tra runlist của một $DATA trước khi đọc bất kỳ cluster nào:
+    - run nằm ngoài volume bị bỏ, run vượt cuối volume bị cắt;
+    - phần chồng lên vùng metadata (`reserved`) thành run thưa (giữ đúng vị trí phần sau);
+    - file không nén: bỏ các cluster vượt quá real_size (đọc rồi cũng bị cắt đi);
+      file nén: bỏ các cluster sau compression unit chứa byte cuối của real_size;
+    - LCN/số cluster ngoài khoảng int64 (record hỏng) thì loại cả file.
+    File thưa có real_size lớn hơn volume là hợp lệ: chỉ số cluster thật sự cấp phát bị so với
+    volume, còn real_size bị giới hạn bởi khoảng VCN mà runlist mô tả (kể cả run thưa).
+    Trả về (runs mới | None nếu loại cả file, stats: rejected_bytes, clipped_bytes, reasons).
+    """
+    stats = {"rejected_bytes": 0, "clipped_bytes": 0, "reasons": []}
+    real_size = data_info["real_size"]
+    if any(not 0 <= count <= INT64_MAX or (lcn is not None and not -INT64_MAX <= lcn <= INT64_MAX)
+           for lcn, count in data_info["runs"]):
+        stats["reasons"].append("run_out_of_range")
+        return None, stats
+    allocated = sum(c for lcn, c in data_info["runs"] if lcn is not None)
+    span = sum(c for _, c in data_info["runs"])
+    if total_clusters and allocated > total_clusters:
+        # Record hỏng khai nhiều cluster hơn cả volume: không đọc gì cả
+        stats["rejected_bytes"] = allocated * bytes_per_cluster
+        stats["reasons"].append("allocated_exceeds_volume")
+        return None, stats
+    # Runlist trong record gốc có thể bị cắt (phần sau nằm ở record mở rộng qua $ATTRIBUTE_LIST),
+    # nên vẫn chấp nhận real_size tới cỡ volume dù vượt khoảng VCN
+    if real_size > max(span, total_clusters or 0) * bytes_per_cluster:
+        stats["rejected_bytes"] = allocated * bytes_per_cluster
+        stats["reasons"].append("real_size_exceeds_runlist")
+        return None, stats
+
+    runs = data_info["runs"]
+    needed = (real_size + bytes_per_cluster - 1) // bytes_per_cluster
+    if data_info["compressed"]:
+        # Giải nén cần trọn unit cuối: làm tròn lên bội số của compression unit
+        unit = compression_unit_clusters(data_info["compression_unit"])
+        needed = (needed + unit - 1) // unit * unit
+    if needed < span:
+        trimmed = []
+        for lcn, count in runs:
+            if needed <= 0:
+                if lcn is not None:
+                    stats["clipped_bytes"] += count * bytes_per_cluster
+                continue
+            take = min(count, needed)
+            if take < count and lcn is not None:
+                stats["clipped_bytes"] += (count - take) * bytes_per_cluster
+            trimmed.append((lcn, take))
+            needed -= take
+        if stats["clipped_bytes"]:
+            stats["reasons"].append("runs_beyond_real_size")
+        runs = trimmed
+
+    valid = []
+    for lcn, count in runs:
+        if lcn is None:
+            valid.append((None, count))
+            continue
+        if lcn < 0 or (total_clusters and lcn >= total_clusters):
+            stats["rejected_bytes"] += count * bytes_per_cluster
+            stats["reasons"].append("run_outside_volume")
+            valid.append((None, count))
+            continue
+        if total_clusters and lcn + count > total_clusters:
+            stats["rejected_bytes"] += (lcn + count - total_clusters) * bytes_per_cluster
+            stats["reasons"].append("run_past_volume_end")
+            valid.append((lcn, total_clusters - lcn))
+            valid.append((None, lcn + count - total_clusters))
+            continue
+        for piece in _subtract_reserved(lcn, count, reserved):
+            if piece[0] is None:
+                stats["rejected_bytes"] += piece[1] * bytes_per_cluster
+                if "run_overlaps_metadata" not in stats["reasons"]:
+                    stats["reasons"].append("run_overlaps_metadata")
+            valid.append(piece)
+    if not any(lcn is not None for lcn, _ in valid):
+        return None, stats
+    return valid, stats
+
+def _subtract_reserved(lcn, count, reserved):
+    """Tách run (lcn, count) theo các vùng reserved: phần chồng lấn trở thành (None, n)."""
+    pieces = []
+    pos, end = lcn, lcn + count
+    for r_lcn, r_count in reserved:
+        r_end = r_lcn + r_count
+        if r_end <= pos or r_lcn >= end:
+            continue
+        if r_lcn > pos:
+            pieces.append((pos, r_lcn - pos))
+        overlap_end = min(end, r_end)
+        pieces.append((None, overlap_end - max(pos, r_lcn)))
+        pos = overlap_end
+        if pos >= end:
+            break
+    if pos < end:
+        pieces.append((pos, end - pos))
+    return pieces
+
+def find_overlaps(candidates):
+    """
+    Gắn khóa "overlaps" (tên các file khác dùng chung cluster) cho ứng viên (RecordTable) có run
+    chồng lấn nhau; một trong số đó chắc chắn đã bị ghi đè. Trả về số ứng viên bị đánh dấu.
+    """
+    flagged = {}
+    active = []   # (end, index) của các run đang mở
+    for start, end, i in candidates.intervals():
+        active = [(e, j) for e, j in active if e > start]
+        for _, j in active:
+            if j != i:
+                flagged.setdefault(i, set()).add(j)
+                flagged.setdefault(j, set()).add(i)
+        active.append((end, i))
+    for i, others in flagged.items():
+        candidates[i]["overlaps"] = sorted(candidates.name(j) for j in others)
+    return len(flagged)
 
 # --- GIAI ĐOẠN 4: HÀM KHÔI PHỤC FILE TỪ CLUSTER ---
 
-def read_clusters(drive_path, clusters, bytes_per_cluster):
+def read_clusters(drive_path, clusters, bytes_per_cluster, reader=None):
     """
     Đọc dữ liệu từ một danh sách các cluster (LCN, count).
+    Run thưa (LCN None) trả về số 0 mà không đọc đĩa.
+    Có `reader` (PrefetchReader) thì các run được đọc song song, trả về đúng thứ tự.
     """
     data = b""
+    if reader is not None:
+        with METRICS.phase("io.read_clusters"):
+            ranges = [(lcn * bytes_per_cluster, count * bytes_per_cluster)
+                      for lcn, count in clusters if lcn is not None]
+            try:
+                pieces = reader.read_ranges(ranges)
+                return b"".join(bytes(count * bytes_per_cluster) if lcn is None else next(pieces)
+                                for lcn, count in clusters)
+            except OSError as e:
+                print(f"  [!] Lỗi khi đọc cluster qua prefetch reader: {e}")
+                return b""
     try:
-        with open(drive_path, "rb") as f:
+        with METRICS.phase("io.read_clusters"), open(drive_path, "rb") as f:
             for lcn, count in clusters:
+                if lcn is None:
+                    data += bytes(count * bytes_per_cluster)
+                    continue
                 try:
                     f.seek(lcn * bytes_per_cluster)
-                    data += f.read(count * bytes_per_cluster)
+                    chunk = f.read(count * bytes_per_cluster)
+                    METRICS.record_read(len(chunk))
+                    data += chunk
                 except Exception as e:
                     print(f"  [!] Lỗi khi đọc cluster (LCN: {lcn}, Count: {count}): {e}")
         return data
@@ -235,133 +481,688 @@ def read_clusters(drive_path, clusters, bytes_per_cluster):
         print(f"[!] Lỗi nghiêm trọng khi mở ổ đĩa để đọc cluster: {e}")
         return b""
 
+def _iter_run_pieces(drive_path, ranges, reader=None):
+    """Sinh dữ liệu của từng (offset, size) theo thứ tự; có reader thì đọc song song."""
+    if reader is not None:
+        yield from reader.read_ranges(ranges)
+        return
+    with open(drive_path, "rb") as f:
+        for offset, size in ranges:
+            f.seek(offset)
+            data = f.read(size)
+            METRICS.record_read(len(data))
+            yield data
+
+def write_runs(drive_path, runs, bytes_per_cluster, output_path, real_size=None, reader=None,
+               hasher=None):
+    """
+    Ghi dữ liệu của runlist ra `output_path` theo luồng, mỗi lần tối đa STREAM_CHUNK byte.
+    Run thưa (LCN None) không đọc đĩa: chỉ seek qua để tạo lỗ trong file đích, file thưa vẫn thưa
+    (trên NTFS, file đích cần cờ sparse - `fsutil sparse setflag` - thì lỗ mới không chiếm chỗ).
+    Cắt file đúng `real_size` nếu biết. Trả về số byte đã đọc từ đĩa.
+    hasher (tùy chọn, có update()) nhận đúng nội dung file (lỗ là số 0, không quá real_size).
+    """
+    # Chia run thật thành các đoạn <= STREAM_CHUNK để không giữ cả run lớn trong bộ nhớ
+    ranges = []
+    for lcn, count in runs:
+        if lcn is None:
+            continue
+        start, end = lcn * bytes_per_cluster, (lcn + count) * bytes_per_cluster
+        ranges.extend((off, min(STREAM_CHUNK, end - off)) for off in range(start, end, STREAM_CHUNK))
+    pieces = _iter_run_pieces(drive_path, ranges, reader)
+
+    bytes_read = 0
+    remaining = float("inf") if real_size is None else real_size   # Số byte còn phải băm
+    with METRICS.phase("io.write_runs"), open(output_path, "wb") as out:
+        for lcn, count in runs:
+            size = count * bytes_per_cluster
+            if lcn is None:
+                out.seek(size, os.SEEK_CUR)
+                METRICS.count("phase4_recover.sparse_bytes", size)
+                if hasher is not None and remaining > 0:
+                    zeros = int(min(size, remaining))
+                    for off in range(0, zeros, STREAM_CHUNK):
+                        hasher.update(bytes(min(STREAM_CHUNK, zeros - off)))
+                    remaining -= size
+                continue
+            for piece_size in [min(STREAM_CHUNK, size - off) for off in range(0, size, STREAM_CHUNK)]:
+                piece = next(pieces)
+                out.write(piece)
+                bytes_read += len(piece)
+                if len(piece) < piece_size:
+                    # Đọc thiếu (run vượt cuối ảnh): giữ đúng vị trí cho các run phía sau
+                    METRICS.count("phase4_recover.short_reads")
+                    out.seek(piece_size - len(piece), os.SEEK_CUR)
+                    piece += bytes(piece_size - len(piece))
+                if hasher is not None and remaining > 0:
+                    hasher.update(piece[:int(min(piece_size, remaining))])
+                    remaining -= piece_size
+        out.truncate(out.tell() if real_size is None else real_size)
+    return bytes_read
+
+def _head_runs(runs, nbytes, bytes_per_cluster):
+    """Các run (kể cả run thưa) phủ `nbytes` byte đầu của file."""
+    head, need = [], (nbytes + bytes_per_cluster - 1) // bytes_per_cluster
+    for lcn, count in runs:
+        if need <= 0:
+            break
+        take = min(count, need)
+        head.append((lcn, take))
+        need -= take
+    return head
+
+def iter_file_content(drive_path, runs, bytes_per_cluster, real_size, reader=None):
+    """
+    Sinh nội dung file theo từng khúc <= STREAM_CHUNK, đúng `real_size` byte: run thưa là số 0
+    (không đọc đĩa), đọc thiếu hoặc lỗi đọc được đệm số 0 để vị trí phần sau không lệch.
+    Dùng cho đầu ra dạng stream (archive), nơi không thể seek hay xóa file đã ghi dở.
+    """
+    ranges = []
+    for lcn, count in runs:
+        if lcn is None:
+            continue
+        start, end = lcn * bytes_per_cluster, (lcn + count) * bytes_per_cluster
+        ranges.extend((off, min(STREAM_CHUNK, end - off)) for off in range(start, end, STREAM_CHUNK))
+    pieces = _iter_run_pieces(drive_path, ranges, reader)
+
+    remaining = real_size
+    for lcn, count in runs:
+        if remaining <= 0:
+            break
+        size = count * bytes_per_cluster
+        if lcn is None:
+            zeros = min(size, remaining)
+            for off in range(0, zeros, STREAM_CHUNK):
+                yield bytes(min(STREAM_CHUNK, zeros - off))
+            remaining -= size
+            continue
+        for piece_size in [min(STREAM_CHUNK, size - off) for off in range(0, size, STREAM_CHUNK)]:
+            piece = b""
+            if pieces is not None:
+                try:
+                    piece = next(pieces)
+                except (OSError, StopIteration) as e:
+                    METRICS.count("io.read_errors")
+                    print(f"  [!] Lỗi khi đọc cluster (LCN: {lcn}): {e}")
+                    pieces = None
+            if len(piece) < piece_size:
+                METRICS.count("phase4_recover.short_reads")
+                piece += bytes(piece_size - len(piece))
+            if remaining > 0:
+                yield piece[:remaining]
+            remaining -= piece_size
+
+def _hashing(chunks, hasher):
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+def _warn_partial_entry(archive, name):
+    """Archive ghi tuần tự (tar/zip dạng stream): entry ghi dở không gỡ ra được."""
+    print(f"  [!] Entry '{name}' có thể đã ghi dở vào {archive.fmt} '{archive.target}' và không thể "
+          f"rollback; archive có thể hỏng từ entry này, nên kiểm tra lại hoặc chạy lại ra thư mục.")
+
+def _fanout(*sinks):
+    """Gộp nhiều record_sink (timeline, bản đồ thư mục...) thành một."""
+    sinks = [sink for sink in sinks if sink is not None]
+    if not sinks:
+        return None
+    if len(sinks) == 1:
+        return sinks[0]
+    def sink(*args):
+        for s in sinks:
+            s(*args)
+    return sink
+
+def iter_compressed_content(drive_path, data_info, bytes_per_cluster, reader=None, workers=0):
+    """
+    Đọc và giải nén một $DATA nén (LZNT1), sinh dữ liệu theo từng compression unit.
+    Cluster được đọc theo lô UNIT_BATCH unit nên bộ nhớ chỉ cỡ một lô, kể cả với file nén lớn.
+    Unit giải nén lỗi được thay bằng số 0 (giống cluster đọc lỗi ở iter_file_content).
+    workers > 1: giải nén các unit bằng process pool (cho file nén lớn).
+    """
+    unit_clusters = compression_unit_clusters(data_info["compression_unit"])
+    units = split_compression_units(data_info["runs"], unit_clusters)
+
+    def unit_blobs():
+        # Đọc cluster thật của cả lô trong một lượt, rồi cắt lại theo unit
+        for start in range(0, len(units), UNIT_BATCH):
+            batch = units[start:start + UNIT_BATCH]
+            extents = [extent for _, unit_extents, _ in batch for extent in unit_extents]
+            raw = read_clusters(drive_path, extents, bytes_per_cluster, reader=reader)
+            if len(raw) < sum(count for _, count in extents) * bytes_per_cluster:
+                METRICS.count("phase4_recover.short_reads")
+            pos = 0
+            for _, unit_extents, _ in batch:
+                size = sum(count for _, count in unit_extents) * bytes_per_cluster
+                yield raw[pos:pos + size]
+                pos += size
+
+    def unit_error(index, error):
+        METRICS.count("phase4_recover.decompress_errors")
+        print(f"  [!] Lỗi khi giải nén LZNT1 (unit {index}): {error}. Thay bằng số 0.")
+
+    METRICS.count("phase4_recover.compressed_files")
+    chunks = iter_decompressed(units, unit_blobs(), bytes_per_cluster, data_info["real_size"],
+                               workers=workers, on_error=unit_error)
+    while True:
+        with METRICS.phase("lznt1_decompress"):   # Gồm cả lần đọc cluster của lô mới
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        METRICS.count("phase4_recover.decompressed_bytes", len(chunk))
+        yield chunk
+
 # --- HÀM CHÍNH (MAIN) ---
 
-def main():
-    # --- ĐÃ SỬA: CODE CỨNG Ổ ĐĨA D: ---
-    # Đã xóa phần input() và kiểm tra drive_path
-    drive_path = r"\\.\E:" 
-    
-    print(f"*** Bắt đầu quá trình phân tích và khôi phục ổ đĩa: {drive_path} ***\n")
-    
-    # --- GIAI ĐOẠN 1: PHÂN TÍCH BOOT SECTOR ---
-    print("[+] --- GIAI ĐOẠN 1: PHÂN TÍCH BOOT SECTOR ---")
-    sector_data = read_disk_sector(drive_path, 0, 512)
-    if sector_data is None:
-        sys.exit(1) # Hàm read_disk_sector đã in lỗi
+def run_recovery(drive_path, reader=None, output_dir=OUTPUT_DIR, mft_list_file=MFT_LIST_FILE,
+                 extract=True, timeline=None, decompress_workers=0, triage_threshold=None,
+                 triage_tail=False, known_files=None, known_mode="tag", volumes=None,
+                 archive=None, incremental=None):
+    """
+    Chạy các GIAI ĐOẠN 1-4 trên một ổ đĩa/ảnh và trả về dict tóm tắt kết quả.
+    Mọi phân vùng NTFS tìm được (bảng GPT/MBR/EBR hoặc quét sector) đều được xử lý trong một
+    lượt, dùng chung một nguồn đọc và cache; mỗi phân vùng có thư mục khôi phục và danh sách
+    MFT record riêng (hậu tố .p<N>) khi có nhiều hơn một phân vùng.
+    volumes: list Volume đã mở sẵn (bỏ qua bước tìm phân vùng).
+    extract=False chỉ quét (GIAI ĐOẠN 1-3), không ghi file khôi phục.
+    timeline: TimelineWriter (tùy chọn) nhận mọi record ngay trong GIAI ĐOẠN 2.
+    decompress_workers > 1: giải nén file nén NTFS lớn bằng process pool.
+    triage_threshold (0..1, None = tắt): chấm điểm từng file bằng cluster đầu (và cuối nếu
+    triage_tail), khôi phục theo điểm giảm dần và bỏ qua file dưới ngưỡng.
+    known_files: KnownFileSet (tùy chọn); file khôi phục trùng hash trong tập được gắn nhãn
+    (known_mode="tag", liệt kê trong summary["known_files"]) hoặc bị xóa (known_mode="suppress";
+    file lớn khớp hash 64 KiB đầu thì bỏ qua luôn, không đọc phần còn lại).
+    archive: ArchiveWriter (tùy chọn); file khôi phục được ghi thẳng vào archive với đường dẫn
+    dựng lại từ MFT thay vì ghi ra output_dir (nhiều phân vùng: tiền tố partition_<N>/).
+    incremental: file trạng thái quét tăng dần (ntfs_incremental); chỉ phân tích lại khúc MFT đã
+    đổi so với lần quét trước và ghi báo cáo delta <incremental>.delta.json.
+    """
+    options = dict(archive=archive, extract=extract, timeline=timeline, decompress_workers=decompress_workers,
+                   triage_threshold=triage_threshold, triage_tail=triage_tail,
+                   known_files=known_files, known_mode=known_mode)
+    source = None
+    if volumes is None:
+        try:
+            with METRICS.phase("phase0_partitions"):
+                source, volumes = open_volumes(drive_path, reader)
+        except OSError as e:
+            print(f"[!] LỖI: Không mở được {drive_path}: {e}")
+            return {"drive": drive_path, "status": "error", "error": str(e), "valid_records": 0,
+                    "deleted_candidates": 0, "recovered": 0, "failed": 0, "output_dir": None}
+    try:
+        if len(volumes) == 1:
+            return recover_volume(volumes[0], output_dir, mft_list_file, incremental=incremental,
+                                  **options)
+        print(f"[+] Tìm thấy {len(volumes)} phân vùng NTFS, xử lý lần lượt.")
+        base, ext = os.path.splitext(mft_list_file)
+        results = [recover_volume(volume, os.path.join(output_dir, f"partition_{volume.index}"),
+                                  f"{base}.p{volume.index}{ext}",
+                                  archive_prefix=f"partition_{volume.index}/",
+                                  incremental=f"{incremental}.p{volume.index}" if incremental else None,
+                                  **options)
+                   for volume in volumes]
+    finally:
+        if source is not None:
+            source.close()
+    ok = [r for r in results if r["status"] == "ok"]
+    summary = {"drive": drive_path, "status": "ok" if ok else "error", "volumes": results,
+               "output_dir": os.path.abspath(output_dir) if extract and ok else None}
+    for key in ("valid_records", "deleted_candidates", "recovered", "failed"):
+        summary[key] = sum(r.get(key, 0) for r in results)
+    summary["candidates"] = [dict(c, partition=r["partition"]["index"])
+                             for r in results for c in r.get("candidates", [])][:CANDIDATE_SAMPLE]
+    summary["candidates_files"] = [r["candidates_file"] for r in results if r.get("candidates_file")]
+    if not ok:
+        summary["error"] = "; ".join(r.get("error", "") for r in results)
+    return summary
+
+def recover_volume(volume, output_dir=OUTPUT_DIR, mft_list_file=MFT_LIST_FILE, extract=True,
+                   timeline=None, decompress_workers=0, triage_threshold=None, triage_tail=False,
+                   known_files=None, known_mode="tag", archive=None, archive_prefix="",
+                   incremental=None):
+    """
+    GIAI ĐOẠN 1-4 trên một Volume: mọi lệnh đọc đi qua volume (offset tính từ đầu phân vùng).
+    Offset record trong báo cáo, danh sách MFT record và timeline là offset tuyệt đối trên ảnh.
+    """
+    summary, ntfs_info, candidates = scan_volume(volume, mft_list_file, timeline=timeline,
+                                                 triage_threshold=triage_threshold,
+                                                 triage_tail=triage_tail,
+                                                 resolve_paths=archive is not None and extract,
+                                                 incremental=incremental)
+    if summary["status"] != "ok" or not extract:
+        return summary
+    return extract_files(volume, ntfs_info, candidates, summary, output_dir,
+                         decompress_workers=decompress_workers, known_files=known_files,
+                         known_mode=known_mode, archive=archive, archive_prefix=archive_prefix)
+
+def scan_volume(volume, mft_list_file=MFT_LIST_FILE, timeline=None, triage_threshold=None,
+                triage_tail=False, resolve_paths=False, incremental=None):
+    """
+    GIAI ĐOẠN 1-3 trên một Volume: boot sector, quét MFT, lập bảng file đã xóa (kiểm tra runlist,
+    triage). resolve_paths=True: dựng đường dẫn đầy đủ từ MFT cho từng file (dùng cho archive).
+    Trả về (summary, ntfs_info, RecordTable); khi lỗi ntfs_info và bảng là None.
+    Kết quả có thể giữ lại để khôi phục nhiều lần bằng extract_files mà không quét lại.
+    incremental: đường dẫn file trạng thái; GIAI ĐOẠN 2-3 dùng scan_mft_incremental.
+    """
+    drive_path = volume.path
+    reader = volume
+    resolver = PathResolver() if resolve_paths else None
+    summary = {"drive": drive_path, "status": "ok", "partition": volume.describe(),
+               "valid_records": 0, "deleted_candidates": 0, "recovered": 0, "failed": 0, "output_dir": None}
+    print(f"*** Bắt đầu quá trình phân tích và khôi phục ổ đĩa: {drive_path} "
+          f"(phân vùng {volume.index}, offset {volume.offset}) ***\n")
 
-    print("\n[+] --- Thông tin Boot Sector ---")
-    # (Phần còn lại của hàm main giữ nguyên...)
-    
-    print(f"\n*** Bắt đầu quá trình phân tích và khôi phục ổ đĩa: {drive_path} ***\n")
-    
     # --- GIAI ĐOẠN 1: PHÂN TÍCH BOOT SECTOR ---
     print("[+] --- GIAI ĐOẠN 1: PHÂN TÍCH BOOT SECTOR ---")
-    sector_data = read_disk_sector(drive_path, 0, 512)
-    if sector_data is None:
-        sys.exit(1) 
+    with METRICS.phase("phase1_boot_sector"):
+        try:
+            sector_data = volume.boot_sector()
+        except OSError as e:
+            print(f"[!] Lỗi khi đọc boot sector tại offset {volume.offset}: {e}")
+            return dict(summary, status="error", error="Không đọc được boot sector"), None, None
+        if volume.boot_source != "primary":
+            print(f"  (Dùng boot sector {volume.boot_source}: bản chính bị hỏng)")
+
+        print("\n[+] --- Thông tin Boot Sector ---")
+        ntfs_info = parse_boot_sector(sector_data)
 
-    print("\n[+] --- Thông tin Boot Sector ---")
-    ntfs_info = parse_boot_sector(sector_data)
-    
     if ntfs_info is None:
         print("[!] Dừng lại do không phân tích được Boot Sector.")
-        sys.exit(1)
+        return dict(summary, status="error", error="Boot sector không hợp lệ"), None, None
 
     print(f"  📄 OEM_ID               : {ntfs_info['OEM_ID']}")
     print(f"  💾 BytesPerCluster      : {ntfs_info['BytesPerCluster']}")
     print(f"  📏 BytesPerFileRecord   : {ntfs_info['BytesPerFileRecord']}")
-    print(f"  📌 MFT_Offset           : {ntfs_info['MFT_Offset']}")
+    print(f"  📌 MFT_Offset           : {ntfs_info['MFT_Offset']} "
+          f"(trên ảnh: {volume.absolute(ntfs_info['MFT_Offset'])})")
 
     # --- GIAI ĐOẠN 2: QUÉT MFT ---
     print("\n[+] --- GIAI ĐOẠN 2: QUÉT MFT ---")
-    valid_record_offsets = read_mft_records(
-        drive_path, 
-        ntfs_info['MFT_Offset'], 
-        ntfs_info['BytesPerFileRecord'],
-        MAX_MFT_RECORDS_TO_SCAN,
-        MFT_LIST_FILE
-    )
+    record_sink = _fanout(timeline.add if timeline is not None else None,
+                          resolver.add if resolver is not None else None)
+    parsed = None   # Ứng viên đã phân tích sẵn (quét tăng dần)
+    with METRICS.phase("phase2_mft_scan"):
+        if incremental is not None:
+            from ntfs_incremental import scan_mft_incremental
+            valid_record_offsets, parsed, summary["mft_delta"] = scan_mft_incremental(
+                volume, ntfs_info, incremental, MAX_MFT_RECORDS_TO_SCAN, mft_list_file,
+                record_sink=record_sink)
+        else:
+            valid_record_offsets = read_mft_records(
+                drive_path,
+                ntfs_info['MFT_Offset'],
+                ntfs_info['BytesPerFileRecord'],
+                MAX_MFT_RECORDS_TO_SCAN,
+                mft_list_file,
+                reader=reader,
+                record_sink=record_sink,
+                base_offset=volume.offset
+            )
+        if timeline is not None:
+            timeline.flush()
+            summary["timeline"] = timeline.path
+    summary["valid_records"] = len(valid_record_offsets)
 
     if not valid_record_offsets:
         print("[!] Không tìm thấy MFT record hợp lệ. Dừng lại.")
-        sys.exit(1)
+        return dict(summary, status="error", error="Không tìm thấy MFT record hợp lệ"), None, None
 
     # --- GIAI ĐOẠN 3: PHÂN TÍCH TÊN FILE VÀ DATA CLUSTERS ---
     print("\n[+] --- GIAI ĐOẠN 3: TÌM FILE ĐÃ XÓA VÀ CLUSTER DATA ---")
-    print(f"  (Đọc {len(valid_record_offsets)} record từ file '{MFT_LIST_FILE}'...)\n")
-    
-    found_deleted_files = [] # Danh sách động, thay thế cho list code cứng
-    
-    for offset in valid_record_offsets:
-        record = read_disk_sector(drive_path, offset, ntfs_info['BytesPerFileRecord'])
-        if record is None or record[0:4] != b"FILE":
-            continue
-        
-        flags = struct.unpack("<H", record[22:24])[0]
-        deleted = not (flags & 0x0001)
-        name = parse_file_name_attribute(record)
-        
-        # CHỈ TÌM FILE BỊ XÓA VÀ CÓ TÊN
-        if deleted and name != "<không có tên>":
-            print(f"  [ĐÃ XÓA] Tìm thấy: {name} (tại MFT offset {offset})")
-            
-            # **NÂNG CẤP:** Tự động tìm cluster
-            clusters = parse_data_attribute(record)
-            
-            if clusters:
-                print(f"    -> Tìm thấy data runs: {clusters}")
-                found_deleted_files.append({"name": name, "clusters": clusters, "offset": offset})
-            else:
-                print(f"    -> Không tìm thấy data runs (có thể file quá nhỏ hoặc bị ghi đè).")
+    print(f"  (Đọc {len(valid_record_offsets)} record từ file '{mft_list_file}'...)\n")
+
+    # Bảng dạng cột: vài chục byte/file thay vì vài KB khi quét hàng triệu record
+    found_deleted_files = RecordTable()
+
+    # Runlist được kiểm tra theo hình học volume ngay khi thêm vào bảng, trước khi đọc bất kỳ
+    # cluster dữ liệu nào (không cần dựng bảng thứ hai chỉ chứa file hợp lệ)
+    with METRICS.phase("phase3_validate_runs"):
+        reserved = metadata_extents(drive_path, ntfs_info, reader=reader)
+    checked = {"rejected_candidates": 0, "rejected_bytes": 0, "clipped_bytes": 0}
+
+    def add_candidate(record_no, offset, name, data_info, **fields):
+        runs, stats = validate_runs(data_info, ntfs_info['TotalClusters'],
+                                    ntfs_info['BytesPerCluster'], reserved)
+        checked["rejected_bytes"] += stats["rejected_bytes"]
+        checked["clipped_bytes"] += stats["clipped_bytes"]
+        if runs is None:
+            checked["rejected_candidates"] += 1
+            return
+        j = found_deleted_files.append(record_no, offset, name, data_info, runs=runs, **fields)
+        if stats["reasons"]:
+            found_deleted_files[j]["runlist_issues"] = stats["reasons"]
+    progress = Progress("GIAI ĐOẠN 3", total=len(valid_record_offsets))
+
+    with METRICS.phase("phase3_parse"):
+        if parsed is not None:
+            # Quét tăng dần: record đã được phân tích ngay trong giai đoạn 2 (hoặc lấy từ lần trước)
+            for c in parsed:
+                progress.update(found=len(found_deleted_files))
+                METRICS.count("phase3_parse.deleted_named")
+                if c["data"]["compressed"]:
+                    METRICS.count("phase3_parse.compressed")
+                path = mtime = None
+                if resolver is not None and c["primary"][0] is not None:
+                    path, mtime = resolver.path(*c["primary"]), c["mtime"]
+                add_candidate(c["record_no"],
+                              volume.absolute(ntfs_info['MFT_Offset'] + c["index"] *
+                                              ntfs_info['BytesPerFileRecord']),
+                              c["name"], c["data"], flags=c["flags"],
+                              parent_ref=c["parent_ref"], path=path, mtime=mtime)
+        else:
+            for offset in valid_record_offsets:
+                progress.update(found=len(found_deleted_files))
+                METRICS.count("phase3_parse.records")
+                record = read_disk_sector(drive_path, offset, ntfs_info['BytesPerFileRecord'], reader=reader)
+                if record is None or record[0:4] != b"FILE":
+                    continue
+
+                flags = struct.unpack("<H", record[22:24])[0]
+                deleted = not (flags & 0x0001)
+                name = parse_file_name_attribute(record)
+
+                # CHỈ TÌM FILE BỊ XÓA VÀ CÓ TÊN
+                if deleted and name != "<không có tên>":
+                    METRICS.count("phase3_parse.deleted_named")
+
+                    # **NÂNG CẤP:** Tự động tìm cluster
+                    data_info = parse_data_info(record)
+                    clusters = None
+                    if data_info is not None and not data_info["resident"]:
+                        clusters = [(lcn, count) for lcn, count in data_info["runs"] if lcn is not None]
+
+                    if clusters:
+                        if data_info["compressed"]:
+                            METRICS.count("phase3_parse.compressed")
+                        path = mtime = None
+                        if resolver is not None:
+                            path, mtime = record_path_and_time(record, resolver)
+                        add_candidate(struct.unpack("<I", record[0x2C:0x30])[0],
+                                      volume.absolute(offset), name, data_info,
+                                      flags=flags, parent_ref=parse_file_name_parent(record),
+                                      path=path, mtime=mtime)
+                    else:
+                        # Không có data runs (file quá nhỏ hoặc bị ghi đè)
+                        METRICS.count("phase3_parse.no_data_runs")
+    progress.close()
+    print(f"  -> {len(found_deleted_files) + checked['rejected_candidates']} file đã xóa còn data runs.")
+
+    with METRICS.phase("phase3_validate_runs"):
+        checked["overlapping_candidates"] = find_overlaps(found_deleted_files)
+    for key, value in checked.items():
+        METRICS.count(f"phase3_validate_runs.{key}", value)
+    summary["runlist_validation"] = checked
+    print(f"  -> Kiểm tra runlist: loại {checked['rejected_candidates']} file, bỏ "
+          f"{checked['rejected_bytes']} byte ngoài volume/metadata, cắt {checked['clipped_bytes']} "
+          f"byte thừa, {checked['overlapping_candidates']} file dùng chung cluster.")
+    summary["deleted_candidates"] = len(found_deleted_files)
+
+    if triage_threshold is not None and found_deleted_files:
+        # Chấm điểm bằng cluster đầu/cuối, khôi phục file điểm cao trước, bỏ qua file rác
+        with METRICS.phase("phase3_triage"):
+            ranked = triage_candidates(drive_path, found_deleted_files, ntfs_info['BytesPerCluster'],
+                                       reader=reader, check_tail=triage_tail)
+        found_deleted_files = found_deleted_files.select(
+            [f.index for f in ranked if f["triage"]["score"] >= triage_threshold])
+        skipped = len(ranked) - len(found_deleted_files)
+        METRICS.count("phase3_triage.skipped", skipped)
+        summary["skipped_by_triage"] = skipped
+        print(f"  -> Triage: giữ {len(found_deleted_files)} file (điểm >= {triage_threshold}), "
+              f"bỏ qua {skipped} file.")
+
+    # Danh sách đầy đủ được ghi thẳng từ bảng ra file; summary chỉ giữ vài ứng viên đầu làm mẫu
+    summary["candidates_file"] = write_candidates(found_deleted_files,
+                                                  os.path.splitext(mft_list_file)[0] + ".candidates.jsonl")
+    summary["candidates"] = [candidate_entry(found_deleted_files[i])
+                             for i in range(min(CANDIDATE_SAMPLE, len(found_deleted_files)))]
+    return summary, ntfs_info, found_deleted_files
+
+def candidate_entry(f):
+    """Dict báo cáo của một ứng viên (RecordView)."""
+    return dict({"name": f["name"], "offset": f["offset"]},
+                **({"score": f["triage"]["score"]} if "triage" in f else {}),
+                **({"overlaps": f["overlaps"]} if "overlaps" in f else {}),
+                **({"runlist_issues": f["runlist_issues"]} if "runlist_issues" in f else {}))
+
+def write_candidates(table, path):
+    """
+    Ghi mọi ứng viên của RecordTable ra `path` (JSON Lines, mỗi dòng một file) theo từng hàng,
+    không dựng list dict cho cả bảng. Trả về đường dẫn, hoặc None nếu không ghi được.
+    """
+    try:
+        with open(path, "w", encoding="utf-8") as cf:
+            for f in table:
+                cf.write(json.dumps(candidate_entry(f), ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[!] Không ghi được danh sách ứng viên '{path}': {e}")
+        return None
+    print(f"  -> Danh sách {len(table)} ứng viên: '{path}'.")
+    return path
+
+def extract_files(volume, ntfs_info, found_deleted_files, summary, output_dir=OUTPUT_DIR,
+                  decompress_workers=0, known_files=None, known_mode="tag", archive=None,
+                  archive_prefix=""):
+    """
+    GIAI ĐOẠN 4: khôi phục các file trong `found_deleted_files` (RecordTable từ scan_volume, có
+    thể đã lọc bằng select) ra output_dir hoặc archive; cập nhật và trả về `summary`.
+    """
+    drive_path = volume.path
+    reader = volume
 
     # --- GIAI ĐOẠN 4: KHÔI PHỤC FILE (TỰ ĐỘNG) ---
     print("\n[+] --- GIAI ĐOẠN 4: KHÔI PHỤC FILE TỰ ĐỘNG ---")
-    
+
     if not found_deleted_files:
         print("[!] Không tìm thấy file nào đã xóa (còn data run) để khôi phục.")
         print("\n[+] === HOÀN THÀNH ===")
-        sys.exit(0)
+        return summary
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    print(f"[+] Tạo thư mục khôi phục tại: {os.path.abspath(OUTPUT_DIR)}")
-    
-    # **NÂNG CẤP:** Chạy vòng lặp trên danh sách TỰ ĐỘNG tìm được
-    for file_info in found_deleted_files:
-        file_name = file_info["name"]
-        clusters = file_info["clusters"]
-        offset = file_info["offset"] # Dùng để tránh trùng tên
-        
-        # Làm sạch tên file để tránh lỗi
-        safe_name = "".join(c for c in file_name if c.isalnum() or c in (' ', '.', '_', '-')).strip()
-        if not safe_name:
-            safe_name = f"recovered_file_offset_{offset}.dat" # Tên dự phòng
+    if archive is not None:
+        summary["archive"] = archive.target
+        print(f"[+] Ghi file khôi phục vào archive: {archive.target}")
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        summary["output_dir"] = os.path.abspath(output_dir)
+        print(f"[+] Tạo thư mục khôi phục tại: {os.path.abspath(output_dir)}")
+
+    if known_files is not None:
+        summary["known_files"] = []
+    progress = Progress("GIAI ĐOẠN 4", total=len(found_deleted_files))
+    with METRICS.phase("phase4_recover"):
+        # **NÂNG CẤP:** Chạy vòng lặp trên danh sách TỰ ĐỘNG tìm được
+        for file_info in found_deleted_files:
+            progress.update()
+            file_name = file_info["name"]
+            offset = file_info["offset"] # Dùng để tránh trùng tên
+
+            # Làm sạch tên file để tránh lỗi
+            safe_name = "".join(c for c in file_name if c.isalnum() or c in (' ', '.', '_', '-')).strip()
+            if not safe_name:
+                safe_name = f"recovered_file_offset_{offset}.dat" # Tên dự phòng
+
+            output_path = os.path.join(output_dir, safe_name)
 
-        print(f"[+] Đang khôi phục {safe_name}...")
-        
-        content = read_clusters(drive_path, clusters, ntfs_info['BytesPerCluster'])
-        
-        if content:
-            output_path = os.path.join(OUTPUT_DIR, safe_name)
-            
             # Xử lý nếu trùng tên file
-            if os.path.exists(output_path):
+            if archive is not None:
+                output_path = archive.unique_name(archive_prefix + (file_info.get("path") or safe_name),
+                                                  offset)
+            elif os.path.exists(output_path):
                 base, ext = os.path.splitext(safe_name)
-                output_path = os.path.join(OUTPUT_DIR, f"{base}_(offset_{offset}){ext}")
-            
-            try:
-                with open(output_path, "wb") as out_file:
-                    out_file.write(content)
-                print(f"  ✅ {safe_name} đã khôi phục vào {output_path}")
-            except Exception as e:
-                print(f"  ❌ Lỗi khi GHI file {safe_name}: {e}")
-        else:
-            print(f"  ❌ Lỗi khi ĐỌC cluster cho file {safe_name}. (Nội dung trống)")
+                output_path = os.path.join(output_dir, f"{base}_(offset_{offset}){ext}")
+
+            data_info = file_info["data"]
+            if (known_files is not None and known_mode == "suppress" and not data_info["compressed"]
+                    and data_info["real_size"] >= HEAD_CHECK_MIN_SIZE):
+                # Loại sớm file lớn đã biết bằng hash 64 KiB đầu: không đọc phần còn lại
+                head = read_clusters(drive_path, _head_runs(data_info["runs"], HEAD_SIZE,
+                                                            ntfs_info['BytesPerCluster']),
+                                     ntfs_info['BytesPerCluster'], reader=reader)
+                if known_files.match_head(head):
+                    METRICS.count("phase4_recover.known_head_skipped")
+                    METRICS.count("phase4_recover.known_bytes_skipped", data_info["real_size"])
+                    summary["known_files"].append({"name": file_name, "offset": offset,
+                                                   "match": "head64k", "action": "suppressed"})
+                    continue
+
+            hasher = known_files.hasher() if known_files is not None else None
+            if data_info["compressed"]:
+                # File nén NTFS: giải nén và ghi từng compression unit thay vì ghi byte nén thô
+                chunks = iter_compressed_content(drive_path, data_info, ntfs_info['BytesPerCluster'],
+                                                 reader=reader, workers=decompress_workers)
+                if hasher is not None:
+                    chunks = _hashing(chunks, hasher)
+                try:
+                    if archive is not None:
+                        archive.add(output_path, data_info["real_size"], chunks, file_info.get("mtime"))
+                        written = data_info["real_size"]
+                    else:
+                        written = 0
+                        with open(output_path, "wb") as out_file:
+                            for chunk in chunks:
+                                out_file.write(chunk)
+                                written += len(chunk)
+                except Exception as e:
+                    METRICS.count("phase4_recover.write_errors")
+                    summary["failed"] += 1
+                    print(f"  ❌ Lỗi khi GHI file {safe_name}: {e}")
+                    if archive is not None:
+                        _warn_partial_entry(archive, output_path)
+                    elif os.path.exists(output_path):
+                        os.remove(output_path)
+                    continue
+            elif archive is not None:
+                # Stream thẳng vào archive: không file tạm, bộ nhớ chỉ vài khúc STREAM_CHUNK
+                chunks = iter_file_content(drive_path, data_info["runs"], ntfs_info['BytesPerCluster'],
+                                           data_info["real_size"], reader=reader)
+                try:
+                    archive.add(output_path, data_info["real_size"],
+                                _hashing(chunks, hasher) if hasher is not None else chunks,
+                                file_info.get("mtime"))
+                except Exception as e:
+                    METRICS.count("phase4_recover.write_errors")
+                    summary["failed"] += 1
+                    print(f"  ❌ Lỗi khi GHI file {safe_name} vào archive: {e}")
+                    _warn_partial_entry(archive, output_path)
+                    continue
+                written = data_info["real_size"]
+            else:
+                # Ghi theo luồng; run thưa thành lỗ trong file đích, không đọc đĩa
+                try:
+                    write_runs(drive_path, data_info["runs"], ntfs_info['BytesPerCluster'],
+                               output_path, real_size=data_info["real_size"], reader=reader,
+                               hasher=hasher)
+                except OSError as e:
+                    METRICS.count("phase4_recover.write_errors")
+                    summary["failed"] += 1
+                    print(f"  ❌ Lỗi khi khôi phục file {safe_name}: {e}")
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                    continue
+                written = data_info["real_size"]
+
+            if hasher is not None:
+                algo = known_files.match(hasher.digests())
+                if algo is not None:
+                    METRICS.count("phase4_recover.known_files")
+                    entry = {"name": file_name, "offset": offset, "match": algo,
+                             "hash": hasher.hexdigests()[algo], "action": known_mode}
+                    if archive is not None:
+                        entry["action"] = "tag"   # Đã nằm trong archive, không xóa được nữa
+                    elif known_mode == "suppress":
+                        os.remove(output_path)
+                        summary["known_files"].append(entry)
+                        continue
+                    entry["path"] = output_path
+                    summary["known_files"].append(entry)
+
+            summary["recovered"] += 1
+            METRICS.count("phase4_recover.files_written")
+            METRICS.count("phase4_recover.bytes_written", written)
+    progress.close()
+    if summary["failed"]:
+        print(f"  [!] {summary['failed']} file không ghi được (xem lỗi ở trên).")
+    if known_files is not None:
+        print(f"  -> {len(summary['known_files'])} file trùng tập hash đã biết "
+              f"({'đã loại bỏ' if known_mode == 'suppress' else 'đã gắn nhãn'}).")
 
     print("\n[+] === HOÀN THÀNH TẤT CẢ CÁC GIAI ĐOẠN ===")
+    return summary
+
+def main():
+    # --- ĐÃ SỬA: CODE CỨNG Ổ ĐĨA D: ---
+    # Đã xóa phần input(); ổ đĩa mặc định vẫn là E:, có thể đổi qua tham số dòng lệnh
+    ap = argparse.ArgumentParser(description="Phân tích MFT và khôi phục file NTFS đã xóa.")
+    ap.add_argument("drive", nargs="?", default=r"\\.\E:", help="Ổ đĩa hoặc file ảnh cần khôi phục")
+    ap.add_argument("--metrics", help="Ghi thời gian từng giai đoạn và bộ đếm I/O ra file JSON")
+    ap.add_argument("--profile", help="Bật cProfile và ghi stats ra file này")
+    ap.add_argument("--tracemalloc", action="store_true", help="Đo peak bộ nhớ Python bằng tracemalloc")
+    ap.add_argument("--prefetch-depth", type=int, default=0,
+                    help="Số lệnh đọc song song (0 = đọc tuần tự như cũ)")
+    ap.add_argument("--prefetch-window", type=int, default=DEFAULT_WINDOW,
+                    help="Kích thước mỗi lệnh đọc prefetch (byte)")
+    ap.add_argument("--timeline", help="Xuất timeline MACB trong lúc quét MFT (.body, .csv hoặc .jsonl)")
+    ap.add_argument("--timeline-format", choices=FORMATS, default=None,
+                    help="Định dạng timeline (mặc định theo phần mở rộng)")
+    ap.add_argument("--mapfile", help="Map file của ntfs_rescue/ddrescue: chỉ đọc vùng đã cứu được, "
+                                      "vùng lỗi coi như số 0")
+    ap.add_argument("--size", type=int, default=None,
+                    help="Kích thước nguồn (byte) nếu không tự đọc được (vd volume raw \\\\.\\E:)")
+    ap.add_argument("--triage-threshold", type=float, default=None,
+                    help="Chấm điểm file trước khi khôi phục, bỏ qua file dưới ngưỡng (0..1, vd 0.3)")
+    ap.add_argument("--triage-tail", action="store_true",
+                    help="Đọc thêm cluster cuối để kiểm tra chữ ký cuối file khi triage")
+    ap.add_argument("--known-hashes", help="Tập hash file đã biết (CSV kiểu NSRL hoặc text mỗi dòng "
+                                           "một hash) để lọc file hệ điều hành/ứng dụng")
+    ap.add_argument("--known-mode", choices=("tag", "suppress"), default="tag",
+                    help="tag: giữ file và liệt kê trong báo cáo; suppress: không giữ file đã biết")
+    ap.add_argument("--archive", help="Ghi file khôi phục vào archive (.tar, .tar.gz, .zip) thay vì "
+                                      "thư mục; '-' = tar ra stdout (log chuyển sang stderr)")
+    ap.add_argument("--archive-format", choices=ARCHIVE_FORMATS, default=None,
+                    help="Định dạng archive (mặc định theo phần mở rộng)")
+    ap.add_argument("--incremental", metavar="STATE",
+                    help="Quét MFT tăng dần: chỉ phân tích lại khúc 1 MiB đã đổi so với lần trước "
+                         "(lưu trong STATE), ghi báo cáo delta STATE.delta.json")
+    ap.add_argument("--decompress-workers", type=int, default=0,
+                    help="Số process giải nén LZNT1 cho file nén lớn (0 = giải nén tại chỗ)")
+    args = ap.parse_args()
+
+    reader = None
+    timeline = None
+    if args.mapfile:
+        reader = MappedReader(args.drive, args.mapfile, depth=max(1, args.prefetch_depth),
+                              window=args.prefetch_window, size=args.size)
+    elif args.prefetch_depth > 0 or args.size:
+        reader = PrefetchReader(args.drive, depth=max(1, args.prefetch_depth), window=args.prefetch_window,
+                                size=args.size)
+    if args.timeline:
+        timeline = TimelineWriter(args.timeline, args.timeline_format)
+    known_files = KnownFileSet.load(args.known_hashes) if args.known_hashes else None
+    archive = ArchiveWriter(args.archive, args.archive_format) if args.archive else None
+    # stdout dành cho dữ liệu archive: mọi log chuyển sang stderr
+    log_stream = contextlib.redirect_stdout(sys.stderr) if args.archive == "-" else contextlib.nullcontext()
+    try:
+        with log_stream, profiling(args.profile, args.tracemalloc):
+            summary = run_recovery(args.drive, reader=reader, timeline=timeline,
+                                   decompress_workers=args.decompress_workers,
+                                   triage_threshold=args.triage_threshold,
+                                   triage_tail=args.triage_tail,
+                                   known_files=known_files, known_mode=args.known_mode,
+                                   archive=archive, incremental=args.incremental)
+        if summary["status"] != "ok":
+            sys.exit(1)
+    finally:
+        if reader is not None:
+            reader.close()
+        if timeline is not None:
+            timeline.close()
+        if archive is not None:
+            archive.close()
+        if args.metrics:
+            METRICS.export_json(args.metrics)
 
 # --- ĐIỂM BẮT ĐẦU CHẠY SCRIPT ---
 if __name__ == "__main__":
     main()
     
-## Phiên bản tốt nhất của test_v3.py đã được hoàn thiện ở trên.
\ No newline at end of file
+## Phiên bản tốt nhất của test_v3.py đã được hoàn thiện ở trên.
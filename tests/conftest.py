@@ -0,0 +1,55 @@
+# conftest.py
+# Mục đích: fixture dùng chung cho các test hành vi dựng trên ảnh tổng hợp của ntfs_image_gen.
+# Các module của dự án nằm phẳng ở thư mục gốc nên thêm thư mục gốc vào sys.path.
+
+import contextlib
+import hashlib
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ntfs_image_gen import build_image  # noqa: E402
+
+# Ảnh nhỏ nhưng đủ mọi loại file: thưa, nén LZNT1, phân mảnh, resident, đã xóa
+IMAGE_OPTIONS = {"size_mb": 64, "records": 400, "sparse_ratio": 0.2, "compressed_ratio": 0.3,
+                 "fragmentation": 0.3, "max_file_clusters": 24, "seed": 3}
+
+
+def sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+def recoverable(manifest):
+    """{tên: sha1} của các file đã xóa còn data run (những file giai đoạn 4 phải khôi phục)."""
+    return {f["name"]: f["sha1"] for f in manifest["files"]
+            if f["deleted"] and f["kind"] != "resident"}
+
+def quiet(func, *args, **kwargs):
+    """Gọi hàm in nhiều tiến độ mà không làm rối output của pytest."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+@pytest.fixture(scope="session")
+def image_factory(tmp_path_factory):
+    """make(scheme, **tùy chọn) -> manifest; ảnh cùng tham số chỉ sinh một lần mỗi phiên test."""
+    built = {}
+
+    def make(scheme="mbr", **options):
+        key = (scheme, tuple(sorted(options.items())))
+        if key not in built:
+            path = str(tmp_path_factory.mktemp("images") / f"{scheme}.img")
+            built[key] = build_image(path, scheme=scheme, **dict(IMAGE_OPTIONS, **options))
+        return built[key]
+    return make
+
+@pytest.fixture
+def fresh_image(tmp_path):
+    """Ảnh riêng cho test có ghi/sửa ảnh (không dùng chung với test khác)."""
+    def make(scheme="mbr", **options):
+        return build_image(str(tmp_path / f"{scheme}.img"), scheme=scheme,
+                           **dict(IMAGE_OPTIONS, **options))
+    return make
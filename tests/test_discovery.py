@@ -0,0 +1,46 @@
+# test_discovery.py
+# Mục đích: tìm phân vùng theo bảng (MBR, GPT, chuỗi EBR) và suy ra hình học khi mất cả hai VBR.
+
+import pytest
+
+from conftest import quiet
+from ntfs_discovery import discover_partitions, ntfs_partitions
+from ntfs_geometry import infer_geometry, rebuild_vbr
+from recovery_ntfs import run_recovery
+
+
+@pytest.mark.parametrize("scheme, expected", [("mbr", "mbr"), ("gpt", "gpt"), ("ebr", "mbr"),
+                                              ("raw", "raw")])
+def test_table_discovery(image_factory, scheme, expected):
+    manifest = image_factory(scheme)
+    result = quiet(discover_partitions, manifest["image"], scan_fallback=False)
+    assert result["scheme"] == expected
+    parts = ntfs_partitions(result)
+    assert [p["offset"] for p in parts] == [manifest["partition_offset"]]
+    assert parts[0]["boot"]["mft_lcn"] == manifest["mft_lcn"]
+    if scheme == "ebr":
+        assert parts[0]["scheme"] == "ebr"
+    assert result["reads"] <= 4                   # Vài lần đọc, không quét từng sector
+
+def test_backup_vbr_used_when_primary_is_corrupt(image_factory):
+    manifest = image_factory("gpt", corrupt_vbr="primary")
+    parts = ntfs_partitions(quiet(discover_partitions, manifest["image"], scan_fallback=False))
+    assert [p["offset"] for p in parts] == [manifest["partition_offset"]]
+    assert parts[0]["boot_source"] == "backup"
+
+def test_infer_geometry_without_vbr(image_factory):
+    manifest = image_factory("mbr", corrupt_vbr="both")
+    geometry = quiet(infer_geometry, manifest["image"])
+    assert geometry is not None
+    assert geometry["start_lba"] * manifest["bytes_per_sector"] == manifest["partition_offset"]
+    for key in ("bytes_per_cluster", "mft_lcn", "mftmirr_lcn", "record_size"):
+        assert geometry[key] == manifest[key], key
+
+def test_rebuilt_vbr_recovers_files(fresh_image, tmp_path):
+    manifest = fresh_image("mbr", corrupt_vbr="both")
+    assert quiet(rebuild_vbr, manifest["image"]) is not None
+    summary = quiet(run_recovery, manifest["image"], output_dir=str(tmp_path / "out"),
+                    mft_list_file=str(tmp_path / "mft.txt"), extract=False)
+    assert summary["status"] == "ok"
+    assert summary["deleted_candidates"] == sum(
+        1 for f in manifest["files"] if f["deleted"] and f["kind"] != "resident")
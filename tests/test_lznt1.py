@@ -0,0 +1,84 @@
+# test_lznt1.py
+# Mục đích: giải nén LZNT1 và ghép compression unit (unit nén, unit thô, unit thưa).
+
+import random
+
+import pytest
+
+from ntfs_image_gen import lznt1_compress
+from ntfs_lznt1 import (assemble_compressed, iter_decompressed, lznt1_decompress,
+                        split_compression_units)
+
+CLUSTER = 4096
+UNIT = 16
+
+
+def _compressed_file(units):
+    """(runs, blob từng unit, nội dung gốc) cho một file gồm các unit "compressed"/"raw"/"sparse"."""
+    rng = random.Random(7)
+    runs, blobs, content = [], [], b""
+    lcn = 100
+    for kind in units:
+        if kind == "compressed":
+            data = bytes(rng.choice(b"ntfs ") for _ in range(UNIT * CLUSTER))
+            packed = lznt1_compress(data)
+            used = -(-len(packed) // CLUSTER)
+            runs += [(lcn, used), (None, UNIT - used)]
+            blobs.append(packed + bytes(used * CLUSTER - len(packed)))
+            lcn += used
+        elif kind == "raw":
+            data = rng.randbytes(UNIT * CLUSTER)
+            runs.append((lcn, UNIT))
+            blobs.append(data)
+            lcn += UNIT
+        else:
+            data = bytes(UNIT * CLUSTER)
+            runs.append((None, UNIT))
+            blobs.append(b"")
+        content += data
+    return runs, blobs, content
+
+
+@pytest.mark.parametrize("data", [b"", b"a", b"abc" * 5000, bytes(range(256)) * 40])
+def test_roundtrip(data):
+    assert bytes(lznt1_decompress(lznt1_compress(data))) == data
+
+def test_split_compression_units():
+    runs, _, _ = _compressed_file(["compressed", "raw", "sparse"])
+    kinds = [kind for kind, _, _ in split_compression_units(runs, UNIT)]
+    assert kinds == ["compressed", "raw", "sparse"]
+
+def test_stream_matches_assembled():
+    runs, blobs, content = _compressed_file(["compressed", "raw", "sparse", "compressed"] * 20)
+    units = split_compression_units(runs, UNIT)
+    real_size = len(content) - 1234
+    chunks = list(iter_decompressed(units, iter(blobs), CLUSTER, real_size))
+    assert b"".join(chunks) == content[:real_size]
+    assert max(len(c) for c in chunks) == UNIT * CLUSTER   # Một unit mỗi lần, không cả file
+    assert assemble_compressed(units, blobs, CLUSTER, real_size) == content[:real_size]
+
+def test_corrupt_unit_becomes_zeros():
+    runs, blobs, content = _compressed_file(["compressed", "compressed"])
+    units = split_compression_units(runs, UNIT)
+    blobs[0] = b"\xff\xbf" + b"\x01" * 64            # Back-reference ra ngoài chunk
+    errors = []
+    out = b"".join(iter_decompressed(units, blobs, CLUSTER, len(content),
+                                     on_error=lambda index, e: errors.append(index)))
+    assert errors == [0]
+    assert out == bytes(UNIT * CLUSTER) + content[UNIT * CLUSTER:]
+    with pytest.raises(ValueError):
+        b"".join(iter_decompressed(units, blobs, CLUSTER, len(content)))
+
+def test_oversized_chunk_is_value_error():
+    # 'a' rồi back-reference dài 4098 byte: token tiếp theo nằm sau byte thứ 4096 của chunk
+    chunk = b"\x06a\xff\x0f\xff\x0f"
+    with pytest.raises(ValueError):
+        lznt1_decompress((0xB000 | len(chunk) - 1).to_bytes(2, "little") + chunk)
+
+    runs, blobs, content = _compressed_file(["compressed", "compressed"])
+    units = split_compression_units(runs, UNIT)
+    blobs[1] = (0xB000 | len(chunk) - 1).to_bytes(2, "little") + chunk
+    errors = []
+    out = b"".join(iter_decompressed(units, blobs, CLUSTER, len(content),
+                                     on_error=lambda index, e: errors.append(index)))
+    assert errors == [1] and out == content[:UNIT * CLUSTER] + bytes(UNIT * CLUSTER)
@@ -0,0 +1,251 @@
+# test_recovery.py
+# Mục đích: khôi phục đầu-cuối trên ảnh tổng hợp: nội dung file (kể cả thưa và nén LZNT1),
+# archive tar/zip, quét MFT tăng dần và đọc qua rescue map.
+
+import json
+import os
+import struct
+import tarfile
+import zipfile
+
+import pytest
+
+from conftest import quiet, recoverable, sha1
+from ntfs_archive import ArchiveWriter, record_name_and_time
+from ntfs_prefetch import PrefetchReader, source_size
+from ntfs_records import RecordTable
+from ntfs_rescue import BAD_SECTOR, FINISHED, MappedReader, RescueImager, RescueMap
+from ntfs_timeline import TimelineWriter, parse_record_times
+from ntfs_volume import SharedSource, Volume, open_volumes
+from recovery_ntfs import run_recovery, validate_runs
+
+
+def _recover(image, tmp_path, **options):
+    out = tmp_path / "out"
+    summary = quiet(run_recovery, image, output_dir=str(out), mft_list_file=str(tmp_path / "mft.txt"),
+                    **options)
+    return summary, out
+
+def _recovered_hashes(out):
+    return {name: sha1((out / name).read_bytes()) for name in os.listdir(out)}
+
+
+@pytest.mark.parametrize("scheme", ["mbr", "gpt", "ebr"])
+def test_recovered_content(image_factory, tmp_path, scheme):
+    manifest = image_factory(scheme)
+    want = recoverable(manifest)
+    kinds = {f["kind"] for f in manifest["files"] if f["name"] in want}
+    assert {"sparse", "compressed", "nonresident"} <= kinds
+    summary, out = _recover(manifest["image"], tmp_path)
+    assert summary["status"] == "ok"
+    assert summary["recovered"] == len(want) and summary["failed"] == 0
+    assert _recovered_hashes(out) == want
+
+@pytest.mark.parametrize("fmt", ["tar", "zip"])
+def test_archive_content(image_factory, tmp_path, fmt):
+    manifest = image_factory("gpt")
+    target = tmp_path / f"recovered.{fmt}"
+    with ArchiveWriter(str(target)) as archive:
+        summary, _ = _recover(manifest["image"], tmp_path, archive=archive)
+    assert summary["recovered"] == len(recoverable(manifest))
+    if fmt == "tar":
+        with tarfile.open(target) as tf:
+            got = sorted(sha1(tf.extractfile(m).read()) for m in tf.getmembers() if m.isfile())
+    else:
+        with zipfile.ZipFile(target) as zf:
+            got = sorted(sha1(zf.read(name)) for name in zf.namelist())
+    assert got == sorted(recoverable(manifest).values())
+    assert not (tmp_path / "out").exists()           # Archive không ghi file tạm ra thư mục
+
+
+def _attribute_offset(image, entry, attr_type):
+    """Offset tuyệt đối của thuộc tính `attr_type` đầu tiên trong FILE record của `entry`."""
+    with open(image, "rb") as f:
+        f.seek(entry["offset"])
+        record = f.read(1024)
+    p, = struct.unpack_from("<H", record, 0x14)
+    while p + 8 <= len(record):
+        kind, length = struct.unpack_from("<II", record, p)
+        if kind == attr_type:
+            return entry["offset"] + p
+        if kind == 0xFFFFFFFF or length == 0:
+            break
+        p += length
+    raise AssertionError(f"không thấy thuộc tính 0x{attr_type:X}")
+
+def _patch(image, offset, data):
+    with open(image, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+def test_corrupt_compression_unit_does_not_stop_scan(fresh_image, tmp_path):
+    manifest = fresh_image("mbr")
+    victim = next(f for f in manifest["files"] if f["deleted"] and f["kind"] == "compressed")
+    _patch(manifest["image"], _attribute_offset(manifest["image"], victim, 0x80) + 0x22,
+           struct.pack("<H", 0x0104))
+    summary, _ = _recover(manifest["image"], tmp_path, extract=False)
+    assert summary["status"] == "ok"
+    assert summary["deleted_candidates"] == len(recoverable(manifest))
+
+def test_validate_runs_rejects_runs_outside_int64():
+    info = {"resident": False, "runs": [(100, 4), (None, 1 << 63)], "real_size": 4096,
+            "compressed": True, "sparse": True, "compression_unit": 4}
+    runs, stats = validate_runs(info, 1 << 20, 4096)
+    assert runs is None and stats["reasons"] == ["run_out_of_range"]
+
+def test_validate_runs_trims_compressed_tail():
+    # Run thưa khổng lồ sau unit cuối của file nén bị cắt, bảng lưu được mà không tràn array("q")
+    info = {"resident": False, "runs": [(100, 4), (None, 12), (None, 1 << 62)],
+            "real_size": 10000, "compressed": True, "sparse": True, "compression_unit": 4}
+    runs, _ = validate_runs(info, 1 << 20, 4096)
+    assert runs == [(100, 4), (None, 12)]
+    table = RecordTable()
+    i = table.append(40, 0, "a.txt", dict(info, compression_unit=0x0104), runs=runs)
+    assert table[i]["data"]["compression_unit"] == 0x0104
+
+def test_truncated_standard_information(fresh_image, tmp_path):
+    manifest = fresh_image("mbr")
+    image = manifest["image"]
+    victim = next(f for f in manifest["files"] if f["deleted"] and f["kind"] == "nonresident")
+    _patch(image, _attribute_offset(image, victim, 0x10) + 0x14, struct.pack("<H", 0x3F0))
+    with open(image, "rb") as f:
+        f.seek(victim["offset"])
+        record = f.read(1024)
+    info = parse_record_times(record)
+    assert info["si"] is None and info["names"][0][0] == victim["name"]
+    assert record_name_and_time(record)[:1] == (victim["name"],)
+
+    # Quét có timeline và trạng thái tăng dần vẫn đi hết, kể cả lượt dùng lại trạng thái
+    state = str(tmp_path / "disk.mftstate")
+    for _ in range(2):
+        timeline = TimelineWriter(str(tmp_path / "timeline.jsonl"))
+        try:
+            summary, _ = _recover(image, tmp_path, extract=False, timeline=timeline, incremental=state)
+        finally:
+            timeline.close()
+        assert summary["status"] == "ok"
+        assert summary["deleted_candidates"] == len(recoverable(manifest))
+    assert summary["mft_delta"]["chunks_parsed"] == 0
+
+def _set_in_use(image, entry, in_use):
+    """Bật/tắt cờ in-use (0x16) của FILE record của file `entry` trong manifest."""
+    with open(image, "r+b") as f:
+        f.seek(entry["offset"] + 0x16)
+        flags, = struct.unpack("<H", f.read(2))
+        f.seek(entry["offset"] + 0x16)
+        f.write(struct.pack("<H", flags | 1 if in_use else flags & ~1))
+
+def test_incremental_delta(fresh_image, tmp_path):
+    manifest = fresh_image("mbr")
+    image, state = manifest["image"], str(tmp_path / "disk.mftstate")
+    first, _ = _recover(image, tmp_path, extract=False, incremental=state)
+    assert first["mft_delta"]["baseline"]
+
+    live = next(f for f in manifest["files"] if not f["deleted"] and f["kind"] == "nonresident")
+    dead = next(f for f in manifest["files"] if f["deleted"] and f["kind"] == "nonresident")
+    _set_in_use(image, live, False)
+    _set_in_use(image, dead, True)
+    second, _ = _recover(image, tmp_path, extract=False, incremental=state)
+    delta = second["mft_delta"]
+    assert (delta["created"], delta["deleted"], delta["modified"]) == (1, 1, 0)
+    assert delta["chunks_parsed"] == 1 and delta["chunks_reused"] == delta["chunks"] - 1
+    with open(delta["report"], encoding="utf-8") as rf:
+        report = json.load(rf)
+    assert [e["offset"] for e in report["deleted"]] == [live["offset"]]
+    assert [e["offset"] for e in report["created"]] == [dead["offset"]]
+    assert second["deleted_candidates"] == first["deleted_candidates"]
+
+    # Kết quả tăng dần phải giống hệt một lượt quét đầy đủ
+    full, _ = _recover(image, tmp_path, extract=False)
+    assert second["candidates"] == full["candidates"]
+
+@pytest.mark.parametrize("damage", ["truncated", "bad_chunk", "other_geometry"])
+def test_incremental_bad_state_rescans(fresh_image, tmp_path, damage):
+    manifest = fresh_image("mbr")
+    image, state = manifest["image"], str(tmp_path / "disk.mftstate")
+    full, _ = _recover(image, tmp_path, extract=False, incremental=state)
+    with open(state, encoding="utf-8") as sf:
+        lines = sf.readlines()
+    if damage == "truncated":                 # Lượt trước bị ngắt giữa lúc ghi
+        lines[-1] = lines[-1][:len(lines[-1]) // 2]
+    elif damage == "bad_chunk":
+        lines[1] = json.dumps({"chunk": 0}) + "\n"
+    else:
+        lines[0] = json.dumps(dict(json.loads(lines[0]), record_size=4096)) + "\n"
+    with open(state, "w", encoding="utf-8") as sf:
+        sf.writelines(lines)
+
+    # Trạng thái hỏng/không khớp: quét lại đầy đủ, kết quả như lần đầu, rồi lần sau dùng lại được
+    rescan, _ = _recover(image, tmp_path, extract=False, incremental=state)
+    assert rescan["mft_delta"]["baseline"] and rescan["candidates"] == full["candidates"]
+    reuse, _ = _recover(image, tmp_path, extract=False, incremental=state)
+    assert reuse["mft_delta"]["chunks_parsed"] == 0 and reuse["candidates"] == full["candidates"]
+
+
+def test_rescue_image_and_mapped_reader(image_factory, tmp_path):
+    manifest = image_factory("mbr")
+    copy, mapfile = str(tmp_path / "copy.img"), str(tmp_path / "copy.map")
+    imager = RescueImager(manifest["image"], copy, mapfile)
+    try:
+        result = quiet(imager.run)
+    finally:
+        imager.close()
+    assert result[FINISHED] == manifest["image_size"] and result[BAD_SECTOR] == 0
+    with open(manifest["image"], "rb") as a, open(copy, "rb") as b:
+        assert a.read() == b.read()
+
+    # Đánh dấu cluster đầu của một file đã xóa là sector lỗi: chỉ file đó bị ảnh hưởng
+    victim = next(f for f in manifest["files"] if f["deleted"] and f["kind"] == "nonresident")
+    cluster = manifest["bytes_per_cluster"]
+    bad_offset = manifest["partition_offset"] + victim["runs"][0][0] * cluster
+    rescue_map = RescueMap.load(mapfile)
+    rescue_map.mark(bad_offset, cluster, BAD_SECTOR)
+    rescue_map.save(mapfile)
+
+    reader = MappedReader(copy, mapfile)
+    try:
+        summary, out = _recover(copy, tmp_path, reader=reader)
+    finally:
+        reader.close()
+    assert summary["status"] == "ok"
+    got = _recovered_hashes(out)
+    want = recoverable(manifest)
+    assert {name for name in want if got.get(name) != want[name]} == {victim["name"]}
+    with open(copy, "rb") as f:
+        f.seek(bad_offset)
+        original = f.read(min(victim["size"], cluster * victim["runs"][0][1]))
+    recovered = (out / victim["name"]).read_bytes()
+    assert recovered[:cluster] == bytes(cluster)[:len(recovered)]
+    assert recovered[cluster:len(original)] == original[cluster:]
+
+
+def test_source_size_from_vbr(image_factory):
+    # Handle không báo được kích thước (như volume raw trên Windows): lấy từ VBR
+    manifest = image_factory("raw")
+    with open(manifest["image"], "rb") as f:
+        vbr = f.read(512)
+    r, w = os.pipe()
+    try:
+        os.write(w, vbr)
+        assert source_size(r) == manifest["image_size"]
+    finally:
+        os.close(r)
+        os.close(w)
+
+def test_reader_size_explicit_or_unknown(image_factory):
+    manifest = image_factory("raw")
+    with open(manifest["image"], "rb") as f:
+        head = f.read(4096)
+    with PrefetchReader(manifest["image"], depth=1, size=1024) as reader:
+        assert reader.size == 1024
+        source, volumes = open_volumes(manifest["image"], reader)
+        assert volumes[0].pread(512, 4096) == head[512:1024]
+
+    # Không biết kích thước: Volume không cắt lệnh đọc về 0 byte
+    with PrefetchReader(manifest["image"], depth=1) as reader:
+        reader.size = None
+        volume = Volume(SharedSource(manifest["image"], reader))
+        assert volume.size is None
+        assert volume.pread(0, 4096) == head
+        assert list(volume.read_ranges([(512, 512)])) == [head[512:1024]]
+        assert volume.boot_sector() == head[:512]